@@ -16,9 +16,35 @@ except Exception as e:
     print(f"⚠️ AI Engine not available: {e}")
     ai_engine = None
 
+from content_hash import save_upload  # same module as app.request_class
+
 # Register AI blueprint
 app.register_blueprint(ai_bp)
 
+# Landing-page suggestions: generated in the background, served from a rotating pool
+from utils.suggestion_pool import SuggestionPool
+
+def generate_landing_suggestions():
+    """One suggestion set for the landing page"""
+    if not (ai_engine and ai_engine.is_available()):
+        return None
+    result = ai_engine.generate(
+        prompt="Generate 3 creative video project ideas for a content creator",
+        system_prompt="Be concise and creative",
+        temperature=0.9,
+        max_tokens=300
+    )
+    return result.get('response') if result.get('success') else None
+
+suggestion_pool = SuggestionPool(generate_landing_suggestions,
+                                 size=int(os.environ.get('SUGGESTION_POOL_SIZE', 4)),
+                                 ttl_seconds=int(os.environ.get('SUGGESTION_TTL', 900))).start()
+
+# Server-side sessions in the shared state backend (Redis at REDIS_URL),
+# so any worker process can serve any request
+from utils.state_backend import StateSessionInterface
+app.session_interface = StateSessionInterface()
+
 # ============================================================================
 # AI-ENHANCED ROUTES
 # ============================================================================
@@ -85,13 +111,15 @@ def upload_video_enhanced():
     session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
     os.makedirs(session_dir, exist_ok=True)
     
-    # Save original file
+    # Save original file (hashed while it was uploaded)
     original_path = os.path.join(session_dir, filename)
-    file.save(original_path)
+    content = save_upload(file, original_path)
+    media_store.add_original(original_path, content['digest'], session_id)
     
     # Create proxy (from your existing logic)
     try:
-        proxy_info = proxy_manager.create_proxy(original_path, session_id)
+        proxy_info = proxy_manager.create_proxy(original_path, session_id, filename,
+                                                file_hash=content['digest'])
     except Exception as e:
         return jsonify({'error': f'Proxy creation failed: {str(e)}'}), 500
     
@@ -99,7 +127,7 @@ def upload_video_enhanced():
     ai_analysis = None
     if ai_engine and ai_engine.is_available():
         try:
-            description = f"Uploaded video: {filename}, Size: {os.path.getsize(original_path)} bytes"
+            description = f"Uploaded video: {filename}, Size: {content['size']} bytes"
             metadata = {
                 "filename": filename,
                 "extension": file_ext,
@@ -115,6 +143,7 @@ def upload_video_enhanced():
         'success': True,
         'session_id': session_id,
         'filename': filename,
+        'digest': content['digest'],
         'proxy_url': proxy_info.get('proxy_url', ''),
         'proxy_info': proxy_info,
         'ai_analysis': ai_analysis if ai_analysis and ai_analysis.get('success') else None
@@ -131,24 +160,18 @@ def index():
     """Main landing page with AI status"""
     ai_status = ai_engine.get_ai_status() if ai_engine else {"status": "unavailable"}
     
-    # Get some AI-generated suggestions if available
-    ai_suggestions = None
-    if ai_engine and ai_engine.is_available():
-        try:
-            result = ai_engine.generate(
-                prompt="Generate 3 creative video project ideas for a content creator",
-                system_prompt="Be concise and creative",
-                max_tokens=300
-            )
-            if result.get('success'):
-                ai_suggestions = result.get('response')
-        except:
-            pass
+    # Precomputed suggestions - never waits on the model
+    ai_suggestions = suggestion_pool.get()
     
     return render_template('landing.html', 
                          ai_status=ai_status,
                          ai_suggestions=ai_suggestions)
 
+@app.route('/api/ai/suggestions/stats')
+def suggestion_stats():
+    """Hit/miss metrics for the landing-page suggestion pool"""
+    return jsonify(suggestion_pool.stats())
+
 # ============================================================================
 # AI TOOLS PAGE
 # ============================================================================
@@ -6,6 +6,8 @@ Adds AI capabilities to existing platform
 
 from flask import Blueprint, request, jsonify, render_template
 from utils.ai_integration import ai_engine
+from utils.rate_limiter import (get_rate_limiter, client_identity, limit_headers, limited_body,
+                                request_cost, parse_max_tokens)
 
 ai_bp = Blueprint('ai', __name__, url_prefix='/ai')
 
@@ -34,13 +36,26 @@ def generate_text():
     if not data or 'prompt' not in data:
         return jsonify({"error": "No prompt provided"}), 400
     
+    try:
+        max_tokens = parse_max_tokens(data.get('max_tokens'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Charged the prompt plus max_tokens up front; the unused part is refunded below
+    identity = client_identity(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    limiter = get_rate_limiter()
+    decision = limiter.hit('generate', identity, request_cost(data['prompt'], max_tokens))
+    if not decision.allowed:
+        return jsonify(limited_body(decision)), 429, limit_headers(decision)
+    
     result = ai_engine.generate(
         model=data.get('model', 'mistral'),
         prompt=data['prompt'],
         system_prompt=data.get('system_prompt'),
         temperature=float(data.get('temperature', 0.7)),
-        max_tokens=int(data.get('max_tokens', 1000))
+        max_tokens=max_tokens
     )
+    limiter.settle('generate', identity, decision, data['prompt'], result.get('response', ''))
     
     return jsonify(result)
 
@@ -0,0 +1,95 @@
+# agent_pool.py
+"""
+Shared agent registry for the chat servers:
+- One prototype per agent type (config, prompts, loaded memory)
+- Per-session clones that only copy conversation state
+- One pooled HTTP session shared by every clone
+"""
+
+import copy
+import threading
+from datetime import datetime
+from typing import Dict, Any, Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from agents.creative_store import LazyCollection
+except ImportError:
+    from creative_store import LazyCollection
+
+
+class AgentPool:
+    """Builds each agent type once and hands out lightweight per-session clones"""
+
+    def __init__(self, factories: Dict[str, Optional[Callable[[], Any]]], pool_size: int = 32):
+        self.factories = factories
+        self.prototypes: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+        # Keep-alive connections to LM Studio shared across all sessions
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+    def is_available(self, agent_type: str) -> bool:
+        return self.factories.get(agent_type) is not None
+
+    def prototype(self, agent_type: str):
+        """Shared, fully-initialized agent for this type (built on first use)"""
+        proto = self.prototypes.get(agent_type)
+        if proto is not None:
+            return proto
+
+        with self._lock:
+            if agent_type not in self.prototypes:
+                factory = self.factories.get(agent_type)
+                if factory is None:
+                    raise KeyError(f"Agent type not available: {agent_type}")
+                proto = factory()
+                if hasattr(proto, "http"):
+                    proto.http = self.http
+                if hasattr(proto, "_get_retriever"):
+                    # Build the creative retrieval index once for every session
+                    proto._get_retriever()
+                self.prototypes[agent_type] = proto
+                print(f"✓ Agent prototype ready: {agent_type}")
+            return self.prototypes[agent_type]
+
+    def acquire(self, agent_type: str):
+        """New per-session agent sharing everything but conversation state"""
+        proto = self.prototype(agent_type)
+        agent = copy.copy(proto)
+
+        for name, value in vars(proto).items():
+            if name == "conversation":
+                # Fresh history seeded with the prototype's system messages
+                setattr(agent, name, [dict(m) for m in value])
+            elif isinstance(value, LazyCollection):
+                # Backed by the shared transactional store
+                continue
+            elif isinstance(value, (list, dict, set)):
+                # Copy-on-write: containers are shallow-copied, entries shared
+                setattr(agent, name, copy.copy(value))
+
+        if hasattr(agent, "conversation_id"):
+            agent.conversation_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{id(agent):x}_enhanced"
+        if hasattr(agent, "longform"):
+            agent.longform = None
+        return agent
+
+    def reload(self, agent_type: Optional[str] = None):
+        """Drop cached prototypes so the next acquire rebuilds them"""
+        with self._lock:
+            if agent_type:
+                self.prototypes.pop(agent_type, None)
+            else:
+                self.prototypes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "prototypes": sorted(self.prototypes),
+            "available": {k: v is not None for k, v in self.factories.items()}
+        }
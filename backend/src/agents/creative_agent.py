@@ -4,31 +4,53 @@ Creative Writing Agent with:
 - Story development
 - Character creation  
 - World building
-- Persistent memory
+- Persistent memory (incremental SQLite store)
 - Writing assistance
 """
 
 import json
 import os
-import pickle
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import requests
 import time
 
+try:
+    from agents.creative_store import CreativeStore, LazyCollection
+    from agents.creative_retrieval import CreativeRetriever, lmstudio_embedder
+    from agents.creative_longform import LongFormPipeline
+    from agents.streaming import stream_agent
+except ImportError:
+    from creative_store import CreativeStore, LazyCollection
+    from creative_retrieval import CreativeRetriever, lmstudio_embedder
+    from creative_longform import LongFormPipeline
+    from streaming import stream_agent
+
 class CreativeAgent:
     """Enhanced agent for creative writing and storytelling"""
     
     def __init__(self, 
                  model: str = "deepseek-coder-6.7b-coder",
                  api_base: str = "http://localhost:1234/v1",
-                 memory_dir: str = "data/memory"):
+                 memory_dir: str = "data/memory",
+                 context_token_budget: int = 600,
+                 embedding_model: Optional[str] = None,
+                 backends: Optional[List[str]] = None):
         self.model = model
         self.api_base = api_base
+        # Extra OpenAI-compatible servers used to parallelize long-form sections
+        self.backends = backends or [api_base]
+        self.longform = None
+        self.http = requests.Session()
         self.memory_dir = Path(memory_dir)
         self.memory_dir.mkdir(parents=True, exist_ok=True)
         
+        # Retrieval settings (index is built on first use)
+        self.context_token_budget = context_token_budget
+        self.embedding_model = embedding_model
+        self.retriever = None
+        
         # ADD THESE LINES:
         # Creative system prompt
         self.system_prompt = """You are Deepseek Creative - CREATIVE mode. Provide:
@@ -70,13 +92,14 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
 """
         
         # Initialize creative state
+        self.store = None
         self.current_project = None
         self.characters = {}
         self.worlds = {}
         self.stories = {}
         self.inspirations = []
         
-        # Load existing creative works
+        # Open the creative store (entities are loaded lazily)
         self.load_creative_memory()
         
         # Conversation with creative context
@@ -86,7 +109,10 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
         self._add_creative_context()
     
     def _add_creative_context(self):
-        """Add loaded creative works to context"""
+        """Add current project and library size to context.
+        
+        Individual works are retrieved per message by _retrieve_creative_context.
+        """
         context_parts = []
         
         if self.current_project:
@@ -94,15 +120,10 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
             context_parts.append(f"Genre: {self.current_project.get('genre', 'Not specified')}")
             context_parts.append(f"Status: {self.current_project.get('status', 'In progress')}")
         
-        if self.characters:
-            context_parts.append(f"\nCHARACTERS IN MEMORY: {len(self.characters)}")
-            for name, char in list(self.characters.items())[:3]:  # Show first 3
-                context_parts.append(f"- {name}: {char.get('role', 'Character')}")
-        
-        if self.stories:
-            context_parts.append(f"\nSTORIES IN MEMORY: {len(self.stories)}")
-            for title, story in list(self.stories.items())[:2]:
-                context_parts.append(f"- {title}: {story.get('genre', 'Story')}")
+        counts = [(label, len(works)) for label, works in
+                  (("characters", self.characters), ("worlds", self.worlds), ("stories", self.stories))]
+        if any(count for _, count in counts):
+            context_parts.append("IN MEMORY: " + ", ".join(f"{count} {label}" for label, count in counts))
         
         if context_parts:
             context_message = "\n".join(context_parts)
@@ -111,8 +132,38 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
                 "content": f"CURRENT CREATIVE CONTEXT:\n{context_message}\n\nUse this context in your responses."
             })
     
-    def send_message(self, user_message: str, creative_mode: str = "general") -> str:
-        """Send message with creative enhancements"""
+    def _get_retriever(self) -> CreativeRetriever:
+        """Build the retrieval index from the store on first use"""
+        if self.retriever is None:
+            embedder = None
+            if self.embedding_model:
+                embedder = lmstudio_embedder(self.api_base, self.embedding_model)
+            self.retriever = CreativeRetriever(embedder=embedder)
+            for kind in ("characters", "worlds", "stories"):
+                self.retriever.add_many([
+                    (kind, key, entity) for key, entity in self.store.iter_items(kind)
+                ])
+        return self.retriever
+    
+    def _index_creative_work(self, kind: str, key: str, entity: Dict[str, Any]):
+        """Keep the retrieval index in step with new or updated works"""
+        if self.retriever is not None:
+            self.retriever.add(kind, key, entity)
+    
+    def _retrieve_creative_context(self, query: str) -> Optional[str]:
+        """Most relevant creative works for this message, within the token budget"""
+        if not any([self.characters, self.worlds, self.stories]):
+            return None
+        
+        hits = self._get_retriever().select_context(query, self.context_token_budget)
+        if not hits:
+            return None
+        
+        snippets = "\n".join(hit["snippet"] for hit in hits)
+        return f"RELEVANT CREATIVE WORKS FROM MEMORY:\n{snippets}\n\nStay consistent with these."
+    
+    def _build_payload(self, user_message: str, creative_mode: str) -> Dict[str, Any]:
+        """Append the user turn and build the request with creative context"""
         
         # Add creative mode context
         mode_context = {
@@ -123,16 +174,19 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
             "general": "Creative writing assistance across all areas."
         }.get(creative_mode, "Creative writing assistance.")
         
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": message}
-        ]
+        enhanced_message = f"[Creative focus: {mode_context}]\n\n{user_message}"
         
         self.conversation.append({"role": "user", "content": enhanced_message})
         
+        # Retrieved context is sent with this request only, not kept in history
+        messages = list(self.conversation)
+        creative_context = self._retrieve_creative_context(user_message)
+        if creative_context:
+            messages.insert(-1, {"role": "system", "content": creative_context})
+        
         payload = {
             "model": self.model,
-            "messages": self.conversation,
+            "messages": messages,
             "temperature": 0.85,  # Higher for creativity
             "max_tokens": 3000,   # Longer for detailed creative work
             "top_p": 0.9,
@@ -140,9 +194,14 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
             "presence_penalty": 0.1,
             "stream": False
         }
+        return payload
+    
+    def send_message(self, user_message: str, creative_mode: str = "general") -> str:
+        """Send message with creative enhancements"""
+        payload = self._build_payload(user_message, creative_mode)
         
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.api_base}/chat/completions",
                 json=payload,
                 timeout=180  # Longer timeout for creative work
@@ -163,6 +222,20 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
         except Exception as e:
             return f"Error: {str(e)}"
     
+    def prepare_stream(self, user_message: str, creative_mode: str = "general"):
+        """Append the user turn and build the streaming request (payload, timeout)"""
+        payload = self._build_payload(user_message, creative_mode)
+        payload.pop("stream", None)
+        return payload, 180
+    
+    def finish_stream(self, user_message: str, reply: str):
+        """Pick up creative elements from the completed reply"""
+        self._extract_and_save_creative_elements(user_message, reply)
+    
+    def stream_message(self, user_message: str, creative_mode: str = "general", cancel_event=None):
+        """Send message and yield reply tokens as they arrive"""
+        yield from stream_agent(self, user_message, cancel_event, creative_mode=creative_mode)
+    
     def _extract_and_save_creative_elements(self, user_input: str, response: str):
         """Extract potential creative elements from response for saving"""
         # This is a simple extraction - could be enhanced with more sophisticated parsing
@@ -202,6 +275,7 @@ YOU ARE: Imaginative, detailed, consistent, and passionate about storytelling.
         }
         
         self.characters[name] = character
+        self._index_creative_work("characters", name, character)
         self.save_creative_memory()
         
         # Generate character profile using AI
@@ -223,7 +297,8 @@ Make this character feel real and compelling."""
         
         return self.send_message(prompt, creative_mode="character")
     
-    def develop_story(self, title: str, genre: str, premise: str) -> str:
+    def develop_story(self, title: str, genre: str, premise: str,
+                      long_form: bool = False, on_progress=None, run_id: Optional[str] = None) -> str:
         """Develop a story outline"""
         story_id = f"story_{len(self.stories) + 1:04d}"
         
@@ -241,9 +316,19 @@ Make this character feel real and compelling."""
         }
         
         self.stories[title] = story
+        self._index_creative_work("stories", title, story)
         self.current_project = story
         self.save_creative_memory()
         
+        if long_form:
+            brief = f"Genre: {genre}\nPremise: {premise}"
+            text, sections = self.long_form("story", title, brief, on_progress, run_id)
+            if sections:
+                story["outline"] = sections
+                story["updated"] = datetime.now().isoformat()
+                self.stories.save(title, story)
+            return text
+        
         # Generate story development using AI
         prompt = f"""Develop a story titled "{title}" in the {genre} genre.
 
@@ -265,7 +350,8 @@ Make this an engaging, well-structured story framework."""
         
         return self.send_message(prompt, creative_mode="story")
     
-    def build_world(self, name: str, genre: str, description: str) -> str:
+    def build_world(self, name: str, genre: str, description: str,
+                    long_form: bool = False, on_progress=None, run_id: Optional[str] = None) -> str:
         """Build a fictional world"""
         world_id = f"world_{len(self.worlds) + 1:04d}"
         
@@ -285,8 +371,13 @@ Make this an engaging, well-structured story framework."""
         }
         
         self.worlds[name] = world
+        self._index_creative_work("worlds", name, world)
         self.save_creative_memory()
         
+        if long_form:
+            brief = f"Genre: {genre}\nDescription: {description}"
+            return self.long_form("world", name, brief, on_progress, run_id)[0]
+        
         # Generate world-building using AI
         prompt = f"""Build a fictional world called "{name}" in the {genre} genre.
 
@@ -342,7 +433,8 @@ Be constructive, specific, and helpful."""
         
         return self.send_message(prompt, creative_mode="writing")
     
-    def generate_scene(self, context: str, scene_type: str) -> str:
+    def generate_scene(self, context: str, scene_type: str,
+                       long_form: bool = False, on_progress=None, run_id: Optional[str] = None) -> str:
         """Generate a scene based on context"""
         
         scene_types = {
@@ -356,6 +448,10 @@ Be constructive, specific, and helpful."""
         
         scene_desc = scene_types.get(scene_type, "A well-written scene")
         
+        if long_form:
+            brief = f"{scene_desc}.\nContext: {context}"
+            return self.long_form("scene", f"{scene_type.title()} Scene", brief, on_progress, run_id)[0]
+        
         prompt = f"""Generate a {scene_type} scene.
 
 Context: {context}
@@ -375,55 +471,96 @@ Write the full scene with proper formatting."""
         
         return self.send_message(prompt, creative_mode="writing")
     
+    # ===== LONG-FORM GENERATION =====
+    
+    def long_form(self, kind: str, title: str, brief: str,
+                  on_progress=None, run_id: Optional[str] = None):
+        """Outline, generate sections concurrently, then stitch.
+        
+        Returns (text, {section title: text}). Pass the run_id reported in the
+        'start' event to resume an interrupted or cancelled run.
+        """
+        sections = {}
+        text = ""
+        for event in self.stream_long_form(kind, title, brief, run_id):
+            if on_progress:
+                on_progress(event)
+            if event["event"] == "done":
+                text = event["text"]
+                sections = event["sections"]
+            elif event["event"] in ("cancelled", "incomplete"):
+                text = (f"Long-form run {event['run_id']} stopped after "
+                        f"{event['completed']}/{event.get('total', '?')} sections. "
+                        f"Resume with run_id='{event['run_id']}'.")
+        
+        if text and sections:
+            self.conversation.append({"role": "user", "content": f"[Long-form {kind}] {title}"})
+            self.conversation.append({"role": "assistant", "content": text})
+        return text, sections
+    
+    def stream_long_form(self, kind: str, title: str, brief: str, run_id: Optional[str] = None):
+        """Yield long-form progress events (see LongFormPipeline.run)"""
+        self.longform = LongFormPipeline(
+            model=self.model,
+            backends=self.backends,
+            system_prompt=self.creative_prompt,
+            checkpoint_dir=str(self.memory_dir / "longform"),
+            http=self.http
+        )
+        yield from self.longform.run(kind, title, brief, run_id=run_id)
+    
+    def cancel_long_form(self):
+        """Cancel the running long-form generation, if any"""
+        if self.longform:
+            self.longform.cancel()
+    
     # ===== MEMORY MANAGEMENT =====
     
     def save_creative_memory(self):
-        """Save all creative works to disk"""
-        creative_data = {
-            "characters": self.characters,
-            "worlds": self.worlds,
-            "stories": self.stories,
-            "current_project": self.current_project,
-            "inspirations": self.inspirations,
-            "last_saved": datetime.now().isoformat()
-        }
-        
-        # Save as JSON
-        json_file = self.memory_dir / "creative_works.json"
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(creative_data, f, indent=2, ensure_ascii=False)
-        
-        # Also save as pickle for Python objects
-        pickle_file = self.memory_dir / "creative_works.pkl"
-        with open(pickle_file, 'wb') as f:
-            pickle.dump(creative_data, f)
+        """Persist project state - entities are already upserted individually"""
+        self.store.set_meta("current_project", self.current_project)
+        self.store.set_meta("inspirations", self.inspirations)
+        self.store.set_meta("last_saved", datetime.now().isoformat())
         
         print(f"✓ Creative memory saved: {len(self.characters)} characters, "
               f"{len(self.worlds)} worlds, {len(self.stories)} stories")
     
     def load_creative_memory(self):
-        """Load creative works from disk"""
+        """Open the creative store; entities are fetched on demand"""
+        db_file = self.memory_dir / "creative_works.db"
         json_file = self.memory_dir / "creative_works.json"
         
-        if json_file.exists():
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    creative_data = json.load(f)
-                
-                self.characters = creative_data.get("characters", {})
-                self.worlds = creative_data.get("worlds", {})
-                self.stories = creative_data.get("stories", {})
-                self.current_project = creative_data.get("current_project")
-                self.inspirations = creative_data.get("inspirations", [])
-                
-                print(f"✓ Creative memory loaded: {len(self.characters)} characters, "
-                      f"{len(self.worlds)} worlds, {len(self.stories)} stories")
-                      
-            except Exception as e:
-                print(f"Note: Could not load creative memory: {e}")
+        try:
+            self.store = CreativeStore(db_file)
+            
+            # One-time migration from the old full-file JSON format
+            if self.store.is_empty() and json_file.exists():
+                self.store.import_json(json_file)
+                print(f"✓ Migrated {json_file.name} into {db_file.name}")
+        except Exception as e:
+            print(f"Note: Could not load creative memory: {e}")
+            self.store = CreativeStore(":memory:")
+        
+        self.characters = LazyCollection(self.store, "characters")
+        self.worlds = LazyCollection(self.store, "worlds")
+        self.stories = LazyCollection(self.store, "stories")
+        self.current_project = self.store.get_meta("current_project")
+        self.inspirations = self.store.get_meta("inspirations", []) or []
+        
+        if any([len(self.characters), len(self.worlds), len(self.stories)]):
+            print(f"✓ Creative memory loaded: {len(self.characters)} characters, "
+                  f"{len(self.worlds)} worlds, {len(self.stories)} stories")
         else:
             print("Note: No existing creative memory found. Starting fresh.")
     
+    def export_creative_memory(self, fmt: str = "json") -> str:
+        """Export all creative works as a single JSON or pickle file"""
+        if fmt == "pickle":
+            path = self.store.export_pickle(self.memory_dir / "creative_works.pkl")
+        else:
+            path = self.store.export_json(self.memory_dir / "creative_works.json")
+        return f"✓ Creative memory exported to {path}"
+    
     def list_creative_works(self) -> str:
         """List all creative works in memory"""
         if not any([self.characters, self.worlds, self.stories]):
@@ -462,7 +599,7 @@ Write the full scene with proper formatting."""
     
     def clear_history(self):
         """Clear conversation but keep creative prompt and memory"""
-         self.conversation = [{"role": "system", "content": self.system_prompt}]
+        self.conversation = [{"role": "system", "content": self.system_prompt}]
         self._add_creative_context()
     
     def interactive_creative_session(self):
@@ -481,6 +618,7 @@ Write the full scene with proper formatting."""
         print("  'scene <type> <context>' - Generate scene")
         print("  'list' - List all creative works")
         print("  'save' - Save creative memory")
+        print("  'export json|pickle' - Export creative memory to a single file")
         print("  'clear' - Clear conversation")
         print("  'exit' - Exit")
         print("="*70)
@@ -508,6 +646,11 @@ Write the full scene with proper formatting."""
                     self.save_creative_memory()
                     continue
                 
+                elif user_input.lower().startswith('export'):
+                    fmt = user_input[6:].strip().lower() or "json"
+                    print(self.export_creative_memory(fmt))
+                    continue
+                
                 # Parse special creative commands
                 response = self._parse_creative_command(user_input)
                 if response:
@@ -0,0 +1,272 @@
+# creative_longform.py
+"""
+Long-form generation pipeline for CreativeAgent:
+- Outline first, then independent sections (acts, regions, beats)
+- Sections generated concurrently across available backends
+- Progress events streamed to the caller
+- Cancellable, and resumable from completed sections via checkpoints
+"""
+
+import json
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Callable, Iterator
+
+import requests
+
+try:
+    from agents.streaming import iter_chat_completion, StreamCancelled
+except ImportError:
+    from streaming import iter_chat_completion, StreamCancelled
+
+# Section shape per kind of long-form work, used when the outline can't be parsed
+DEFAULT_SECTIONS = {
+    "story": [
+        {"title": "Logline and Themes", "brief": "One-sentence logline, central conflict and themes."},
+        {"title": "Act I - Setup", "brief": "Opening, inciting incident and first plot point."},
+        {"title": "Act II - Confrontation", "brief": "Rising action, midpoint and escalating stakes."},
+        {"title": "Act III - Resolution", "brief": "Climax, resolution and possible endings."},
+        {"title": "Character Arcs", "brief": "Roster of characters and how each one changes."},
+        {"title": "Settings and Style", "brief": "Key locations and writing style for the genre."},
+    ],
+    "world": [
+        {"title": "Geography", "brief": "Physical geography, climate and major regions."},
+        {"title": "Cultures and Politics", "brief": "Societies, governments and conflicts."},
+        {"title": "Magic or Technology", "brief": "How magic or technology works and its limits."},
+        {"title": "History", "brief": "Major historical events and eras."},
+        {"title": "Economy and Belief", "brief": "Trade, religion and daily life."},
+        {"title": "Creatures and Locations", "brief": "Unique races, creatures and notable places."},
+    ],
+    "scene": [
+        {"title": "Opening Beat", "brief": "Establish setting, mood and the characters present."},
+        {"title": "Rising Beat", "brief": "Build tension through action and dialogue."},
+        {"title": "Turning Beat", "brief": "The emotional or plot turn of the scene."},
+        {"title": "Closing Beat", "brief": "Land the scene arc and hand off to what comes next."},
+    ],
+}
+
+
+class LongFormCancelled(Exception):
+    """Raised inside workers when a run is cancelled"""
+
+
+class LongFormPipeline:
+    """Outline -> concurrent sections -> stitched document"""
+
+    def __init__(self,
+                 model: str,
+                 backends: List[str],
+                 system_prompt: str,
+                 checkpoint_dir: str = "data/memory/longform",
+                 section_tokens: int = 900,
+                 temperature: float = 0.85,
+                 timeout: int = 120,
+                 http=None):
+        self.model = model
+        self.backends = backends
+        self.system_prompt = system_prompt
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.section_tokens = section_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+        self.http = http or requests
+        self._cancel = threading.Event()
+
+    # ===== CONTROL =====
+
+    def cancel(self):
+        """Stop the run; completed sections stay checkpointed"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    # ===== CHECKPOINTS =====
+
+    def _checkpoint_path(self, run_id: str) -> Path:
+        return self.checkpoint_dir / f"{run_id}.json"
+
+    def load_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        path = self._checkpoint_path(run_id)
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def _save_checkpoint(self, state: Dict[str, Any]):
+        state["updated"] = datetime.now().isoformat()
+        path = self._checkpoint_path(state["run_id"])
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        tmp.replace(path)
+
+    # ===== GENERATION =====
+
+    def _complete(self, api_base: str, prompt: str, max_tokens: int) -> str:
+        """Streamed chat completion that stops early when cancelled"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": self.temperature,
+            "max_tokens": max_tokens
+        }
+        try:
+            return "".join(iter_chat_completion(self.http, f"{api_base}/chat/completions",
+                                                payload, self.timeout, self._cancel))
+        except StreamCancelled:
+            raise LongFormCancelled()
+        except RuntimeError as e:
+            raise RuntimeError(f"{e} from {api_base}")
+
+    def _outline(self, kind: str, title: str, brief: str) -> List[Dict[str, str]]:
+        prompt = f"""Plan a {kind} called "{title}".
+
+{brief}
+
+Return ONLY a JSON array of 4-8 sections that can be written independently, like:
+[{{"title": "Section title", "brief": "What this section must cover"}}]"""
+        try:
+            text = self._complete(self.backends[0], prompt, max_tokens=600)
+            match = re.search(r"\[.*\]", text, re.DOTALL)
+            sections = json.loads(match.group(0)) if match else []
+            sections = [
+                {"title": str(s["title"]), "brief": str(s.get("brief", ""))}
+                for s in sections if isinstance(s, dict) and s.get("title")
+            ]
+            if sections:
+                return sections
+        except LongFormCancelled:
+            raise
+        except Exception as e:
+            print(f"Note: Outline generation failed, using default sections: {e}")
+        return [dict(s) for s in DEFAULT_SECTIONS.get(kind, DEFAULT_SECTIONS["story"])]
+
+    def _section(self, state: Dict[str, Any], index: int, api_base: str) -> str:
+        section = state["outline"][index]
+        others = "\n".join(f"- {s['title']}" for i, s in enumerate(state["outline"]) if i != index)
+        prompt = f"""You are writing one section of the {state['kind']} "{state['title']}".
+
+Overall brief: {state['brief']}
+
+Other sections (written separately, do not repeat them):
+{others}
+
+Write ONLY this section:
+## {section['title']}
+{section['brief']}
+
+Use markdown and stay consistent with the overall brief."""
+        return self._complete(api_base, prompt, self.section_tokens)
+
+    def run(self, kind: str, title: str, brief: str,
+            run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Generate a long-form work, yielding progress events.
+
+        Events: start, outline, section, error, cancelled, incomplete, done.
+        Passing the run_id of an interrupted run resumes from its completed
+        sections.
+        """
+        self._cancel.clear()
+        state = self.load_checkpoint(run_id) if run_id else None
+        if state is None:
+            state = {
+                "run_id": run_id or uuid.uuid4().hex[:12],
+                "kind": kind,
+                "title": title,
+                "brief": brief,
+                "outline": None,
+                "sections": {},
+                "created": datetime.now().isoformat()
+            }
+        yield {"event": "start", "run_id": state["run_id"], "resumed": bool(state["sections"])}
+
+        try:
+            if not state["outline"]:
+                state["outline"] = self._outline(kind, title, brief)
+                self._save_checkpoint(state)
+        except LongFormCancelled:
+            yield {"event": "cancelled", "run_id": state["run_id"], "completed": 0}
+            return
+        total = len(state["outline"])
+        yield {"event": "outline", "sections": [s["title"] for s in state["outline"]]}
+
+        pending = [i for i in range(total) if str(i) not in state["sections"]]
+        lock = threading.Lock()
+        workers = max(1, min(len(self.backends) * 2, len(pending)))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._section, state, i, self.backends[n % len(self.backends)]): i
+                for n, i in enumerate(pending)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    text = future.result()
+                except LongFormCancelled:
+                    continue
+                except Exception as e:
+                    yield {"event": "error", "section": index, "error": str(e)}
+                    continue
+                with lock:
+                    state["sections"][str(index)] = text
+                    self._save_checkpoint(state)
+                yield {
+                    "event": "section",
+                    "section": index,
+                    "title": state["outline"][index]["title"],
+                    "text": text,
+                    "completed": len(state["sections"]),
+                    "total": total
+                }
+                if self.cancelled:
+                    for f in futures:
+                        f.cancel()
+
+        if self.cancelled or len(state["sections"]) < total:
+            yield {
+                "event": "cancelled" if self.cancelled else "incomplete",
+                "run_id": state["run_id"],
+                "completed": len(state["sections"]),
+                "total": total
+            }
+            return
+
+        yield {
+            "event": "done",
+            "run_id": state["run_id"],
+            "text": self.stitch(state),
+            "sections": {s["title"]: state["sections"][str(i)] for i, s in enumerate(state["outline"])}
+        }
+
+    @staticmethod
+    def stitch(state: Dict[str, Any]) -> str:
+        parts = [f"# {state['title']}"]
+        for i, section in enumerate(state["outline"]):
+            text = state["sections"].get(str(i), "").strip()
+            if not text.lstrip("#").strip().lower().startswith(section["title"].lower()):
+                text = f"## {section['title']}\n\n{text}"
+            parts.append(text)
+        return "\n\n".join(parts)
+
+
+def run_to_completion(pipeline: LongFormPipeline, kind: str, title: str, brief: str,
+                      run_id: Optional[str] = None,
+                      on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Drive a pipeline run, forwarding events; returns the final event"""
+    last: Dict[str, Any] = {}
+    for event in pipeline.run(kind, title, brief, run_id=run_id):
+        if on_progress:
+            on_progress(event)
+        last = event
+    return last
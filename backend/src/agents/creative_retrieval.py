@@ -0,0 +1,255 @@
+# creative_retrieval.py
+"""
+Retrieval index over characters, worlds and stories:
+- Incremental BM25 postings scored with vectorized NumPy ops
+- Optional dense embeddings (e.g. LM Studio /v1/embeddings) blended in
+- Token-budgeted context selection for each message
+"""
+
+import re
+import threading
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+import numpy as np
+import requests
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he",
+    "her", "his", "in", "is", "it", "its", "me", "my", "of", "on", "or", "she",
+    "that", "the", "their", "them", "they", "this", "to", "was", "we", "were",
+    "will", "with", "you", "your", "i", "can", "about", "please", "help", "write",
+}
+
+KIND_LABELS = {"characters": "Character", "worlds": "World", "stories": "Story"}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def entity_text(entity: Dict[str, Any]) -> str:
+    """Flatten an entity's fields into searchable text"""
+    parts = []
+    for key, value in entity.items():
+        if key in ("id", "created", "updated") or value in (None, "", [], {}):
+            continue
+        if isinstance(value, (dict, list)):
+            value = " ".join(str(v) for v in (value.values() if isinstance(value, dict) else value))
+        parts.append(f"{key}: {value}")
+    return "\n".join(parts)
+
+
+def entity_snippet(kind: str, key: str, entity: Dict[str, Any], max_chars: int = 400) -> str:
+    """Compact one-entry summary injected into the prompt"""
+    label = KIND_LABELS.get(kind, kind)
+    fields = []
+    for field in ("role", "genre", "premise", "description", "personality", "background"):
+        if entity.get(field):
+            fields.append(f"{field}: {entity[field]}")
+    for field, value in entity.items():
+        if field not in ("id", "name", "title", "created", "updated", "role", "genre", "premise",
+                         "description", "personality", "background") and isinstance(value, str) and value:
+            fields.append(f"{field}: {value}")
+    body = "; ".join(fields)
+    if len(body) > max_chars:
+        body = body[:max_chars].rsplit(" ", 1)[0] + "..."
+    return f"- {label} {key}: {body}" if body else f"- {label} {key}"
+
+
+def lmstudio_embedder(api_base: str, model: str, timeout: int = 30) -> Callable[[List[str]], np.ndarray]:
+    """Embedding function backed by an OpenAI-compatible /embeddings endpoint"""
+    def embed(texts: List[str]) -> np.ndarray:
+        response = requests.post(
+            f"{api_base}/embeddings",
+            json={"model": model, "input": texts},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda d: d["index"])
+        return np.asarray([d["embedding"] for d in data], dtype=np.float32)
+    return embed
+
+
+class CreativeRetriever:
+    """Incremental BM25 (+ optional embedding) index over creative works"""
+
+    def __init__(self, embedder: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 k1: float = 1.5, b: float = 0.75, embedding_weight: float = 0.5):
+        self.embedder = embedder
+        self.k1 = k1
+        self.b = b
+        self.embedding_weight = embedding_weight
+
+        self.doc_keys: List[Tuple[str, str]] = []           # (kind, key) per doc index
+        self.doc_snippets: List[str] = []
+        self.doc_index: Dict[Tuple[str, str], int] = {}     # live doc per (kind, key)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+
+        # term -> [doc ids, term frequencies]; arrays are materialized on demand
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._posting_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self.embeddings: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.doc_index)
+
+    # ===== INDEXING =====
+
+    def add(self, kind: str, key: str, entity: Dict[str, Any]):
+        """Index a new entity, or re-index an updated one"""
+        self.add_many([(kind, key, entity)])
+
+    def add_many(self, items: List[Tuple[str, str, Dict[str, Any]]]):
+        if not items:
+            return
+        with self._lock:
+            self._add_many(items)
+
+    def _add_many(self, items: List[Tuple[str, str, Dict[str, Any]]]):
+
+        texts, lengths, replaced = [], [], []
+        for kind, key, entity in items:
+            old = self.doc_index.get((kind, key))
+            if old is not None:
+                replaced.append(old)
+
+            doc_id = len(self.doc_keys)
+            text = f"{key}\n{entity_text(entity)}"
+            tokens = tokenize(text)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                docs, freqs = self.postings.setdefault(term, ([], []))
+                docs.append(doc_id)
+                freqs.append(tf)
+                self._posting_arrays.pop(term, None)
+
+            self.doc_keys.append((kind, key))
+            self.doc_snippets.append(entity_snippet(kind, key, entity))
+            self.doc_index[(kind, key)] = doc_id
+            texts.append(text)
+            lengths.append(len(tokens))
+
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray(lengths, dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+        self.alive[replaced] = False
+
+        if self.embedder is not None:
+            try:
+                vectors = np.asarray(self.embedder(texts), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+                self.embeddings = vectors if self.embeddings is None else np.vstack([self.embeddings, vectors])
+            except Exception as e:
+                print(f"Note: Embeddings disabled ({e})")
+                self.embedder = None
+                self.embeddings = None
+
+        # Drop dead documents once they dominate the index
+        if (~self.alive).sum() > max(64, len(self.alive) // 2):
+            self._compact()
+
+    def _compact(self):
+        live = [i for i in range(len(self.doc_keys)) if self.alive[i]]
+        remap = {old: new for new, old in enumerate(live)}
+        for term in list(self.postings):
+            docs, freqs = self.postings[term]
+            kept = [(remap[d], f) for d, f in zip(docs, freqs) if d in remap]
+            if kept:
+                self.postings[term] = ([d for d, _ in kept], [f for _, f in kept])
+            else:
+                del self.postings[term]
+        self._posting_arrays.clear()
+        self.doc_keys = [self.doc_keys[i] for i in live]
+        self.doc_snippets = [self.doc_snippets[i] for i in live]
+        self.doc_index = {dk: i for i, dk in enumerate(self.doc_keys)}
+        self.doc_lengths = self.doc_lengths[live]
+        self.alive = np.ones(len(live), dtype=bool)
+        if self.embeddings is not None:
+            self.embeddings = self.embeddings[live]
+
+    def _posting(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if term not in self.postings:
+            return None
+        if term not in self._posting_arrays:
+            docs, freqs = self.postings[term]
+            self._posting_arrays[term] = (np.asarray(docs, dtype=np.int64),
+                                          np.asarray(freqs, dtype=np.float32))
+        return self._posting_arrays[term]
+
+    # ===== SCORING =====
+
+    def score(self, query: str) -> np.ndarray:
+        with self._lock:
+            return self._score(query)
+
+    def _score(self, query: str) -> np.ndarray:
+        n_docs = len(self.doc_keys)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if n_docs == 0:
+            return scores
+
+        n_live = max(1, int(self.alive.sum()))
+        avgdl = float(self.doc_lengths[self.alive].mean()) if self.alive.any() else 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(avgdl, 1e-6))
+
+        for term in set(tokenize(query)):
+            posting = self._posting(term)
+            if posting is None:
+                continue
+            docs, tf = posting
+            df = int(self.alive[docs].sum())
+            if df == 0:
+                continue
+            idf = np.log(1 + (n_live - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+
+        if self.embedder is not None and self.embeddings is not None:
+            try:
+                q = np.asarray(self.embedder([query]), dtype=np.float32)[0]
+                q /= np.linalg.norm(q) + 1e-8
+                dense = self.embeddings @ q
+                if scores.max() > 0:
+                    scores = scores / scores.max()
+                scores = (1 - self.embedding_weight) * scores + self.embedding_weight * np.clip(dense, 0, None)
+            except Exception as e:
+                print(f"Note: Embedding query failed ({e})")
+
+        scores[~self.alive] = 0
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        # One lock for scoring and lookup: a concurrent add/_compact renumbers docs
+        with self._lock:
+            scores = self._score(query)
+            if not len(scores):
+                return []
+            limit = min(limit, len(scores))
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {"kind": self.doc_keys[i][0], "key": self.doc_keys[i][1],
+                 "score": float(scores[i]), "snippet": self.doc_snippets[i]}
+                for i in top if scores[i] > 0
+            ]
+
+    def select_context(self, query: str, token_budget: int = 600) -> List[Dict[str, Any]]:
+        """Most relevant entries whose snippets fit within the token budget"""
+        selected, used = [], 0
+        for hit in self.search(query, limit=50):
+            cost = estimate_tokens(hit["snippet"])
+            if used + cost > token_budget:
+                continue
+            selected.append(hit)
+            used += cost
+        return selected
@@ -0,0 +1,309 @@
+# creative_store.py
+"""
+Incremental store for CreativeAgent creative memory:
+- SQLite in WAL mode, one row per character/world/story
+- Per-entity upserts instead of full-file rewrites
+- Indexes on name, genre and type
+- Lazy mapping views for the agent, with a bounded LRU cache
+- Explicit JSON / pickle export
+"""
+
+import json
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator
+
+# Entity kinds kept in the works table, matching the CreativeAgent attributes
+KINDS = ("characters", "worlds", "stories")
+
+
+class CreativeStore:
+    """Transactional SQLite store for characters, worlds and stories"""
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        with self._lock:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS works (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    id TEXT,
+                    name TEXT,
+                    genre TEXT,
+                    type TEXT,
+                    created TEXT,
+                    updated TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (kind, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_works_name ON works (name);
+                CREATE INDEX IF NOT EXISTS idx_works_genre ON works (kind, genre);
+                CREATE INDEX IF NOT EXISTS idx_works_type ON works (kind, type);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            ''')
+            self.conn.commit()
+
+    # ===== ENTITIES =====
+
+    def upsert(self, kind: str, key: str, entity: Dict[str, Any]):
+        """Insert or replace a single entity"""
+        row = (
+            kind, key,
+            entity.get("id"),
+            entity.get("name") or entity.get("title") or key,
+            entity.get("genre"),
+            entity.get("type") or entity.get("role"),
+            entity.get("created"),
+            entity.get("updated"),
+            json.dumps(entity, ensure_ascii=False),
+        )
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO works (kind, key, id, name, genre, type, created, updated, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    id = excluded.id, name = excluded.name, genre = excluded.genre,
+                    type = excluded.type, created = excluded.created,
+                    updated = excluded.updated, data = excluded.data
+            ''', row)
+            self.conn.commit()
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM works WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, kind: str, key: str) -> bool:
+        with self._lock:
+            cursor = self.conn.execute(
+                "DELETE FROM works WHERE kind = ? AND key = ?", (kind, key)
+            )
+            self.conn.commit()
+        return cursor.rowcount > 0
+
+    def keys(self, kind: str) -> List[str]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key FROM works WHERE kind = ? ORDER BY rowid", (kind,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def count(self, kind: str) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM works WHERE kind = ?", (kind,)
+            ).fetchone()[0]
+
+    def contains(self, kind: str, key: str) -> bool:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM works WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone() is not None
+
+    def summaries(self, kind: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Indexed columns only - no JSON parsing of the entity bodies"""
+        sql = "SELECT key, id, name, genre, type, created FROM works WHERE kind = ? ORDER BY rowid"
+        params: tuple = (kind,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (kind, limit)
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            {"key": r[0], "id": r[1], "name": r[2], "genre": r[3], "type": r[4], "created": r[5]}
+            for r in rows
+        ]
+
+    def find(self, kind: str, name: Optional[str] = None, genre: Optional[str] = None,
+             type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Look up entities through the name/genre/type indexes"""
+        clauses, params = ["kind = ?"], [kind]
+        for column, value in (("name", name), ("genre", genre), ("type", type)):
+            if value is not None:
+                clauses.append(f"{column} = ? COLLATE NOCASE")
+                params.append(value)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT data FROM works WHERE {' AND '.join(clauses)} ORDER BY rowid", params
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def iter_items(self, kind: str, batch_size: int = 200) -> Iterator[tuple]:
+        """Stream (key, entity) pairs in insertion order without loading everything"""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, key, data FROM works WHERE kind = ? AND rowid > ? "
+                    "ORDER BY rowid LIMIT ?", (kind, last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, key, data in rows:
+                last_rowid = rowid
+                yield key, json.loads(data)
+
+    # ===== META (current project, inspirations) =====
+
+    def set_meta(self, key: str, value: Any):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+            self.conn.commit()
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            works = self.conn.execute("SELECT 1 FROM works LIMIT 1").fetchone()
+            meta = self.conn.execute("SELECT 1 FROM meta LIMIT 1").fetchone()
+        return works is None and meta is None
+
+    # ===== IMPORT / EXPORT =====
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {kind: dict(self.iter_items(kind)) for kind in KINDS}
+        data["current_project"] = self.get_meta("current_project")
+        data["inspirations"] = self.get_meta("inspirations", [])
+        data["last_saved"] = datetime.now().isoformat()
+        return data
+
+    def import_dict(self, creative_data: Dict[str, Any]):
+        """Bulk-load a creative_works.json style dict in one transaction"""
+        with self._lock:
+            for kind in KINDS:
+                for key, entity in (creative_data.get(kind) or {}).items():
+                    self.conn.execute('''
+                        INSERT OR REPLACE INTO works
+                            (kind, key, id, name, genre, type, created, updated, data)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (
+                        kind, key, entity.get("id"),
+                        entity.get("name") or entity.get("title") or key,
+                        entity.get("genre"), entity.get("type") or entity.get("role"),
+                        entity.get("created"), entity.get("updated"),
+                        json.dumps(entity, ensure_ascii=False),
+                    ))
+            for key in ("current_project", "inspirations"):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (key, json.dumps(creative_data.get(key), ensure_ascii=False))
+                )
+            self.conn.commit()
+
+    def import_json(self, json_file: Path):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            self.import_dict(json.load(f))
+
+    def export_json(self, json_file: Path) -> Path:
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        return json_file
+
+    def export_pickle(self, pickle_file: Path) -> Path:
+        with open(pickle_file, 'wb') as f:
+            pickle.dump(self.to_dict(), f)
+        return pickle_file
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class LazyCollection(MutableMapping):
+    """Dict-like view over one kind of entity, loaded on first access.
+
+    Only the max_cached most recently used entities stay in memory; iterating
+    streams from the store without filling the cache.
+    """
+
+    def __init__(self, store: CreativeStore, kind: str, max_cached: int = 256):
+        self.store = store
+        self.kind = kind
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()  # shared by every pooled session
+
+    def _remember(self, key: str, entity: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._cache[key] = entity
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return entity
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            entity = self._cache.get(key)
+            if entity is not None:
+                self._cache.move_to_end(key)
+                return entity
+        entity = self.store.get(self.kind, key)
+        if entity is None:
+            raise KeyError(key)
+        return self._remember(key, entity)
+
+    def __setitem__(self, key: str, entity: Dict[str, Any]):
+        self.store.upsert(self.kind, key, entity)
+        self._remember(key, entity)
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            self._cache.pop(key, None)
+        if not self.store.delete(self.kind, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._cache or self.store.contains(self.kind, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.kind))
+
+    def __len__(self) -> int:
+        return self.store.count(self.kind)
+
+    def items(self):
+        """Stream entities in batches; cached ones are reused, the rest aren't kept"""
+        for key, entity in self.store.iter_items(self.kind):
+            cached = self._cache.get(key)
+            yield key, entity if cached is None else cached
+
+    def values(self):
+        for _, entity in self.items():
+            yield entity
+
+    def save(self, key: str, entity: Optional[Dict[str, Any]] = None):
+        """Persist in-place edits; pass the edited entity, as it may have left the cache"""
+        if entity is None:
+            entity = self[key]
+        self.store.upsert(self.kind, key, entity)
+        self._remember(key, entity)
+
+    def summaries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.store.summaries(self.kind, limit)
+
+    def find(self, **filters) -> List[Dict[str, Any]]:
+        return self.store.find(self.kind, **filters)
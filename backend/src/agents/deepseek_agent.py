@@ -3,11 +3,17 @@ import requests
 import json
 import time
 
+try:
+    from agents.streaming import stream_agent
+except ImportError:
+    from streaming import stream_agent
+
 class DeepseekAgent:
     def __init__(self, model="deepseek-coder-6.7b-coder", api_base="http://localhost:1234/v1"):
         self.model = model
         self.api_base = api_base
         self.conversation = []
+        self.http = requests.Session()
         
 # Basic system prompt
         self.system_prompt = """You are Deepseek Coder - BASIC mode. Provide:
@@ -15,7 +21,8 @@ class DeepseekAgent:
 - Direct code solutions
 - Minimal explanation unless asked
 - Focus on correctness and efficiency
-Example style: "Here's the function: [code]. It works by: [brief explanation].""""
+Example style: "Here's the function: [code]. It works by: [brief explanation]."
+"""
         
         # Add system prompt to conversation
         self.conversation.append({
@@ -44,7 +51,7 @@ Example style: "Here's the function: [code]. It works by: [brief explanation].""
         }
         
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.api_base}/chat/completions",
                 json=payload,
                 timeout=120
@@ -61,6 +68,25 @@ Example style: "Here's the function: [code]. It works by: [brief explanation].""
         except Exception as e:
             return f"Error: {str(e)}"
     
+    def prepare_stream(self, user_message):
+        """Append the user turn and build the streaming request (payload, timeout)"""
+        self.conversation.append({"role": "user", "content": user_message})
+        
+        payload = {
+            "model": self.model,
+            "messages": self.conversation,
+            "temperature": 0.7,
+            "max_tokens": 2000
+        }
+        return payload, 120
+    
+    def finish_stream(self, user_message, reply):
+        """Nothing to record beyond the conversation itself"""
+    
+    def stream_message(self, user_message, cancel_event=None):
+        """Send message and yield reply tokens as they arrive"""
+        yield from stream_agent(self, user_message, cancel_event)
+    
     def clear_history(self):
         """Clear conversation but keep system prompt"""
         self.conversation = [self.conversation[0]] if self.conversation else []
@@ -124,4 +150,4 @@ Example style: "Here's the function: [code]. It works by: [brief explanation].""
 
 if __name__ == "__main__":
     agent = DeepseekAgent()
-    agent.interactive_chat()
+    agent.interactive_chat()
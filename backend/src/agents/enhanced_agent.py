@@ -4,6 +4,11 @@ import json
 import time
 from datetime import datetime
 
+try:
+    from agents.streaming import stream_agent
+except ImportError:
+    from streaming import stream_agent
+
 class EnhancedDeepseekAgent:
     """Enhanced agent with more confident and capable responses"""
     
@@ -11,6 +16,7 @@ class EnhancedDeepseekAgent:
         self.model = model
         self.api_base = api_base
         self.conversation = []
+        self.http = requests.Session()
         
         # ENHANCED system prompt - more confident and capable
         self.conversation.append({
@@ -57,7 +63,7 @@ STARTING NOW: You will respond as an EXPERT ready to tackle ANY challenge."""
         }
         
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.api_base}/chat/completions",
                 json=payload,
                 timeout=180  # Longer timeout for complex responses
@@ -78,6 +84,29 @@ STARTING NOW: You will respond as an EXPERT ready to tackle ANY challenge."""
         except Exception as e:
             return f"Error: {str(e)}"
     
+    def prepare_stream(self, user_message):
+        """Append the user turn and build the streaming request (payload, timeout)"""
+        self.conversation.append({"role": "user", "content": user_message})
+        
+        payload = {
+            "model": self.model,
+            "messages": self.conversation,
+            "temperature": 0.85,
+            "max_tokens": 2500,
+            "top_p": 0.9,
+            "frequency_penalty": 0.2,
+            "presence_penalty": 0.1
+        }
+        return payload, 180
+    
+    def finish_stream(self, user_message, reply):
+        """Log the completed turn"""
+        self._save_enhanced_turn(user_message, reply)
+    
+    def stream_message(self, user_message, cancel_event=None):
+        """Send message and yield reply tokens as they arrive"""
+        yield from stream_agent(self, user_message, cancel_event)
+    
     def _save_enhanced_turn(self, user_msg, assistant_msg):
         """Save enhanced conversation turns"""
         try:
@@ -240,4 +269,4 @@ STARTING NOW: You will respond as an EXPERT ready to tackle ANY challenge."""
 
 if __name__ == "__main__":
     agent = EnhancedDeepseekAgent()
-    agent.interactive_chat()
+    agent.interactive_chat()
@@ -0,0 +1,122 @@
+# streaming.py
+"""
+Token streaming for OpenAI-compatible /chat/completions (LM Studio)
+- Blocking iterators over a requests.Session (Flask routes, worker threads)
+- Async iterators over an httpx.AsyncClient (ASGI routes)
+"""
+
+import asyncio
+import json
+from typing import Dict, Any, AsyncIterator, Iterator, Optional
+
+
+class StreamCancelled(Exception):
+    """Raised when a stream is stopped through its cancel event"""
+
+
+def _parse_sse_line(line: str):
+    """Content delta from one SSE line; None to skip it, StopIteration at [DONE]"""
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        raise StopIteration
+    delta = json.loads(data)["choices"][0].get("delta", {})
+    return delta.get("content") or None
+
+
+def iter_chat_completion(http, url: str, payload: Dict[str, Any], timeout: int = 120,
+                         cancel_event=None) -> Iterator[str]:
+    """Yield content deltas from a streamed chat completion.
+
+    Closing the response when cancel_event is set drops the upstream
+    connection, which stops generation on the server.
+    """
+    payload = dict(payload, stream=True)
+    with http.post(url, json=payload, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        for line in response.iter_lines(decode_unicode=True):
+            if cancel_event is not None and cancel_event.is_set():
+                raise StreamCancelled()
+            try:
+                content = _parse_sse_line(line)
+            except StopIteration:
+                return
+            if content:
+                yield content
+
+
+def stream_reply(agent, payload: Dict[str, Any], timeout: int,
+                 cancel_event: Optional[Any] = None) -> Iterator[str]:
+    """Stream a reply for agent.conversation and record it when complete"""
+    parts = []
+    try:
+        for token in iter_chat_completion(agent.http, f"{agent.api_base}/chat/completions",
+                                          payload, timeout, cancel_event):
+            parts.append(token)
+            yield token
+    except StreamCancelled:
+        if parts:
+            agent.conversation.append({"role": "assistant", "content": "".join(parts)})
+        return
+    except Exception as e:
+        yield f"Error: {str(e)}"
+        return
+    agent.conversation.append({"role": "assistant", "content": "".join(parts)})
+
+
+def stream_agent(agent, user_message: str, cancel_event: Optional[Any] = None,
+                 **kwargs) -> Iterator[str]:
+    """Stream one turn through the agent's prepare_stream/finish_stream hooks"""
+    payload, timeout = agent.prepare_stream(user_message, **kwargs)
+    start = len(agent.conversation)
+    yield from stream_reply(agent, payload, timeout, cancel_event)
+    if len(agent.conversation) > start:
+        agent.finish_stream(user_message, agent.conversation[-1]["content"])
+
+
+async def aiter_chat_completion(client, url: str, payload: Dict[str, Any],
+                                timeout: int = 120) -> AsyncIterator[str]:
+    """Async version of iter_chat_completion for an httpx.AsyncClient.
+
+    Cancel the consuming task (e.g. on client disconnect) to close the
+    upstream connection.
+    """
+    payload = dict(payload, stream=True)
+    async with client.stream("POST", url, json=payload, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        async for line in response.aiter_lines():
+            try:
+                content = _parse_sse_line(line)
+            except StopIteration:
+                return
+            if content:
+                yield content
+
+
+async def astream_agent(agent, client, user_message: str, **kwargs) -> AsyncIterator[str]:
+    """Async stream_agent: the request is awaited, never holding a thread.
+
+    A cancelled stream keeps the partial reply in the conversation, like a
+    cancel_event does for the blocking version.
+    """
+    payload, timeout = agent.prepare_stream(user_message, **kwargs)
+    parts = []
+    try:
+        async for token in aiter_chat_completion(client, f"{agent.api_base}/chat/completions",
+                                                 payload, timeout):
+            parts.append(token)
+            yield token
+    except (asyncio.CancelledError, GeneratorExit):
+        if parts:
+            agent.conversation.append({"role": "assistant", "content": "".join(parts)})
+        raise
+    except Exception as e:
+        yield f"Error: {str(e)}"
+        return
+    reply = "".join(parts)
+    agent.conversation.append({"role": "assistant", "content": reply})
+    # Hooks may write files or call the embedder
+    await asyncio.to_thread(agent.finish_stream, user_message, reply)
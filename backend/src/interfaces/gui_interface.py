@@ -6,16 +6,42 @@ Location: C:\LM Studio\AI_Agent_Framework\src\interfaces\gui_interface.py
 import tkinter as tk
 from tkinter import scrolledtext, ttk, messagebox, filedialog
 import threading
+import queue
 import time
 import json
+from collections import deque
 from datetime import datetime
 import os
 
+try:
+    from interfaces.transcript import Transcript
+except ImportError:
+    from transcript import Transcript
+
+# Streamed tokens are drawn at most this often (~60 fps)
+FLUSH_INTERVAL_MS = 16
+
+# Messages kept in the chat widget; others reload from the transcript on scroll
+MAX_WIDGET_MESSAGES = 200
+SCROLLBACK_PAGE = 50
+
 class DeepseekGUI:
     def __init__(self, agent=None):
         """Initialize the GUI interface"""
         self.agent = agent
         
+        # Streaming state: worker thread -> token queue -> timed widget inserts
+        self.token_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.streaming = False
+        
+        # Conversation history: full log on disk, a bounded window in the widget
+        self.transcript = Transcript()
+        self.widget_lines = deque()  # line count of each message shown, oldest first
+        self.window_start = 0        # transcript index of the first message shown
+        self.window_end = 0          # transcript index after the last message shown
+        self.loading_page = False
+        
         # Create main window
         self.root = tk.Tk()
         self.root.title("Deepseek Agent - Enhanced GUI")
@@ -28,9 +54,6 @@ class DeepseekGUI:
         # Build the interface
         self.create_widgets()
         
-        # Conversation history
-        self.conversation_history = []
-        
     def setup_styles(self):
         """Configure ttk styles"""
         style = ttk.Style()
@@ -128,7 +151,13 @@ class DeepseekGUI:
             font=('Consolas', 10)
         )
         self.chat_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        self.chat_text.config(state=tk.DISABLED)
+        self.chat_text.config(state=tk.DISABLED, yscrollcommand=self.on_chat_scroll)
+        
+        # Tags for different message types
+        self.chat_text.tag_config('user', foreground='#4a90e2', font=('Helvetica', 10, 'bold'))
+        self.chat_text.tag_config('assistant', foreground='#50c878', font=('Helvetica', 10, 'bold'))
+        self.chat_text.tag_config('code', foreground='#f39c12', font=('Consolas', 9))
+        self.chat_text.tag_config('system', foreground='#9b59b6', font=('Helvetica', 9, 'italic'))
         
         # Right panel - Info
         info_frame = ttk.LabelFrame(main_frame, text="Information", padding="10")
@@ -169,47 +198,131 @@ class DeepseekGUI:
         self.input_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
         self.input_entry.bind('<Return>', self.send_message)
         
-        # Send button
-        ttk.Button(input_frame, text="Send", command=self.send_message).grid(row=0, column=1)
+        # Send / stop buttons
+        self.send_button = ttk.Button(input_frame, text="Send", command=self.send_message)
+        self.send_button.grid(row=0, column=1)
+        self.stop_button = ttk.Button(input_frame, text="⏹ Stop", command=self.stop_response,
+                                      state=tk.DISABLED)
+        self.stop_button.grid(row=0, column=2, padx=(5, 0))
         
         # Bind window close event
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
     def append_message(self, sender, message, is_code=False):
         """Add a message to the chat display"""
-        self.chat_text.config(state=tk.NORMAL)
+        entry = {
+            'timestamp': datetime.now().strftime("%H:%M:%S"),
+            'sender': sender,
+            'message': message,
+            'is_code': is_code
+        }
+        self.show_tail()
+        self.transcript.append(entry)
         
-        # Configure tags for different message types
-        self.chat_text.tag_config('user', foreground='#4a90e2', font=('Helvetica', 10, 'bold'))
-        self.chat_text.tag_config('assistant', foreground='#50c878', font=('Helvetica', 10, 'bold'))
-        self.chat_text.tag_config('code', foreground='#f39c12', font=('Consolas', 9))
-        self.chat_text.tag_config('system', foreground='#9b59b6', font=('Helvetica', 9, 'italic'))
+        self.chat_text.config(state=tk.NORMAL)
+        self.widget_lines.append(self.render_message(entry, tk.END))
+        self.window_end = len(self.transcript)
+        self.trim_window()
+        self.chat_text.see(tk.END)  # Scroll to bottom
+        self.chat_text.config(state=tk.DISABLED)
+    
+    def render_message(self, entry, index):
+        """Insert one message at index; returns the number of lines it takes"""
+        header = f"\n[{entry['timestamp']}] {entry['sender']}: "
+        if entry['is_code']:
+            body, body_tag = f"\n{entry['message']}\n", 'code'
+        else:
+            body, body_tag = f"{entry['message']}\n", ()
+        self.chat_text.insert(index, header, 'user' if entry['sender'] == 'You' else 'assistant',
+                              body, body_tag)
+        return (header + body).count('\n')
+    
+    def trim_window(self):
+        """Drop the oldest messages from the widget; they stay in the transcript.
+        Returns the number of lines removed."""
+        excess = len(self.widget_lines) - MAX_WIDGET_MESSAGES
+        if excess <= 0:
+            return 0
+        lines = sum(self.widget_lines.popleft() for _ in range(excess))
+        self.chat_text.delete('1.0', f"{lines + 1}.0")
+        self.window_start += excess
+        return lines
+    
+    def trim_bottom(self):
+        """Drop the newest messages from the widget after a scroll-back; they reload on scroll-down"""
+        excess = len(self.widget_lines) - MAX_WIDGET_MESSAGES
+        if excess <= 0 or self.streaming:
+            return  # a reply being streamed in sits below the counted messages
+        for _ in range(excess):
+            self.widget_lines.pop()
+        self.chat_text.delete(f"{sum(self.widget_lines) + 1}.0", tk.END)
+        self.window_end -= excess
+    
+    def show_tail(self):
+        """Bring back the newest messages if a scroll-back trimmed them from the widget"""
+        if self.window_end >= len(self.transcript):
+            return
+        self.window_end = len(self.transcript)
+        self.window_start = max(0, self.window_end - SCROLLBACK_PAGE)
+        self.chat_text.config(state=tk.NORMAL)
+        self.chat_text.delete('1.0', tk.END)
+        self.widget_lines.clear()
+        for entry in self.transcript.read(self.window_start, self.window_end):
+            self.widget_lines.append(self.render_message(entry, tk.END))
+        self.chat_text.config(state=tk.DISABLED)
+        self.chat_text.see(tk.END)
+    
+    def on_chat_scroll(self, first, last):
+        """Scrollbar update; reaching the top or bottom pulls in the next page"""
+        self.chat_text.vbar.set(first, last)
+        if self.loading_page:
+            return
+        if float(first) <= 0.0 and self.window_start > 0:
+            self.loading_page = True
+            self.root.after_idle(self.load_earlier)
+        elif float(last) >= 1.0 and self.window_end < len(self.transcript):
+            self.loading_page = True
+            self.root.after_idle(self.load_later)
+    
+    def load_earlier(self):
+        """Prepend the previous page of messages from the transcript"""
+        start = max(0, self.window_start - SCROLLBACK_PAGE)
+        entries = self.transcript.read(start, self.window_start)
         
-        # Insert message
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_text.insert(tk.END, f"\n[{timestamp}] {sender}: ", 
-                            'user' if sender == 'You' else 'assistant')
+        self.chat_text.config(state=tk.NORMAL)
+        counts = [self.render_message(entry, '1.0') for entry in reversed(entries)]
+        self.widget_lines.extendleft(counts)
+        self.window_start = start
+        self.trim_bottom()
+        self.chat_text.config(state=tk.DISABLED)
         
-        if is_code:
-            self.chat_text.insert(tk.END, f"\n{message}\n", 'code')
-        else:
-            self.chat_text.insert(tk.END, f"{message}\n")
+        # Keep the message that was at the top in place
+        self.chat_text.yview(f"{sum(counts) + 1}.0")
+        self.status_var.set(f"📜 Showing messages {start + 1}-{self.window_end}")
+        self.loading_page = False
+    
+    def load_later(self):
+        """Append the next page of messages (scrolling back down after a scroll-back)"""
+        end = min(len(self.transcript), self.window_end + SCROLLBACK_PAGE)
+        entries = self.transcript.read(self.window_end, end)
+        top = int(self.chat_text.index('@0,0').split('.')[0])
         
-        self.chat_text.see(tk.END)  # Scroll to bottom
+        self.chat_text.config(state=tk.NORMAL)
+        for entry in entries:
+            self.widget_lines.append(self.render_message(entry, tk.END))
+        self.window_end = end
+        removed = self.trim_window()
         self.chat_text.config(state=tk.DISABLED)
         
-        # Add to history
-        self.conversation_history.append({
-            'timestamp': timestamp,
-            'sender': sender,
-            'message': message,
-            'is_code': is_code
-        })
+        # Keep the message that was at the top in place
+        self.chat_text.yview(f"{max(1, top - removed)}.0")
+        self.status_var.set(f"📜 Showing messages {self.window_start + 1}-{end}")
+        self.loading_page = False
     
     def send_message(self, event=None):
         """Send message to agent"""
         message = self.input_var.get().strip()
-        if not message:
+        if not message or self.streaming:
             return
         
         # Clear input
@@ -227,7 +340,26 @@ class DeepseekGUI:
     def process_agent_response(self, message):
         """Process agent response in background thread"""
         try:
-            if self.agent:
+            if self.agent and hasattr(self.agent, 'stream_message'):
+                self.agent.model = self.model_var.get()
+                self.cancel_event.clear()
+                self.root.after(0, self.begin_stream)
+                
+                # Tokens only go on the queue here; the Tk thread draws them in batches
+                start_time = time.time()
+                error = None
+                try:
+                    for token in self.agent.stream_message(message, cancel_event=self.cancel_event):
+                        self.token_queue.put(token)
+                        if self.cancel_event.is_set():
+                            break
+                except Exception as e:
+                    # Shown by finish_stream once the entry is closed, not inside it
+                    error = str(e)
+                finally:
+                    self.token_queue.put(None)  # end of stream
+                    self.root.after(0, self.finish_stream, time.time() - start_time, error)
+            elif self.agent:
                 # Update agent settings if changed
                 self.agent.model = self.model_var.get()
                 # Note: temperature would need to be passed to agent
@@ -259,6 +391,89 @@ class DeepseekGUI:
         self.append_message('Assistant', f"({elapsed:.1f}s) {response}", is_code)
         self.status_var.set("🟢 Ready")
     
+    def begin_stream(self):
+        """Open an assistant entry and start the batched redraw loop"""
+        self.show_tail()
+        self.streaming = True
+        self.stream_parts = []
+        self.stream_started = datetime.now().strftime("%H:%M:%S")
+        self.stop_button.config(state=tk.NORMAL)
+        self.send_button.config(state=tk.DISABLED)
+        self.status_var.set("✍️ Streaming... (Stop to cancel)")
+        
+        self.chat_text.config(state=tk.NORMAL)
+        self.stream_header = f"\n[{self.stream_started}] Assistant: "
+        self.chat_text.insert(tk.END, self.stream_header, 'assistant')
+        self.chat_text.config(state=tk.DISABLED)
+        self.chat_text.see(tk.END)
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_tokens)
+    
+    def flush_tokens(self):
+        """Insert everything queued since the last frame as a single edit"""
+        batch = []
+        done = False
+        while True:
+            try:
+                token = self.token_queue.get_nowait()
+            except queue.Empty:
+                break
+            if token is None:
+                done = True
+                break
+            batch.append(token)
+        
+        if batch:
+            text = ''.join(batch)
+            self.stream_parts.append(text)
+            # Only follow the output if the user hasn't scrolled up to read
+            at_bottom = self.chat_text.yview()[1] >= 0.999
+            self.chat_text.config(state=tk.NORMAL)
+            self.chat_text.insert(tk.END, text)
+            self.chat_text.config(state=tk.DISABLED)
+            if at_bottom:
+                self.chat_text.see(tk.END)
+        
+        if not done:
+            self.root.after(FLUSH_INTERVAL_MS, self.flush_tokens)
+    
+    def finish_stream(self, elapsed, error=None):
+        """Close the streamed entry once the queue has been drained, then report any error"""
+        if not self.token_queue.empty():
+            self.root.after(FLUSH_INTERVAL_MS, self.finish_stream, elapsed, error)
+            return
+        
+        response = ''.join(self.stream_parts)
+        cancelled = self.cancel_event.is_set()
+        mark = ' [error]' if error else ' [stopped]' if cancelled else ''
+        footer = f"{mark} ({elapsed:.1f}s)\n"
+        at_bottom = self.chat_text.yview()[1] >= 0.999
+        self.chat_text.config(state=tk.NORMAL)
+        self.chat_text.insert(tk.END, footer, 'system')
+        self.widget_lines.append((self.stream_header + response + footer).count('\n'))
+        if at_bottom:
+            self.trim_window()
+        self.chat_text.config(state=tk.DISABLED)
+        
+        self.transcript.append({
+            'timestamp': self.stream_started,
+            'sender': 'Assistant',
+            'message': response,
+            'is_code': '```' in response or 'def ' in response or 'import ' in response
+        })
+        self.window_end = len(self.transcript)
+        self.streaming = False
+        self.stop_button.config(state=tk.DISABLED)
+        self.send_button.config(state=tk.NORMAL)
+        self.status_var.set("⏹ Stopped" if cancelled else "🟢 Ready")
+        if error:
+            self.display_error(error)
+    
+    def stop_response(self):
+        """Cancel the running generation (drops the upstream connection)"""
+        if self.streaming:
+            self.cancel_event.set()
+            self.status_var.set("⏳ Stopping...")
+    
     def display_error(self, error_msg):
         """Display error in GUI"""
         self.append_message('System', f"Error: {error_msg}")
@@ -269,7 +484,10 @@ class DeepseekGUI:
         self.chat_text.config(state=tk.NORMAL)
         self.chat_text.delete(1.0, tk.END)
         self.chat_text.config(state=tk.DISABLED)
-        self.conversation_history = []
+        self.transcript.clear()
+        self.widget_lines.clear()
+        self.window_start = 0
+        self.window_end = 0
         
         if self.agent:
             self.agent.clear_history()
@@ -278,7 +496,7 @@ class DeepseekGUI:
     
     def save_conversation(self):
         """Save conversation to file"""
-        if not self.conversation_history:
+        if not len(self.transcript):
             messagebox.showwarning("No Conversation", "No conversation to save.")
             return
         
@@ -290,15 +508,18 @@ class DeepseekGUI:
         
         if filename:
             try:
+                metadata = {
+                    'saved_at': datetime.now().isoformat(),
+                    'model': self.model_var.get(),
+                    'temperature': self.temp_var.get()
+                }
+                # Streamed from the transcript, one message at a time
                 with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump({
-                        'metadata': {
-                            'saved_at': datetime.now().isoformat(),
-                            'model': self.model_var.get(),
-                            'temperature': self.temp_var.get()
-                        },
-                        'conversation': self.conversation_history
-                    }, f, indent=2, ensure_ascii=False)
+                    f.write('{\n  "metadata": ' + json.dumps(metadata, ensure_ascii=False) +
+                            ',\n  "conversation": [')
+                    for i, entry in enumerate(self.transcript):
+                        f.write((',\n    ' if i else '\n    ') + json.dumps(entry, ensure_ascii=False))
+                    f.write('\n  ]\n}\n')
                 
                 messagebox.showinfo("Success", f"Conversation saved to:\n{filename}")
             except Exception as e:
@@ -362,6 +583,8 @@ Status: {"Connected" if self.agent else "Test Mode"}"""
     def on_closing(self):
         """Handle window closing"""
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
+            self.cancel_event.set()
+            self.transcript.close()
             self.root.destroy()
     
     def run(self):
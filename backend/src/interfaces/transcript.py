@@ -0,0 +1,68 @@
+"""
+On-disk transcript for the Tk chat GUI
+- Every message is appended to a JSONL log as it is shown
+- A byte-offset index gives random access for scroll-back pages
+- Exports stream from the log instead of an in-memory list
+"""
+
+import json
+import os
+from array import array
+from datetime import datetime
+
+
+class Transcript:
+    """Append-only message log with an offset index (used from the Tk thread)"""
+
+    def __init__(self, directory="data/conversations/gui", path=None):
+        if path is None:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        self.path = path
+        self.offsets = array('Q')  # byte offset of each message
+        self._file = open(self.path, 'a+b')
+        self._index()
+
+    def _index(self):
+        """Index an existing log, dropping a torn last line"""
+        self._file.seek(0)
+        position = 0
+        for line in self._file:
+            if not line.endswith(b'\n'):
+                self._file.truncate(position)
+                break
+            self.offsets.append(position)
+            position += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, entry):
+        """Write a message; returns its index"""
+        self._file.seek(0, os.SEEK_END)
+        self.offsets.append(self._file.tell())
+        self._file.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+        self._file.flush()
+        return len(self.offsets) - 1
+
+    def read(self, start, end):
+        """Messages [start, end) from disk"""
+        start, end = max(0, start), min(end, len(self.offsets))
+        if start >= end:
+            return []
+        self._file.seek(self.offsets[start])
+        return [json.loads(self._file.readline()) for _ in range(end - start)]
+
+    def __iter__(self):
+        """Every message, oldest first, without loading the whole log"""
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield json.loads(line)
+
+    def clear(self):
+        self._file.truncate(0)
+        self.offsets = array('Q')
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('CHAT_HISTORY_DIR', tempfile.mkdtemp(prefix='chat_history_test_'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils'))
+
+import pytest
+
+import chat_history
+from chat_history import ChatHistoryManager
+
+
+@pytest.fixture(autouse=True)
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_history, 'CHAT_HISTORY_DIR', str(tmp_path))
+    monkeypatch.setattr(chat_history, '_manifest', None)
+    ChatHistoryManager._log_counts.clear()
+    ChatHistoryManager._snapshot_counts.clear()
+    yield tmp_path
+    if chat_history._manifest is not None:
+        chat_history._manifest.conn.close()
+
+
+def message(text):
+    return {'role': 'user', 'content': text, 'timestamp': '2024-01-01T00:00:00'}
+
+
+def contents(chat_data):
+    return [m['content'] for m in chat_data['messages']]
+
+
+def test_two_sessions_survive_compaction():
+    # Two sessions on the same project/agent interleave their messages
+    seqs = [ChatHistoryManager.append_message('General', 'basic', message(text)) for text in ('A0', 'B0')]
+    ChatHistoryManager.compact('General', 'basic')
+    seqs += [ChatHistoryManager.append_message('General', 'basic', message(text)) for text in ('A1', 'B1')]
+
+    assert seqs == [0, 1, 2, 3]
+    assert contents(ChatHistoryManager.load_conversation('General', 'basic')) == ['A0', 'B0', 'A1', 'B1']
+    page = ChatHistoryManager.load_page('General', 'basic')
+    assert page['total'] == 4
+    assert contents(page) == ['A0', 'B0', 'A1', 'B1']
+
+
+def test_seq_continues_after_reload():
+    ChatHistoryManager.append_message('General', 'basic', message('A0'))
+    ChatHistoryManager.compact('General', 'basic')
+    ChatHistoryManager.append_message('General', 'basic', message('A1'))
+    # A fresh process knows nothing cached
+    ChatHistoryManager._log_counts.clear()
+    ChatHistoryManager._snapshot_counts.clear()
+
+    assert ChatHistoryManager.append_message('General', 'basic', message('B1')) == 2
+    assert contents(ChatHistoryManager.load_conversation('General', 'basic')) == ['A0', 'A1', 'B1']
+
+
+def test_page_keeps_unicode_line_separators():
+    text = 'one\u2028two\u2029three\x85four'
+    ChatHistoryManager.append_message('General', 'basic', message(text))
+    ChatHistoryManager.append_message('General', 'basic', message('after'))
+    ChatHistoryManager.compact('General', 'basic')
+
+    assert contents(ChatHistoryManager.load_page('General', 'basic')) == [text, 'after']
+    assert contents(ChatHistoryManager.load_conversation('General', 'basic')) == [text, 'after']
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('CHAT_HISTORY_DIR', tempfile.mkdtemp(prefix='chat_history_test_'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils'))
+
+import chat_search
+from chat_search import ChatSearchIndex
+
+
+def message(text):
+    return {'role': 'user', 'content': text, 'timestamp': '2024-01-01T00:00:00'}
+
+
+def seqs(result):
+    return sorted(r['seq'] for r in result['results'])
+
+
+def test_two_writers_share_one_index(tmp_path, monkeypatch):
+    # Two instances on one directory stand in for two worker processes
+    monkeypatch.setattr(chat_search, 'FLUSH_EVERY', 3)
+    monkeypatch.setattr(chat_search, 'MAX_SEGMENTS', 2)
+    first, second = ChatSearchIndex(str(tmp_path)), ChatSearchIndex(str(tmp_path))
+
+    for seq in range(20):
+        (first if seq % 3 else second).add('Demo', 'basic', seq, message(f"apple note{seq}"))
+    first.add('Demo', 'basic', 5, message('apple again'))  # same log id: not indexed twice
+
+    assert seqs(first.search('apple', limit=50)) == list(range(20))
+    assert seqs(second.search('apple', limit=50)) == list(range(20))
+    assert seqs(second.search('note7')) == [7]
+
+    first.flush()
+    second.flush()
+    reopened = ChatSearchIndex(str(tmp_path))
+    assert reopened.stats()['documents'] == 20
+    assert seqs(reopened.search('note13')) == [13]
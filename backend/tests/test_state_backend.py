@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils'))
+
+from state_backend import LocalRedis, SharedSessionState
+
+
+def expired(client, key):
+    client._expiry[key] = time.time() - 1
+
+
+def test_mutators_treat_expired_keys_as_absent():
+    client = LocalRedis()
+    client.hset('meta', mapping={'version': '7', 'stale': '1'})
+    client.rpush('messages', b'old')
+    expired(client, 'meta')
+    expired(client, 'messages')
+
+    assert client.hincrby('meta', 'version', 1) == 1
+    assert client.hgetall('meta') == {'version': 1}
+    assert client.rpush('messages', b'new') == 1
+    assert client.expire('missing', 10) is False
+
+
+def test_expired_keys_are_purged():
+    client = LocalRedis()
+    client.set('gone', b'x', ex=60)
+    client.set('kept', b'x')
+    expired(client, 'gone')
+
+    assert client.purge_expired() == 1
+    assert set(client._data) == {'kept'}
+
+
+def test_record_appends_conversation_entries():
+    state = SharedSessionState(LocalRedis())
+    system = {'role': 'system', 'content': 'hi'}
+    turn = [{'role': 'user', 'content': 'q'}, {'role': 'assistant', 'content': 'a'}]
+
+    state.record('s', {'agent_type': 'basic'}, conversation=[system], replace=True)
+    state.record('s', {'agent_type': 'basic'}, conversation=turn)
+    assert state.load('s')['conversation'] == [system] + turn
+
+    state.record('s', {'agent_type': 'basic'}, conversation=[system], replace=True)
+    assert state.load('s')['conversation'] == [system]
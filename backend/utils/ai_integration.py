@@ -55,22 +55,8 @@ class OllamaAI:
         Returns:
             Dict with response and metadata
         """
-        if model not in self.available_models:
-            model = self.available_models[0] if self.available_models else "mistral"
-        
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "num_predict": max_tokens,
-                **kwargs
-            }
-        }
-        
-        if system_prompt:
-            payload["system"] = system_prompt
+        payload = self.build_payload(model, prompt, system_prompt, temperature, max_tokens, **kwargs)
+        model = payload["model"]
         
         try:
             start_time = time.time()
@@ -82,19 +68,7 @@ class OllamaAI:
             end_time = time.time()
             
             if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "model": result.get("model", model),
-                    "response": result.get("response", ""),
-                    "total_duration": result.get("total_duration", 0),
-                    "thinking_time": end_time - start_time,
-                    "tokens": {
-                        "prompt": result.get("prompt_eval_count", 0),
-                        "response": result.get("eval_count", 0)
-                    },
-                    "raw": result
-                }
+                return self.format_result(response.json(), model, end_time - start_time)
             else:
                 return {
                     "success": False,
@@ -109,6 +83,51 @@ class OllamaAI:
                 "model": model
             }
     
+    def build_payload(
+        self,
+        model: str = "mistral",
+        prompt: str = "",
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        stream: bool = False,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Request body for /api/generate (shared by sync and async transports)"""
+        if model not in self.available_models:
+            model = self.available_models[0] if self.available_models else "mistral"
+        
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens,
+                **kwargs
+            }
+        }
+        
+        if system_prompt:
+            payload["system"] = system_prompt
+        return payload
+    
+    @staticmethod
+    def format_result(result: Dict[str, Any], model: str, thinking_time: float) -> Dict[str, Any]:
+        """Normalize an Ollama /api/generate response"""
+        return {
+            "success": True,
+            "model": result.get("model", model),
+            "response": result.get("response", ""),
+            "total_duration": result.get("total_duration", 0),
+            "thinking_time": thinking_time,
+            "tokens": {
+                "prompt": result.get("prompt_eval_count", 0),
+                "response": result.get("eval_count", 0)
+            },
+            "raw": result
+        }
+    
     def chat_with_context(
         self,
         model: str,
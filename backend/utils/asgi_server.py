@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# asgi_server.py
+"""
+ASGI entry point for the unified chat server:
+- /api/chat and /ai/generate served by async handlers that await the LLM
+  (httpx), so an idle or slow stream costs a coroutine, not a thread
+- ?stream / "stream": true returns Server-Sent Events; a client disconnect
+  cancels the upstream request
+- Every other route (including the sync Flask versions) runs unchanged
+  through the WSGI adapter
+
+Run:  python asgi_server.py               (uvicorn, WEB_WORKERS processes, default 1)
+  or: uvicorn asgi_server:app --workers 4
+  or: gunicorn asgi_server:app -k uvicorn.workers.UvicornWorker -w 4
+Several workers need REDIS_URL: sessions, chat jobs and rate-limit buckets
+are shared through it, otherwise each process only sees its own.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+import unified_server
+from unified_server import (app as flask_app, get_session, chat_jobs, reply_recorder,
+                            AGENT_CONFIGS, rate_limiter, chat_cost)
+from rate_limiter import client_identity, limit_headers, limited_body, request_cost, parse_max_tokens
+
+# routes/ lives next to utils/
+sys.path.insert(0, unified_server.BASE_DIR)
+from routes.ai_routes import ai_bp
+from utils.ai_integration import ai_engine
+
+if 'ai' not in flask_app.blueprints:
+    flask_app.register_blueprint(ai_bp)
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class Request:
+    """The bits of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1')
+                        for k, v in scope.get('headers', [])}
+        self.remote_addr = (scope.get('client') or (None,))[0]
+
+    def identity(self):
+        """Rate-limit bucket owner for this request"""
+        return client_identity(self.remote_addr, self.headers.get('x-forwarded-for'))
+
+    async def json(self):
+        body = b''
+        while True:
+            message = await self.receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        if not body:
+            return {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise BadRequest('Invalid JSON body')
+        if not isinstance(data, dict):
+            raise BadRequest('JSON body must be an object')
+        return data
+
+    async def respond(self, data, status=200, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        extra = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (headers or {}).items()]
+        await self.send({'type': 'http.response.start', 'status': status,
+                         'headers': [(b'content-type', b'application/json'),
+                                     (b'content-length', str(len(body)).encode())] + extra})
+        await self.send({'type': 'http.response.body', 'body': body})
+
+    async def stream(self, events):
+        """Send an async iterator of SSE strings; stop it if the client goes away"""
+        await self.send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+
+        async def pump():
+            async for event in events:
+                await self.send({'type': 'http.response.body', 'body': event.encode('utf-8'),
+                                 'more_body': True})
+
+        async def disconnected():
+            while (await self.receive())['type'] != 'http.disconnect':
+                pass
+
+        pump_task = asyncio.ensure_future(pump())
+        watch_task = asyncio.ensure_future(disconnected())
+        done, pending = await asyncio.wait({pump_task, watch_task},
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pump_task in done:
+            if pump_task.exception():
+                print(f"Stream error: {pump_task.exception()}")
+            await self.send({'type': 'http.response.body', 'body': b''})
+        else:
+            print("🔌 Client disconnected, upstream stream cancelled")
+
+
+class BadRequest(Exception):
+    """Malformed request; answered with 400 and the message"""
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+_turn_locks = weakref.WeakKeyDictionary()  # session -> asyncio.Lock
+
+
+@asynccontextmanager
+async def session_turn(session):
+    """Hold a session for one agent turn.
+
+    Async requests queue on an asyncio.Lock; the session's threading.Lock
+    is then taken as well, to exclude the sync routes and chat jobs.
+    """
+    turn = _turn_locks.setdefault(session, asyncio.Lock())
+    async with turn:
+        if not session.lock.acquire(blocking=False):
+            # A sync route or job holds it: wait in a worker thread
+            waiter = asyncio.ensure_future(asyncio.to_thread(session.lock.acquire))
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                waiter.add_done_callback(lambda _: session.lock.release())
+                raise
+        try:
+            yield
+        finally:
+            session.lock.release()
+
+
+class AsgiApp:
+    """Async routes first, the Flask app for everything else"""
+
+    def __init__(self, wsgi_app):
+        self.routes = {}
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.client = None
+
+    def route(self, path, methods=('POST',)):
+        def register(handler):
+            for method in methods:
+                self.routes[(method, path)] = handler
+            return handler
+        return register
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        handler = self.routes.get((scope.get('method'), scope.get('path')))
+        if scope['type'] != 'http' or handler is None:
+            await self.fallback(scope, receive, send)
+            return
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=int(os.environ.get('LLM_MAX_CONNECTIONS', 100))))
+        request = Request(scope, receive, send)
+        try:
+            await handler(request)
+        except BadRequest as e:
+            await request.respond({'error': str(e), 'success': False}, 400)
+        except Exception as e:
+            print(f"ASGI handler error: {e}")
+            await request.respond({'error': str(e), 'success': False}, 500)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    await self.client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsgiApp(flask_app)
+
+
+# ===== CHAT =====
+
+async def chat_tokens(session, message):
+    """Reply tokens for a session: awaited stream for real agents, simulation otherwise"""
+    agent = session.agent_instance
+    if agent is not None and hasattr(agent, 'prepare_stream'):
+        from agents.streaming import astream_agent
+        async for token in astream_agent(agent, app.client, message):
+            yield token
+    else:
+        yield await asyncio.to_thread(session.get_response, message)
+
+
+@app.route('/api/chat')
+@app.route('/api/chat/stream')
+async def chat(request):
+    """Async /api/chat; JSON by default, SSE with stream=true or on /api/chat/stream"""
+    data = await request.json()
+    agent_type = data.get('agent_type', 'basic')
+    message = data.get('message', '')
+    if not isinstance(message, str):
+        raise BadRequest('message must be a string')
+    message = message.strip()
+    if not message:
+        await request.respond({'error': 'Message cannot be empty'}, 400)
+        return
+
+    decision = rate_limiter.hit('chat', request.identity(), chat_cost(agent_type, message))
+    if not decision.allowed:
+        await request.respond(limited_body(decision), 429, limit_headers(decision))
+        return
+
+    session = await asyncio.to_thread(get_session, data.get('session_id'), agent_type)
+    await asyncio.to_thread(session.add_message, 'user', message)
+
+    if data.get('async') or request.args.get('async'):
+        job = chat_jobs.submit(session, message,
+                               on_complete=reply_recorder(request.identity(), decision, message))
+        await request.respond({
+            'job_id': job.job_id,
+            'status': job.status,
+            'session_id': session.session_id,
+            'agent_type': agent_type,
+            'status_url': f"/api/chat/jobs/{job.job_id}",
+            'stream_url': f"/api/chat/jobs/{job.job_id}/stream",
+            'success': True
+        }, 202)
+        return
+
+    def summary(response, elapsed):
+        return {
+            'response': response,
+            'session_id': session.session_id,
+            'agent_type': agent_type,
+            'agent_name': AGENT_CONFIGS.get(agent_type, {}).get('name', 'AI Assistant'),
+            'response_time': round(elapsed, 2),
+            'using_real_agent': session.agent_instance is not None,
+            'timestamp': datetime.now().isoformat(),
+            'success': True
+        }
+
+    async def run(on_token=None):
+        """One turn under the session lock; records whatever was produced"""
+        start_time = time.time()
+        parts = []
+        try:
+            async with session_turn(session):
+                async for token in chat_tokens(session, message):
+                    parts.append(token)
+                    if on_token:
+                        yield on_token(token)
+        finally:
+            if parts:
+                await asyncio.shield(asyncio.to_thread(session.add_message, 'assistant', ''.join(parts)))
+            rate_limiter.settle('chat', request.identity(), decision, message, ''.join(parts))
+        yield summary(''.join(parts), time.time() - start_time)
+
+    streaming = request.scope['path'].endswith('/stream') or data.get('stream') \
+        or request.args.get('stream')
+    if not streaming:
+        async for result in run():
+            await request.respond(result)
+        return
+
+    async def events():
+        async for item in run(on_token=lambda token: sse('token', {'text': token})):
+            yield item if isinstance(item, str) else sse('done', item)
+
+    await request.stream(events())
+
+
+# ===== OLLAMA =====
+
+@app.route('/ai/generate')
+@app.route('/ai/generate/stream')
+async def generate(request):
+    """Async /ai/generate; NDJSON from Ollama relayed as SSE when streaming"""
+    data = await request.json()
+    if not data or 'prompt' not in data:
+        await request.respond({"error": "No prompt provided"}, 400)
+        return
+
+    try:
+        max_tokens = parse_max_tokens(data.get('max_tokens'))
+    except ValueError as e:
+        raise BadRequest(str(e))
+    try:
+        temperature = float(data.get('temperature', 0.7))
+    except (TypeError, ValueError):
+        raise BadRequest('temperature must be a number')
+
+    decision = rate_limiter.hit('generate', request.identity(), request_cost(data['prompt'], max_tokens))
+    if not decision.allowed:
+        await request.respond(limited_body(decision), 429, limit_headers(decision))
+        return
+
+    streaming = request.scope['path'].endswith('/stream') or bool(data.get('stream'))
+    payload = ai_engine.build_payload(
+        model=data.get('model', 'mistral'),
+        prompt=data['prompt'],
+        system_prompt=data.get('system_prompt'),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=streaming
+    )
+    url = f"{ai_engine.base_url}/api/generate"
+
+    if not streaming:
+        start_time = time.time()
+        try:
+            response = await app.client.post(url, json=payload, timeout=60)
+        except Exception as e:
+            rate_limiter.settle('generate', request.identity(), decision, data['prompt'], '')
+            await request.respond({"success": False, "error": str(e), "model": payload["model"]})
+            return
+        if response.status_code == 200:
+            result = ai_engine.format_result(response.json(), payload["model"], time.time() - start_time)
+        else:
+            result = {"success": False, "error": f"HTTP {response.status_code}",
+                      "details": response.text}
+        rate_limiter.settle('generate', request.identity(), decision, data['prompt'], result.get('response', ''))
+        await request.respond(result)
+        return
+
+    async def events():
+        parts = []
+        try:
+            async with app.client.stream("POST", url, json=payload, timeout=120) as response:
+                if response.status_code != 200:
+                    yield sse('error', {'error': f"HTTP {response.status_code}"})
+                    return
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('response'):
+                        parts.append(chunk['response'])
+                        yield sse('token', {'text': chunk['response']})
+                    if chunk.get('done'):
+                        yield sse('done', {'model': chunk.get('model', payload['model']),
+                                           'tokens': {'prompt': chunk.get('prompt_eval_count', 0),
+                                                      'response': chunk.get('eval_count', 0)}})
+                        return
+        except httpx.HTTPError as e:
+            yield sse('error', {'error': str(e)})
+        finally:
+            rate_limiter.settle('generate', request.identity(), decision, data['prompt'], ''.join(parts))
+
+    await request.stream(events())
+
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get('PORT', 5000))
+    workers = max(1, int(os.environ.get('WEB_WORKERS', 1)))
+    print(f"🚀 ASGI server on http://0.0.0.0:{port} ({workers} worker{'s' if workers > 1 else ''})")
+    if workers > 1 and not os.environ.get('REDIS_URL'):
+        print("⚠️ WEB_WORKERS > 1 without REDIS_URL: sessions and chat jobs won't be shared between workers")
+    uvicorn.run('asgi_server:app', host='0.0.0.0', port=port, workers=workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                timeout_keep_alive=int(os.environ.get('KEEP_ALIVE', 75)))
@@ -0,0 +1,468 @@
+# chat_history.py
+"""
+Persistent chat history with project folders:
+- Append-only per-conversation log (one JSON record per message)
+- Periodic background compaction into the <agent>_agent.json snapshot
+- Crash-safe recovery: snapshot + replay of the log tail
+- Cursor-paginated reads backed by a byte-offset index of the snapshot
+- SQLite manifest of projects/chats so listings never open history files
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from persistence import atomic_open, read_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+# backend/chat_history by default
+CHAT_HISTORY_DIR = os.environ.get(
+    'CHAT_HISTORY_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_history')
+)
+os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+
+# Compact a conversation's log into its snapshot after this many records
+COMPACT_EVERY = 200
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-compact')
+_pending_compactions = set()
+
+
+class _PathLock:
+    """Re-entrant lock for one conversation: a thread lock plus an flock on
+    <path>.lock, so web workers in other processes are serialized too"""
+
+    def __init__(self, path):
+        self.lock_path = path + '.lock'
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+
+def _lock_for(path):
+    with _file_locks_guard:
+        return _file_locks.setdefault(path, _PathLock(path))
+
+
+def _safe_project_name(project_name):
+    """Sanitize project name for filesystem"""
+    safe_name = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return safe_name or "General"
+
+
+class ChatManifest:
+    """Per-chat metadata (last_updated, message_count), updated on every save"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(CHAT_HISTORY_DIR, 'manifest.db')
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chats (
+                project TEXT NOT NULL,
+                agent_type TEXT NOT NULL,
+                last_updated TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (project, agent_type)
+            )
+        ''')
+        self.conn.commit()
+
+    def record(self, project_name, agent_type, last_updated, message_count):
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO chats (project, agent_type, last_updated, message_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(project, agent_type) DO UPDATE SET
+                    last_updated = excluded.last_updated,
+                    message_count = MAX(chats.message_count, excluded.message_count)
+            ''', (_safe_project_name(project_name), agent_type, last_updated, message_count))
+            self.conn.commit()
+
+    def projects(self):
+        with self._lock:
+            rows = self.conn.execute('SELECT DISTINCT project FROM chats ORDER BY project').fetchall()
+        return [row[0] for row in rows]
+
+    def chats(self, project_name):
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT agent_type, last_updated, message_count FROM chats WHERE project = ? ORDER BY agent_type',
+                (_safe_project_name(project_name),)
+            ).fetchall()
+        return [{'agent': a, 'last_updated': u, 'message_count': n} for a, u, n in rows]
+
+    def is_empty(self):
+        with self._lock:
+            return self.conn.execute('SELECT 1 FROM chats LIMIT 1').fetchone() is None
+
+    def rebuild(self):
+        """One-time scan of the Projects folder (pre-manifest history)"""
+        projects_dir = os.path.join(CHAT_HISTORY_DIR, 'Projects')
+        if not os.path.isdir(projects_dir):
+            return 0
+
+        count = 0
+        for project_name in os.listdir(projects_dir):
+            project_dir = os.path.join(projects_dir, project_name)
+            if not os.path.isdir(project_dir):
+                continue
+            agent_types = set()
+            for file in os.listdir(project_dir):
+                for suffix in ('_agent.json', '_agent.log.jsonl'):
+                    if file.endswith(suffix):
+                        agent_types.add(file[:-len(suffix)])
+            for agent_type in agent_types:
+                page = ChatHistoryManager.load_page(project_name, agent_type, limit=1)
+                if page['total']:
+                    last = page['messages'][-1].get('timestamp') if page['messages'] else None
+                    self.record(project_name, agent_type, last, page['total'])
+                    count += 1
+        print(f"🗂️ Chat manifest rebuilt: {count} chats")
+        return count
+
+
+_manifest = None
+_manifest_guard = threading.Lock()
+
+
+def get_manifest():
+    """Shared manifest, built from disk on first use if empty"""
+    global _manifest
+    with _manifest_guard:
+        if _manifest is not None:
+            return _manifest
+        manifest = ChatManifest()
+        _manifest = manifest
+    # Outside the guard: rebuild takes per-file locks that savers may hold
+    if manifest.is_empty():
+        manifest.rebuild()
+    return manifest
+
+
+def _write_snapshot(file_path, index_path, chat_data):
+    """Write the snapshot with one message per line, plus its offset index.
+
+    The file is still plain JSON; the index holds the snapshot size followed
+    by the byte offset of every message line (and the end of the last one),
+    so a page of messages is one seek + one read.
+    """
+    header = {k: v for k, v in chat_data.items() if k != 'messages'}
+    messages = chat_data['messages']
+    offsets = array('Q')
+
+    # Snapshot first: a stale index is detected by its size header and rebuilt
+    with atomic_open(file_path) as f:
+        f.write((json.dumps(header, ensure_ascii=False)[:-1] + ', "messages": [\n').encode('utf-8'))
+        for i, message in enumerate(messages):
+            offsets.append(f.tell())
+            line = json.dumps(message, ensure_ascii=False) + (',\n' if i < len(messages) - 1 else '\n')
+            f.write(line.encode('utf-8'))
+        offsets.append(f.tell())
+        f.write(b']}\n')
+        size = f.tell()
+
+    index = array('Q', [size])
+    index.extend(offsets)
+    with atomic_open(index_path) as f:
+        index.tofile(f)
+
+
+class ChatHistoryManager:
+    """Manages persistent chat history with project folders"""
+
+    @staticmethod
+    def get_project_path(project_name="General", agent_type="basic"):
+        """Get file path for a project's chat history"""
+        # Create project directory
+        project_dir = os.path.join(CHAT_HISTORY_DIR, 'Projects', _safe_project_name(project_name))
+        os.makedirs(project_dir, exist_ok=True)
+
+        # Return file path
+        return os.path.join(project_dir, f"{agent_type}_agent.json")
+
+    @staticmethod
+    def get_log_path(project_name="General", agent_type="basic"):
+        """Append-only log that sits next to the snapshot"""
+        return ChatHistoryManager.get_project_path(project_name, agent_type)[:-len('.json')] + '.log.jsonl'
+
+    @staticmethod
+    def get_index_path(project_name="General", agent_type="basic"):
+        """Byte-offset index of the snapshot's message lines"""
+        return ChatHistoryManager.get_project_path(project_name, agent_type)[:-len('.json')] + '.idx'
+
+    @staticmethod
+    def append_message(project_name, agent_type, message):
+        """Append one message record; returns its seq.
+
+        seq is the message's index in the conversation (snapshot size plus
+        records already in the log), assigned under the conversation lock so
+        every session and worker writing the same project/agent gets its own.
+        Replay uses it to skip records already folded into the snapshot.
+        """
+        log_path = ChatHistoryManager.get_log_path(project_name, agent_type)
+
+        with _lock_for(log_path):
+            records = ChatHistoryManager._log_record_count(log_path)
+            seq = ChatHistoryManager._snapshot_count(project_name, agent_type) + records
+            record = json.dumps({'seq': seq, 'message': message}, ensure_ascii=False)
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(record + '\n')
+                f.flush()
+            records = ChatHistoryManager._log_record_count(log_path, appended=len(record) + 1)
+        get_manifest().record(project_name, agent_type, message.get('timestamp'), seq + 1)
+
+        if records >= COMPACT_EVERY:
+            ChatHistoryManager.schedule_compaction(project_name, agent_type)
+        return seq
+
+    _log_counts = {}  # log path -> (size, records) as of our last look
+
+    @staticmethod
+    def _log_record_count(log_path, appended=0):
+        """Complete records in the log (caller holds the conversation lock).
+
+        Cached by file size; a log another process appended to is recounted,
+        and a torn tail left by a crash is dropped.
+        """
+        counts = ChatHistoryManager._log_counts
+        size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        cached = counts.get(log_path)
+        if cached and appended and cached[0] + appended == size:
+            counts[log_path] = (size, cached[1] + 1)
+        elif not cached or cached[0] != size:
+            records = valid_end = 0
+            if size:
+                with open(log_path, 'rb+') as f:
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        valid_end += len(line)
+                        records += 1
+                    f.truncate(valid_end)
+            counts[log_path] = (valid_end, records)
+        return counts[log_path][1]
+
+    _snapshot_counts = {}  # snapshot path -> ((size, mtime), messages)
+
+    @staticmethod
+    def _snapshot_count(project_name, agent_type):
+        """Messages in the snapshot (from its offset index, cached while the file is unchanged)"""
+        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
+        if not os.path.exists(file_path):
+            return 0
+        stat = os.stat(file_path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        cached = ChatHistoryManager._snapshot_counts.get(file_path)
+        if cached is None or cached[0] != key:
+            count = max(len(ChatHistoryManager._load_index(project_name, agent_type)) - 1, 0)
+            stat = os.stat(file_path)  # a legacy snapshot is rewritten by its first indexing
+            cached = ChatHistoryManager._snapshot_counts[file_path] = ((stat.st_size, stat.st_mtime_ns), count)
+        return cached[1]
+
+    @staticmethod
+    def _read_log(log_path, after_seq=-1):
+        """Replay log records, skipping a torn final line from a crash"""
+        messages = []
+        if not os.path.exists(log_path):
+            return messages
+
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial write at the tail - everything before it is intact
+                    break
+                if record.get('seq', 0) > after_seq:
+                    messages.append(record['message'])
+        return messages
+
+    @staticmethod
+    def schedule_compaction(project_name, agent_type):
+        """Fold the log into the snapshot on the background compactor"""
+        key = (project_name, agent_type)
+        if key in _pending_compactions:
+            return
+        _pending_compactions.add(key)
+
+        def run():
+            try:
+                ChatHistoryManager.compact(project_name, agent_type)
+            except Exception as e:
+                print(f"Compaction error for {project_name}/{agent_type}: {e}")
+            finally:
+                _pending_compactions.discard(key)
+
+        _compactor.submit(run)
+
+    @staticmethod
+    def compact(project_name, agent_type):
+        """Rewrite the snapshot from snapshot + log, then truncate the log"""
+        log_path = ChatHistoryManager.get_log_path(project_name, agent_type)
+        with _lock_for(log_path):
+            chat_data = ChatHistoryManager.load_conversation(project_name, agent_type)
+            if chat_data is None:
+                return None
+            return ChatHistoryManager.save_conversation(project_name, agent_type, chat_data['messages'])
+
+    @staticmethod
+    def save_conversation(project_name, agent_type, messages):
+        """Write a full snapshot and reset the log (explicit save / compaction)"""
+        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
+        log_path = ChatHistoryManager.get_log_path(project_name, agent_type)
+        index_path = ChatHistoryManager.get_index_path(project_name, agent_type)
+
+        chat_data = {
+            'project': project_name,
+            'agent_type': agent_type,
+            'last_updated': datetime.now().isoformat(),
+            'messages': messages,
+            'message_count': len(messages)
+        }
+
+        with _lock_for(log_path):
+            _write_snapshot(file_path, index_path, chat_data)
+            # A crash before this truncate is safe: replay skips seq < message_count
+            open(log_path, 'w', encoding='utf-8').close()
+            ChatHistoryManager._log_counts[log_path] = (0, 0)
+        get_manifest().record(project_name, agent_type, chat_data['last_updated'], len(messages))
+
+        print(f"💾 Saved chat: {project_name}/{agent_type} ({len(messages)} messages)")
+        return file_path
+
+    @staticmethod
+    def load_conversation(project_name, agent_type):
+        """Load conversation from snapshot plus log tail"""
+        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
+        log_path = ChatHistoryManager.get_log_path(project_name, agent_type)
+
+        with _lock_for(log_path):
+            chat_data = read_json(file_path)
+            if chat_data is not None:
+                # Shallow copy: the parsed snapshot stays cached for the next load
+                chat_data = dict(chat_data, messages=list(chat_data.get('messages', [])))
+
+            snapshot_count = len(chat_data['messages']) if chat_data else 0
+            tail = ChatHistoryManager._read_log(log_path, after_seq=snapshot_count - 1)
+
+        if chat_data is None and not tail:
+            return None
+
+        if chat_data is None:
+            chat_data = {'project': project_name, 'agent_type': agent_type, 'messages': []}
+        if tail:
+            chat_data['messages'].extend(tail)
+            chat_data['last_updated'] = tail[-1].get('timestamp', chat_data.get('last_updated'))
+        chat_data['message_count'] = len(chat_data['messages'])
+        return chat_data
+
+    @staticmethod
+    def _load_index(project_name, agent_type):
+        """Offsets of the snapshot's message lines; rebuilds stale/legacy indexes"""
+        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
+        index_path = ChatHistoryManager.get_index_path(project_name, agent_type)
+        if not os.path.exists(file_path):
+            return array('Q')
+
+        index = array('Q')
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                index.frombytes(f.read())
+        if len(index) >= 2 and index[0] == os.path.getsize(file_path):
+            return index[1:]
+
+        # Legacy (indent=2) or externally edited snapshot: rewrite once in line format
+        chat_data = dict(read_json(file_path))
+        chat_data['message_count'] = len(chat_data.get('messages', []))
+        chat_data.setdefault('messages', [])
+        _write_snapshot(file_path, index_path, chat_data)
+        print(f"🗂️ Indexed chat: {project_name}/{agent_type} ({chat_data['message_count']} messages)")
+        with open(index_path, 'rb') as f:
+            index = array('Q')
+            index.frombytes(f.read())
+        return index[1:]
+
+    @staticmethod
+    def load_page(project_name, agent_type, before=None, limit=50):
+        """Cursor-paginated history, newest page first.
+
+        Returns messages [start, end) in chronological order; pass the
+        returned next_cursor as `before` to fetch the previous page. Only
+        the requested snapshot lines and the (bounded) log tail are parsed.
+        """
+        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
+        log_path = ChatHistoryManager.get_log_path(project_name, agent_type)
+        limit = max(1, int(limit))
+
+        with _lock_for(log_path):
+            offsets = ChatHistoryManager._load_index(project_name, agent_type)
+            snapshot_count = max(len(offsets) - 1, 0)
+            tail = ChatHistoryManager._read_log(log_path, after_seq=snapshot_count - 1)
+
+            total = snapshot_count + len(tail)
+            end = total if before is None else max(0, min(int(before), total))
+            start = max(0, end - limit)
+
+            messages = []
+            snap_end = min(end, snapshot_count)
+            if start < snap_end:
+                with open(file_path, 'rb') as f:
+                    f.seek(offsets[start])
+                    chunk = f.read(offsets[snap_end] - offsets[start])
+                # Split on b'\n' only: str.splitlines would also break lines on
+                # U+2028/U+2029/U+0085, which ensure_ascii=False leaves unescaped
+                for line in chunk.split(b'\n'):
+                    if line:
+                        messages.append(json.loads(line.rstrip(b',')))
+            messages.extend(tail[max(start - snapshot_count, 0):max(end - snapshot_count, 0)])
+
+        return {
+            'project': project_name,
+            'agent_type': agent_type,
+            'messages': messages,
+            'start': start,
+            'end': end,
+            'total': total,
+            'next_cursor': start if start > 0 else None,
+            'has_more': start > 0
+        }
+
+    @staticmethod
+    def list_projects():
+        """List all projects (from the manifest)"""
+        return get_manifest().projects()
+
+    @staticmethod
+    def get_project_chats(project_name):
+        """Get all chats for a project (from the manifest)"""
+        return get_manifest().chats(project_name)
@@ -0,0 +1,304 @@
+# chat_jobs.py
+"""
+Background chat jobs for the chat servers:
+- Agent calls run on a bounded worker pool, not on Flask request threads
+- Tokens are buffered per job for polling or Server-Sent Events
+- Finished jobs are pruned after a retention window
+- Status and tokens are mirrored to the shared state backend (Redis at
+  REDIS_URL), so any worker process can serve a job's polls, stream and
+  cancel, not just the one running it
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    from state_backend import get_state_client
+except ImportError:
+    from utils.state_backend import get_state_client
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class ChatJob:
+    """One queued/running agent call and the tokens it has produced"""
+
+    def __init__(self, session_id, agent_type, message, shared=None):
+        self.job_id = uuid.uuid4().hex
+        self.shared = shared
+        self.session_id = session_id
+        self.agent_type = agent_type
+        self.message = message
+        self.status = 'queued'
+        self.tokens = []
+        self.response = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    def start(self):
+        self.status = 'running'
+        self.started_at = time.time()
+        self._publish()
+
+    def push(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._cond.notify_all()
+        self._publish(token)
+
+    def finish(self, status, response=None, error=None):
+        with self._cond:
+            self.status = status
+            self.response = response if response is not None else ''.join(self.tokens)
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+        self._publish()
+
+    def _publish(self, token=None):
+        if self.shared is not None:
+            try:
+                self.shared.publish(self, token)
+            except Exception as e:
+                print(f"⚠️ Chat job {self.job_id} not shared: {e}")
+
+    def wait_for_tokens(self, since, timeout=15):
+        """Block until tokens past `since` exist or the job ends"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.tokens) > since or self.done, timeout=timeout)
+            return self.tokens[since:], self.done
+
+    def to_dict(self, since=0):
+        return {
+            'job_id': self.job_id,
+            'session_id': self.session_id,
+            'agent_type': self.agent_type,
+            'status': self.status,
+            'text': ''.join(self.tokens[since:]),
+            'next': len(self.tokens),
+            'response': self.response if self.done else None,
+            'error': self.error,
+            'queued_time': round((self.started_at or time.time()) - self.created_at, 3),
+            'response_time': round(self.finished_at - self.started_at, 2)
+                             if self.finished_at and self.started_at else None,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat()
+        }
+
+
+class SharedJobState:
+    """Job status and tokens in the shared state backend, readable by every worker"""
+
+    FIELDS = ('session_id', 'agent_type', 'status', 'error', 'created_at', 'started_at', 'finished_at')
+
+    def __init__(self, client, prefix='chatjob', retention_seconds=600):
+        self.client = client
+        self.prefix = prefix
+        self.retention_seconds = retention_seconds
+
+    def _keys(self, job_id):
+        return f"{self.prefix}:{job_id}", f"{self.prefix}:{job_id}:tokens"
+
+    def publish(self, job, token=None):
+        """Write the job's status (and a new token) in one round trip"""
+        meta_key, tokens_key = self._keys(job.job_id)
+        # Unfinished jobs are kept an hour longer, so a long queue can't expire them
+        ttl = self.retention_seconds + (0 if job.done else 3600)
+        pipe = self.client.pipeline()
+        pipe.hset(meta_key, mapping={field: '' if getattr(job, field) is None else str(getattr(job, field))
+                                     for field in self.FIELDS})
+        pipe.expire(meta_key, ttl)
+        if token is not None:
+            pipe.rpush(tokens_key, token.encode('utf-8'))
+        pipe.expire(tokens_key, ttl)
+        pipe.execute()
+
+    def load(self, job_id, since=0):
+        """(status fields, tokens after `since`), or (None, []) for an unknown job"""
+        meta_key, tokens_key = self._keys(job_id)
+        pipe = self.client.pipeline()
+        pipe.hgetall(meta_key)
+        pipe.lrange(tokens_key, since, -1)
+        meta, tokens = pipe.execute()
+        if not meta:
+            return None, []
+        meta = {_text(k): _text(v) for k, v in meta.items()}
+        return meta, [_text(token) for token in tokens]
+
+    def request_cancel(self, job_id):
+        meta_key = self._keys(job_id)[0]
+        pipe = self.client.pipeline()
+        pipe.hget(meta_key, 'status')
+        pipe.hset(meta_key, mapping={'cancel': '1'})
+        status, _ = pipe.execute()
+        if status is None:
+            self.client.delete(meta_key)  # don't leave a bare flag for an unknown job
+        return status is not None
+
+    def cancel_requested(self, job_id):
+        return self.client.hget(self._keys(job_id)[0], 'cancel') is not None
+
+
+class RemoteChatJob(ChatJob):
+    """A job running in another worker process, read through SharedJobState"""
+
+    POLL_SECONDS = 0.25
+
+    def __init__(self, shared, job_id):
+        self.job_id = job_id
+        self.shared = shared
+        self.message = None
+        self.tokens = []
+        self.response = None
+        self.cancel_event = threading.Event()
+        self.found = self.refresh()
+
+    def refresh(self):
+        """Pull new tokens and the current status; False if the job is gone"""
+        meta, tokens = self.shared.load(self.job_id, since=len(self.tokens))
+        if meta is None:
+            return False
+        self.tokens.extend(tokens)
+        self.session_id = meta.get('session_id')
+        self.agent_type = meta.get('agent_type')
+        self.status = meta.get('status') or 'queued'
+        self.error = meta.get('error') or None
+        self.created_at, self.started_at, self.finished_at = (
+            float(meta[field]) if meta.get(field) else None
+            for field in ('created_at', 'started_at', 'finished_at'))
+        self.created_at = self.created_at or time.time()
+        if self.done:
+            self.response = ''.join(self.tokens)
+        return True
+
+    def wait_for_tokens(self, since, timeout=15):
+        deadline = time.time() + timeout
+        while len(self.tokens) <= since and not self.done and time.time() < deadline:
+            time.sleep(self.POLL_SECONDS)
+            if not self.refresh():
+                self.status, self.error = 'error', 'Job expired'
+                self.finished_at = time.time()
+        return self.tokens[since:], self.done
+
+
+class ChatJobManager:
+    """Runs chat jobs on a fixed-size pool so slow generations can't pin request threads"""
+
+    CANCEL_POLL_SECONDS = 0.5
+
+    def __init__(self, max_workers=None, retention_seconds=600, client=None):
+        self.max_workers = max_workers or int(os.environ.get('CHAT_WORKERS', 4))
+        self.retention_seconds = retention_seconds
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix='chat-job')
+        self.shared = SharedJobState(client or get_state_client(), retention_seconds=retention_seconds)
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session, message, on_complete=None):
+        """Queue an agent call for a session; returns the ChatJob immediately"""
+        job = ChatJob(session.session_id, session.agent_type, message, shared=self.shared)
+        with self._lock:
+            self._prune()
+            self.jobs[job.job_id] = job
+        job._publish()
+        self.executor.submit(self._run, job, session, on_complete)
+        return job
+
+    def get(self, job_id):
+        """A job from this worker, or one another worker is running"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            job = RemoteChatJob(self.shared, job_id)
+        except Exception as e:
+            print(f"⚠️ Chat job lookup failed: {e}")
+            return None
+        return job if job.found else None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and not job.done:
+            job.cancel_event.set()
+            if isinstance(job, RemoteChatJob):
+                self.shared.request_cancel(job_id)  # the owning worker picks it up
+        return job
+
+    def _cancelled(self, job, checked):
+        """Local cancel, or (at most every CANCEL_POLL_SECONDS) one from another worker"""
+        if job.cancel_event.is_set():
+            return True
+        if time.time() - checked[0] >= self.CANCEL_POLL_SECONDS:
+            checked[0] = time.time()
+            try:
+                if self.shared.cancel_requested(job.job_id):
+                    job.cancel_event.set()
+            except Exception:
+                pass
+        return job.cancel_event.is_set()
+
+    def _run(self, job, session, on_complete):
+        job.start()
+        checked = [time.time()]
+        try:
+            # One message at a time per session keeps its conversation ordered
+            with session.lock:
+                for token in session.stream_response(job.message, job.cancel_event):
+                    job.push(token)
+                    if self._cancelled(job, checked):
+                        break
+            status = 'cancelled' if job.cancel_event.is_set() else 'done'
+            job.finish(status)
+            if on_complete:
+                on_complete(session, job)
+        except Exception as e:
+            print(f"Chat job error: {e}")
+            job.finish('error', error=str(e))
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [jid for jid, job in self.jobs.items()
+                   if job.done and job.finished_at < cutoff]
+        for jid in expired:
+            del self.jobs[jid]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            'workers': self.max_workers,
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+            'finished': len(statuses) - statuses.count('queued') - statuses.count('running')
+        }
+
+
+def sse_events(job, since=0):
+    """Server-Sent Events stream of a job's tokens"""
+    position = since
+    while True:
+        tokens, done = job.wait_for_tokens(position)
+        if tokens:
+            position += len(tokens)
+            yield f"event: token\ndata: {json.dumps({'text': ''.join(tokens), 'next': position})}\n\n"
+        elif not done:
+            yield ": keep-alive\n\n"
+        if done and position >= len(job.tokens):
+            yield f"event: {job.status}\ndata: {json.dumps(job.to_dict(since=len(job.tokens)))}\n\n"
+            return
@@ -0,0 +1,403 @@
+# chat_search.py
+"""
+Full-text search over chat history:
+- Incremental inverted index, updated as messages are added
+- BM25 ranking with vectorized NumPy scoring
+- Compact on-disk format: documents in an append-only JSONL file,
+  postings in immutable .npz segments (uint32 doc ids, uint16 term counts)
+- Unflushed documents are re-indexed from the JSONL file after a crash
+- Safe with several worker processes: writes happen under a file lock,
+  after catching up with documents and segments the others wrote
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from chat_history import ChatHistoryManager, CHAT_HISTORY_DIR
+from persistence import file_lock
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he",
+    "her", "his", "in", "is", "it", "its", "me", "my", "of", "on", "or", "she",
+    "that", "the", "their", "them", "they", "this", "to", "was", "we", "were",
+    "will", "with", "you", "your", "i",
+}
+
+# Write a postings segment after this many new documents
+FLUSH_EVERY = 500
+# Merge segments into one when there are more than this many
+MAX_SEGMENTS = 8
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def make_snippet(text, terms, width=160):
+    """Window of text around the first matching query term"""
+    lower = text.lower()
+    hits = [lower.find(t) for t in terms if lower.find(t) >= 0]
+    start = max(0, min(hits) - width // 3) if hits else 0
+    snippet = text[start:start + width].replace('\n', ' ')
+    return ('...' if start > 0 else '') + snippet + ('...' if start + width < len(text) else '')
+
+
+class ChatSearchIndex:
+    """Incremental BM25 inverted index over every project's chat messages"""
+
+    def __init__(self, index_dir=None, k1=1.5, b=0.75):
+        self.index_dir = index_dir or os.path.join(CHAT_HISTORY_DIR, 'search')
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.docs_path = os.path.join(self.index_dir, 'docs.jsonl')
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._lock_path = os.path.join(self.index_dir, 'index')  # file_lock: index.lock
+        with self._lock, file_lock(self._lock_path):
+            self._reset()
+            self._load()
+
+    def _reset(self):
+        self.doc_offsets = array('Q')      # byte offset of each doc line in docs.jsonl
+        self.doc_meta = []                 # (project, agent_type, seq, role, timestamp)
+        self.doc_keys = set()              # (project, agent_type, seq) already indexed
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+
+        # Flushed segments: dicts of terms / term_offsets / doc_ids / tfs
+        self.segments = []
+        self.flushed_docs = 0
+
+        # Unflushed postings: term -> ([doc ids], [term frequencies])
+        self.delta = {}
+        self._delta_lengths = []
+
+        self._docs_size = 0            # bytes of docs.jsonl read so far
+        self._segment_names = ()       # segment files on disk when last loaded
+
+    # ===== PERSISTENCE =====
+
+    def _segment_paths(self):
+        names = sorted(f for f in os.listdir(self.index_dir) if f.startswith('seg_') and f.endswith('.npz'))
+        return [os.path.join(self.index_dir, f) for f in names]
+
+    def _load(self):
+        """Read segments and documents from disk (caller holds the file lock)"""
+        self._segment_names = tuple(self._segment_paths())
+        loaded = []
+        for path in self._segment_names:
+            with np.load(path, allow_pickle=False) as data:
+                loaded.append({k: data[k] for k in data.files})
+
+        # A merged segment supersedes the ones it was built from (if a crash left them behind)
+        loaded.sort(key=lambda s: (int(s['doc_start']), -int(s['doc_end'])))
+        for segment in loaded:
+            if int(segment['doc_start']) < self.flushed_docs:
+                continue
+            self.segments.append(segment)
+            self.flushed_docs = int(segment['doc_end'])
+
+        lengths = [s['doc_lengths'] for s in self.segments]
+        self.doc_lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.float32)
+
+        if not os.path.exists(self.docs_path):
+            return
+
+        pending = []
+        with open(self.docs_path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    f.truncate(offset)  # torn write from a crash
+                    break
+                doc = json.loads(line)
+                self.doc_offsets.append(offset)
+                self._remember(doc)
+                if len(self.doc_meta) > self.flushed_docs:
+                    pending.append(doc)
+                offset += len(line)
+        self._docs_size = offset
+
+        for doc_id, doc in enumerate(pending, start=self.flushed_docs):
+            self._index_postings(doc_id, doc['x'])
+        if pending:
+            print(f"🔎 Search index: replayed {len(pending)} unflushed messages")
+
+    def _refresh(self):
+        """Catch up with what other processes wrote (caller holds the file lock)"""
+        if tuple(self._segment_paths()) != self._segment_names:
+            # Someone flushed or merged: start over from their segments
+            self._reset()
+            self._load()
+            return
+        try:
+            size = os.path.getsize(self.docs_path)
+        except FileNotFoundError:
+            return
+        if size <= self._docs_size:
+            return
+        with open(self.docs_path, 'rb+') as f:
+            f.seek(self._docs_size)
+            offset = self._docs_size
+            for line in f:
+                if not line.endswith(b'\n'):
+                    f.truncate(offset)  # torn write from a crashed process
+                    break
+                doc = json.loads(line)
+                self.doc_offsets.append(offset)
+                doc_id = len(self.doc_meta)
+                self._remember(doc)
+                self._index_postings(doc_id, doc['x'])
+                offset += len(line)
+        self._docs_size = offset
+
+    def _remember(self, doc):
+        self.doc_meta.append((doc['p'], doc['a'], doc['s'], doc['r'], doc['t']))
+        self.doc_keys.add((doc['p'], doc['a'], doc['s']))
+
+    def flush(self):
+        """Write unflushed postings as a new immutable segment"""
+        with self._lock, file_lock(self._lock_path):
+            self._refresh()
+            self._flush()
+
+    def _flush(self):
+        """flush() with the locks held and the index current"""
+        if not self.delta:
+            return
+        terms = sorted(self.delta)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for i, term in enumerate(terms):
+            docs, freqs = self.delta[term]
+            doc_ids.extend(docs)
+            tfs.extend(freqs)
+            term_offsets[i + 1] = len(doc_ids)
+
+        doc_end = len(self.doc_meta)
+        segment = {
+            'terms': np.array(terms, dtype=str),
+            'term_offsets': term_offsets,
+            'doc_ids': np.array(doc_ids, dtype=np.uint32),
+            'tfs': np.minimum(np.array(tfs), 65535).astype(np.uint16),
+            'doc_lengths': np.array(self._delta_lengths, dtype=np.float32),
+            'doc_start': np.int64(self.flushed_docs),
+            'doc_end': np.int64(doc_end)
+        }
+        self._write_segment(segment, f"seg_{self.flushed_docs:010d}.npz")
+        self.segments.append(segment)
+        self.doc_lengths = np.concatenate([self.doc_lengths, segment['doc_lengths']])
+        self.flushed_docs = doc_end
+        self.delta = {}
+        self._delta_lengths = []
+
+        if len(self.segments) > MAX_SEGMENTS:
+            self._merge_segments()
+        self._segment_names = tuple(self._segment_paths())
+
+    def _write_segment(self, segment, name):
+        path = os.path.join(self.index_dir, name)
+        tmp_path = os.path.join(self.index_dir, f"tmp_{name}")
+        np.savez_compressed(tmp_path, **segment)
+        os.replace(tmp_path, path)
+
+    def _merge_segments(self):
+        """Fold all segments into one so queries touch a single postings list per term"""
+        merged = {}
+        for segment in self.segments:
+            offsets = segment['term_offsets']
+            for i, term in enumerate(segment['terms']):
+                lo, hi = offsets[i], offsets[i + 1]
+                merged.setdefault(str(term), []).append((segment['doc_ids'][lo:hi], segment['tfs'][lo:hi]))
+
+        terms = sorted(merged)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_parts, tf_parts = [], []
+        for i, term in enumerate(terms):
+            parts = merged[term]
+            doc_parts.extend(p[0] for p in parts)
+            tf_parts.extend(p[1] for p in parts)
+            term_offsets[i + 1] = term_offsets[i] + sum(len(p[0]) for p in parts)
+
+        old_paths = self._segment_paths()
+        segment = {
+            'terms': np.array(terms, dtype=str),
+            'term_offsets': term_offsets,
+            'doc_ids': np.concatenate(doc_parts).astype(np.uint32) if doc_parts else np.zeros(0, np.uint32),
+            'tfs': np.concatenate(tf_parts).astype(np.uint16) if tf_parts else np.zeros(0, np.uint16),
+            'doc_lengths': self.doc_lengths[:self.flushed_docs],
+            'doc_start': np.int64(0),
+            'doc_end': np.int64(self.flushed_docs)
+        }
+        name = f"seg_merged_{self.flushed_docs:010d}.npz"
+        self._write_segment(segment, name)
+        for path in old_paths:
+            if os.path.basename(path) != name:
+                os.remove(path)
+        self.segments = [segment]
+
+    # ===== INDEXING =====
+
+    def _index_postings(self, doc_id, text):
+        counts = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            docs, freqs = self.delta.setdefault(term, ([], []))
+            docs.append(doc_id)
+            freqs.append(tf)
+        self._delta_lengths.append(sum(counts.values()))
+
+    def add(self, project_name, agent_type, seq, message):
+        """Index one chat message (no-op if already indexed)"""
+        content = message.get('content') or ''
+        if not content.strip():
+            return
+        with self._lock, file_lock(self._lock_path):
+            self._refresh()
+            if (project_name, agent_type, seq) in self.doc_keys:
+                return
+            doc = {
+                'p': project_name, 'a': agent_type, 's': seq,
+                'r': message.get('role'), 't': message.get('timestamp'), 'x': content
+            }
+            line = (json.dumps(doc, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+            with open(self.docs_path, 'ab') as f:
+                self.doc_offsets.append(f.tell())
+                f.write(line)
+            self._docs_size += len(line)
+            doc_id = len(self.doc_meta)
+            self._remember(doc)
+            self._index_postings(doc_id, content)
+            if len(self._delta_lengths) >= FLUSH_EVERY:
+                self._flush()
+
+    def backfill(self):
+        """Index existing history for every chat in the manifest"""
+        added = 0
+        for project_name in ChatHistoryManager.list_projects():
+            for chat in ChatHistoryManager.get_project_chats(project_name):
+                before = None
+                while True:
+                    page = ChatHistoryManager.load_page(project_name, chat['agent'], before=before, limit=500)
+                    for seq, message in enumerate(page['messages'], start=page['start']):
+                        self.add(project_name, chat['agent'], seq, message)
+                        added += 1
+                    if not page['has_more']:
+                        break
+                    before = page['next_cursor']
+        self.flush()
+        print(f"🔎 Search index: backfilled {added} messages")
+        return added
+
+    # ===== QUERY =====
+
+    def _postings(self, term):
+        """All (doc ids, term frequencies) for a term across segments and delta"""
+        doc_parts, tf_parts = [], []
+        for segment in self.segments:
+            terms = segment['terms']
+            i = int(np.searchsorted(terms, term))
+            if i < len(terms) and terms[i] == term:
+                lo, hi = segment['term_offsets'][i], segment['term_offsets'][i + 1]
+                doc_parts.append(segment['doc_ids'][lo:hi])
+                tf_parts.append(segment['tfs'][lo:hi])
+        if term in self.delta:
+            docs, freqs = self.delta[term]
+            doc_parts.append(np.asarray(docs, dtype=np.uint32))
+            tf_parts.append(np.asarray(freqs, dtype=np.uint16))
+        if not doc_parts:
+            return None, None
+        return np.concatenate(doc_parts).astype(np.int64), np.concatenate(tf_parts).astype(np.float32)
+
+    def _read_text(self, doc_id):
+        with open(self.docs_path, 'rb') as f:
+            f.seek(self.doc_offsets[doc_id])
+            return json.loads(f.readline())['x']
+
+    def search(self, query, limit=10, project_name=None, agent_type=None):
+        """Ranked results with snippets"""
+        started = time.perf_counter()
+        terms = list(dict.fromkeys(tokenize(query)))
+        results = []
+
+        with self._lock, file_lock(self._lock_path):
+            self._refresh()
+            total = len(self.doc_meta)
+            if terms and total:
+                lengths = self.doc_lengths
+                if len(self._delta_lengths):
+                    lengths = np.concatenate([lengths, np.array(self._delta_lengths, dtype=np.float32)])
+                avgdl = float(lengths.mean()) or 1.0
+                scores = np.zeros(total, dtype=np.float32)
+
+                for term in terms:
+                    docs, tfs = self._postings(term)
+                    if docs is None:
+                        continue
+                    idf = np.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                    norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avgdl)
+                    np.add.at(scores, docs, idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+                candidates = np.flatnonzero(scores)
+                if project_name or agent_type:
+                    candidates = np.array([
+                        d for d in candidates
+                        if (not project_name or self.doc_meta[d][0] == project_name)
+                        and (not agent_type or self.doc_meta[d][1] == agent_type)
+                    ], dtype=np.int64)
+                if len(candidates) > limit:
+                    top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+                    candidates = candidates[top]
+                candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+                for doc_id in candidates:
+                    project, agent, seq, role, timestamp = self.doc_meta[doc_id]
+                    results.append({
+                        'project': project,
+                        'agent_type': agent,
+                        'seq': seq,
+                        'role': role,
+                        'timestamp': timestamp,
+                        'score': round(float(scores[doc_id]), 4),
+                        'snippet': make_snippet(self._read_text(doc_id), terms)
+                    })
+
+        return {
+            'query': query,
+            'results': results,
+            'total_docs': total,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self.doc_meta),
+                'segments': len(self.segments),
+                'unflushed': len(self._delta_lengths)
+            }
+
+
+_index = None
+_index_guard = threading.Lock()
+
+
+def get_search_index():
+    """Shared index; backfills existing history in the background on first build"""
+    global _index
+    with _index_guard:
+        if _index is None:
+            _index = ChatSearchIndex()
+            atexit.register(_index.flush)
+            if not _index.doc_meta:
+                threading.Thread(target=_index.backfill, name='search-backfill', daemon=True).start()
+        return _index
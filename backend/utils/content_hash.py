@@ -0,0 +1,130 @@
+# content_hash.py
+"""
+Hash-while-uploading for the upload routes:
+- Multipart file parts are spooled straight to disk and hashed as the
+  bytes arrive (one pass, no re-read after the upload)
+- The spool is renamed into place, not copied
+- BLAKE2b by default; xxHash when installed; MD5/SHA-256 on request
+  (UPLOAD_HASH env)
+"""
+
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+DEFAULT_ALGORITHM = os.environ.get('UPLOAD_HASH', 'blake2b')
+CHUNK_SIZE = 1024 * 1024
+
+# Read once at import: os.umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def new_hasher(algorithm=None):
+    """Hash object for an algorithm name; returns (name, hasher)"""
+    algorithm = (algorithm or DEFAULT_ALGORITHM).lower()
+    if algorithm.startswith('xxh'):
+        if XXHASH_AVAILABLE and hasattr(xxhash, algorithm):
+            return algorithm, getattr(xxhash, algorithm)()
+        print(f"⚠️ {algorithm} unavailable (pip install xxhash), using blake2b")
+        algorithm = 'blake2b'
+    if algorithm == 'blake2b':
+        # 128-bit digest: same length as the old MD5 keys, far faster on 64-bit CPUs
+        return algorithm, hashlib.blake2b(digest_size=16)
+    return algorithm, hashlib.new(algorithm)
+
+
+def file_digest(path, algorithm=None):
+    """Digest of a file already on disk (for files that did not arrive through an upload)"""
+    algorithm, hasher = new_hasher(algorithm)
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            size += len(chunk)
+    return {'algorithm': algorithm, 'digest': hasher.hexdigest(), 'size': size}
+
+
+class HashingSpool:
+    """Temp file that hashes everything written to it.
+
+    werkzeug writes each uploaded file part into one of these; commit()
+    renames it to its final path. Uncommitted spools are deleted on close.
+    """
+
+    def __init__(self, directory, algorithm=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self.algorithm, self._hasher = new_hasher(algorithm)
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush for werkzeug and FileStorage
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def content(self):
+        return {'algorithm': self.algorithm, 'digest': self._hasher.hexdigest(), 'size': self.size}
+
+    def commit(self, dest_path):
+        """Move the spooled upload to dest_path; returns its digest info"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # mkstemp creates 0600; give the original the mode file.save would have
+        os.chmod(self.path, 0o666 & ~UMASK)
+        os.replace(self.path, dest_path)
+        self.committed = True
+        self._file.close()
+        return self.content()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def hashing_request_class(spool_dir, algorithm=None):
+    """Flask request class whose uploaded files are HashingSpools in spool_dir.
+
+    spool_dir must be on the same filesystem as the upload folder.
+    """
+    class HashingRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type,
+                             filename=None, content_length=None):
+            return HashingSpool(spool_dir, algorithm)
+
+    return HashingRequest
+
+
+def save_upload(file_storage, dest_path, algorithm=None):
+    """Save an uploaded file; returns {'algorithm', 'digest', 'size'}.
+
+    Spooled uploads are renamed into place with the digest computed on the
+    way in; anything else is saved and hashed once.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingSpool) and (algorithm is None or algorithm == stream.algorithm):
+        return stream.commit(dest_path)
+    file_storage.save(dest_path)
+    return file_digest(dest_path, algorithm)
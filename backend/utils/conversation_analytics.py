@@ -0,0 +1,306 @@
+# conversation_analytics.py
+"""
+Columnar analytics over the enhanced agent's JSONL turn logs:
+- Incremental compaction: only bytes appended since the last run are read
+- Day-partitioned NumPy structured-array segments (.npy)
+- Dictionary-encoded model / agent type / conversation columns
+- Aggregation queries with partition pruning on timestamp
+- Safe with several processes (every server worker, the CLI): compaction
+  runs under a file lock and re-reads the committed state first
+"""
+
+import argparse
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    from persistence import read_json, write_json, file_lock
+except ImportError:
+    from utils.persistence import read_json, write_json, file_lock
+
+TURN_DTYPE = np.dtype([
+    ('ts', 'f8'),               # epoch seconds
+    ('model', 'i4'),            # dictionary id
+    ('agent_type', 'i2'),       # dictionary id
+    ('conversation', 'i4'),     # dictionary id
+    ('user_len', 'i4'),         # characters
+    ('assistant_len', 'i4'),    # characters
+    ('temperature', 'f4'),
+])
+
+# Merge a day's segments into one once it has more than this many
+MAX_SEGMENTS_PER_DAY = 16
+
+METRICS = ('count', 'avg_user_len', 'avg_assistant_len', 'sum_assistant_len',
+           'max_assistant_len', 'avg_temperature')
+
+
+class ConversationAnalytics:
+    """Rolls turn logs into columnar day partitions and answers aggregate queries"""
+
+    def __init__(self, log_dir="data/conversations/enhanced", store_dir="data/conversations/analytics"):
+        self.log_dir = log_dir
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.state_path = os.path.join(store_dir, 'state.json')
+        self.dict_path = os.path.join(store_dir, 'dictionaries.json')
+        self._lock = threading.Lock()
+
+        with self._lock, file_lock(self.state_path):
+            self._reload()
+            self._recover()
+
+    def _reload(self):
+        """Committed state as another process may have left it (call under file_lock)"""
+        state = read_json(self.state_path, default={}, copy_result=True)
+        self.offsets = state.get('offsets', {})   # source file -> bytes already compacted
+        self.segment_seq = state.get('segment_seq', 0)
+        self.dictionaries = read_json(self.dict_path, default={}, copy_result=True)
+        for column in ('model', 'agent_type', 'conversation'):
+            self.dictionaries.setdefault(column, [])
+        self._lookup = {c: {v: i for i, v in enumerate(values)} for c, values in self.dictionaries.items()}
+
+    # ===== COMPACTION =====
+
+    def _encode(self, column, value):
+        value = value or 'unknown'
+        ids = self._lookup[column]
+        if value not in ids:
+            ids[value] = len(self.dictionaries[column])
+            self.dictionaries[column].append(value)
+        return ids[value]
+
+    def _read_new_turns(self, path):
+        """Parse only complete lines appended since the last compaction"""
+        name = os.path.basename(path)
+        start = self.offsets.get(name, 0)
+        if os.path.getsize(path) <= start:
+            return [], start
+
+        rows = []
+        conversation = os.path.splitext(name)[0]
+        with open(path, 'rb') as f:
+            f.seek(start)
+            consumed = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # still being written; pick it up next run
+                consumed += len(line)
+                try:
+                    turn = json.loads(line)
+                    ts = datetime.fromisoformat(turn['timestamp']).timestamp()
+                except (ValueError, KeyError):
+                    continue
+                rows.append((
+                    ts,
+                    self._encode('model', turn.get('model')),
+                    self._encode('agent_type', turn.get('agent_type')),
+                    self._encode('conversation', conversation),
+                    len(turn.get('user') or ''),
+                    len(turn.get('assistant') or ''),
+                    float(turn.get('temperature') or 0.0),
+                ))
+        return rows, consumed
+
+    def compact(self):
+        """Append new turns to their day partitions; returns the number of rows added"""
+        if not os.path.isdir(self.log_dir):
+            return 0
+
+        with self._lock, file_lock(self.state_path):
+            # Another process may have compacted since: start from its offsets and seq
+            self._reload()
+            rows = []
+            offsets = dict(self.offsets)
+            for entry in os.scandir(self.log_dir):
+                if entry.name.endswith('.jsonl') and entry.stat().st_size > offsets.get(entry.name, 0):
+                    new_rows, consumed = self._read_new_turns(entry.path)
+                    rows.extend(new_rows)
+                    offsets[entry.name] = consumed
+            if not rows:
+                return 0
+
+            table = np.array(rows, dtype=TURN_DTYPE)
+            days = np.array([datetime.fromtimestamp(ts).strftime('%Y-%m-%d') for ts in table['ts']])
+            touched = [str(day) for day in np.unique(days)]
+            for day in touched:
+                self._write_segment(day, np.sort(table[days == day], order='ts'))
+            self.offsets = offsets
+            self._commit()
+
+            for day in touched:
+                self._merge_day(day)
+            print(f"📊 Analytics: compacted {len(table)} turns")
+            return len(table)
+
+    def _commit(self):
+        """Segments with seq <= segment_seq become visible together with the new offsets"""
+        write_json(self.dict_path, self.dictionaries)
+        write_json(self.state_path, {'offsets': self.offsets, 'segment_seq': self.segment_seq})
+
+    def _write_segment(self, day, part, merged=False):
+        day_dir = os.path.join(self.store_dir, day)
+        os.makedirs(day_dir, exist_ok=True)
+        self.segment_seq += 1
+        suffix = '_merged' if merged else ''
+        path = os.path.join(day_dir, f"seg_{self.segment_seq:08d}{suffix}.npy")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, part)
+        os.replace(tmp_path, path)
+
+    def _merge_day(self, day):
+        """Fold a day's segments into one; the merged file supersedes every older one"""
+        day_dir = os.path.join(self.store_dir, day)
+        segments = self._segments(day_dir, self.segment_seq)
+        if len(segments) <= MAX_SEGMENTS_PER_DAY:
+            return
+        merged = np.sort(np.concatenate([np.load(p) for p in segments]), order='ts')
+        self._write_segment(day, merged, merged=True)
+        self._commit()
+        for path in segments:
+            os.remove(path)
+
+    @staticmethod
+    def _segment_files(day_dir):
+        """(seq, merged, path) for each segment file in a day partition"""
+        files = []
+        for name in os.listdir(day_dir):
+            if name.startswith('seg_') and name.endswith('.npy'):
+                files.append((int(name[4:12]), name.endswith('_merged.npy'), os.path.join(day_dir, name)))
+        return sorted(files)
+
+    def _segments(self, day_dir, committed=None):
+        """Live segment paths: committed, and not superseded by a later merge"""
+        files = self._segment_files(day_dir)
+        floor = max((seq for seq, merged, _ in files if merged and (committed is None or seq <= committed)),
+                    default=0)
+        return [path for seq, _, path in files
+                if seq >= floor and (committed is None or seq <= committed)]
+
+    def _recover(self):
+        """Drop segments from an interrupted run and inputs of a finished merge"""
+        for day in os.listdir(self.store_dir):
+            day_dir = os.path.join(self.store_dir, day)
+            if not os.path.isdir(day_dir):
+                continue
+            live = set(self._segments(day_dir, self.segment_seq))
+            for _, _, path in self._segment_files(day_dir):
+                if path not in live:
+                    os.remove(path)
+
+    # ===== QUERIES =====
+
+    def load(self, start=None, end=None):
+        """Rows with start <= timestamp < end, reading only the overlapping days"""
+        first = start.strftime('%Y-%m-%d') if start else None
+        last = end.strftime('%Y-%m-%d') if end else None
+        parts = []
+        # Locked so a merge in another process can't delete segments mid-read
+        with self._lock, file_lock(self.state_path):
+            self._reload()
+            for day in sorted(os.listdir(self.store_dir)):
+                day_dir = os.path.join(self.store_dir, day)
+                if not os.path.isdir(day_dir) or (first and day < first) or (last and day > last):
+                    continue
+                parts.extend(np.load(p) for p in self._segments(day_dir, self.segment_seq))
+        table = np.concatenate(parts) if parts else np.zeros(0, dtype=TURN_DTYPE)
+
+        mask = np.ones(len(table), dtype=bool)
+        if start:
+            mask &= table['ts'] >= start.timestamp()
+        if end:
+            mask &= table['ts'] < end.timestamp()
+        return table[mask]
+
+    def query(self, start=None, end=None, model=None, agent_type=None, group_by='model', metrics=METRICS):
+        """Aggregate turns, e.g. query(start=week_ago, group_by='model', metrics=('avg_assistant_len',)).
+
+        group_by: 'model', 'agent_type', 'conversation', 'day', 'hour' or None.
+        """
+        table = self.load(start, end)
+        for column, value in (('model', model), ('agent_type', agent_type)):
+            if value is not None:
+                table = table[table[column] == self._lookup[column].get(value, -1)]
+
+        if group_by is None:
+            keys, inverse = np.array(['all']), np.zeros(len(table), dtype=np.int64)
+        elif group_by in ('day', 'hour'):
+            fmt = '%Y-%m-%d' if group_by == 'day' else '%Y-%m-%d %H:00'
+            labels = np.array([datetime.fromtimestamp(ts).strftime(fmt) for ts in table['ts']], dtype=str)
+            keys, inverse = np.unique(labels, return_inverse=True)
+        else:
+            ids, inverse = np.unique(table[group_by], return_inverse=True)
+            names = self.dictionaries[group_by]
+            keys = np.array([names[i] for i in ids], dtype=object)
+
+        groups = len(keys)
+        count = np.bincount(inverse, minlength=groups)
+        safe = np.maximum(count, 1)
+        columns = {
+            'count': count,
+            'avg_user_len': np.bincount(inverse, table['user_len'], groups) / safe,
+            'avg_assistant_len': np.bincount(inverse, table['assistant_len'], groups) / safe,
+            'sum_assistant_len': np.bincount(inverse, table['assistant_len'], groups),
+            'avg_temperature': np.bincount(inverse, table['temperature'], groups) / safe,
+        }
+        if 'max_assistant_len' in metrics:
+            maxima = np.zeros(groups)
+            np.maximum.at(maxima, inverse, table['assistant_len'])
+            columns['max_assistant_len'] = maxima
+
+        rows = []
+        for g in range(groups):
+            if not count[g]:
+                continue
+            row = {group_by or 'group': str(keys[g])}
+            for metric in metrics:
+                value = columns[metric][g]
+                row[metric] = int(value) if metric in ('count', 'sum_assistant_len', 'max_assistant_len') \
+                    else round(float(value), 2)
+            rows.append(row)
+        return rows
+
+    # ===== BACKGROUND =====
+
+    def start_background(self, interval=300):
+        """Compact new JSONL on a timer"""
+        def loop():
+            while not stop.is_set():
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"Analytics compaction error: {e}")
+                stop.wait(interval)
+        stop = threading.Event()
+        threading.Thread(target=loop, name='analytics-compactor', daemon=True).start()
+        return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation analytics")
+    parser.add_argument('command', choices=['compact', 'query'])
+    parser.add_argument('--days', type=int, default=7, help="Look back this many days")
+    parser.add_argument('--group-by', default='model')
+    parser.add_argument('--model')
+    parser.add_argument('--agent-type')
+    args = parser.parse_args()
+
+    analytics = ConversationAnalytics()
+    if args.command == 'compact':
+        analytics.compact()
+        return
+
+    analytics.compact()
+    start = datetime.now() - timedelta(days=args.days)
+    group_by = None if args.group_by == 'none' else args.group_by
+    for row in analytics.query(start=start, model=args.model, agent_type=args.agent_type, group_by=group_by):
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# ffmpeg_scheduler.py
+"""
+One scheduler for every ffmpeg this machine runs:
+- A fixed number of job slots sized from the CPU count, shared by all
+  processes (web workers, Celery workers) through lock files
+- Each job's -threads is picked from the cores and current demand: a lone
+  job gets the whole machine, a busy queue splits it
+- Interactive work (editing proxies) goes first and always has a slot
+  kept free of exports and other background jobs
+- Queue and utilization metrics for /api/transcode/metrics
+
+Tuning: FFMPEG_SLOTS, FFMPEG_MIN_THREADS, FFMPEG_SLOT_DIR
+"""
+
+import heapq
+import itertools
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: slots are per process only
+    FCNTL_AVAILABLE = False
+
+# Lower runs first; priority 0 is interactive and may use the reserved slot
+PRIORITY = {'proxy': 0, 'preview': 0, 'clip': 1, 'cache': 1, 'export': 2}
+BACKGROUND_PRIORITY = 1
+
+
+def cpu_cores():
+    """Cores this process may run on (respects container CPU affinity)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def with_threads(command, threads):
+    """Copy of an ffmpeg command with its output -threads set"""
+    command = list(command)
+    if '-threads' in command:
+        command[command.index('-threads') + 1] = str(threads)
+    else:
+        command[-1:-1] = ['-threads', str(threads)]  # output option: just before the output path
+    return command
+
+
+class Ticket:
+    def __init__(self, kind, seq):
+        self.kind = kind
+        self.priority = PRIORITY.get(kind, BACKGROUND_PRIORITY)
+        self.seq = seq
+        self.slot = None
+        self.queued_at = time.time()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class FFmpegScheduler:
+    """Priority queue in front of a machine-wide pool of ffmpeg slots"""
+
+    def __init__(self, cores=None, slots=None, min_threads=None, slot_dir=None):
+        self.cores = cores or cpu_cores()
+        self.min_threads = min(self.cores, min_threads or int(os.environ.get('FFMPEG_MIN_THREADS', 2)))
+        self.slots = slots or int(os.environ.get('FFMPEG_SLOTS', 0)) or max(1, self.cores // self.min_threads)
+        self.slot_dir = slot_dir or os.environ.get('FFMPEG_SLOT_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'ffmpeg-slots')
+        os.makedirs(self.slot_dir, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._fds = {}
+        self._held = set()
+        self.running = {}
+        self.completed = 0
+        self.failed = 0
+        self._waits = deque(maxlen=200)
+        print(f"🎛️ ffmpeg scheduler: {self.slots} slots on {self.cores} cores")
+
+    # ===== SLOTS =====
+
+    def _slot_order(self, priority):
+        """Slots a job may take; slot 0 is kept for interactive work when there is more than one"""
+        if priority == 0 or self.slots == 1:
+            return range(self.slots - 1, -1, -1)
+        return range(self.slots - 1, 0, -1)
+
+    def _try_claim(self, priority):
+        for index in self._slot_order(priority):
+            if index in self._held:
+                continue
+            if FCNTL_AVAILABLE:
+                fd = self._fds.get(index)
+                if fd is None:
+                    fd = self._fds[index] = os.open(os.path.join(self.slot_dir, f"slot{index}.lock"),
+                                                    os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # another process is using it
+            self._held.add(index)
+            return index
+        return None
+
+    def _dispatch(self):
+        """Hand free slots to waiters in priority order (caller holds the condition).
+
+        Interactive tickets sort first, so when the head can't get a slot
+        nobody behind it can either.
+        """
+        while self._waiting:
+            ticket = self._waiting[0]
+            slot = self._try_claim(ticket.priority)
+            if slot is None:
+                return
+            ticket.slot = slot
+            heapq.heappop(self._waiting)
+            self._cond.notify_all()
+
+    def _release(self, slot):
+        with self._cond:
+            self._held.discard(slot)
+            if FCNTL_AVAILABLE and slot in self._fds:
+                fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+            self._dispatch()
+            self._cond.notify_all()
+
+    def busy_slots(self):
+        """Slots in use machine-wide (ours plus other processes')"""
+        if not FCNTL_AVAILABLE:
+            return len(self._held)
+        with self._cond:
+            busy = len(self._held)
+            for index in range(self.slots):
+                if index in self._held:
+                    continue
+                path = os.path.join(self.slot_dir, f"slot{index}.lock")
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                except BlockingIOError:
+                    busy += 1
+                finally:
+                    os.close(fd)
+            return busy
+
+    def threads_for(self):
+        """Threads for a job starting now: the cores split over running and queued jobs,
+        capped by what our own running jobs leave free.
+
+        With more than one slot no job gets every core: one slot's share is
+        kept back, so an interactive job arriving next doesn't oversubscribe.
+        """
+        demand = min(self.slots, self.busy_slots() + len(self._waiting))
+        free = self.cores - sum(job['threads'] for job in list(self.running.values()))
+        reserve = self.cores // self.slots if self.slots > 1 else 0
+        return max(self.min_threads, min(free, self.cores - reserve, self.cores // max(1, demand)))
+
+    @contextmanager
+    def slot(self, kind='proxy', check=None):
+        """Wait for a slot; yields the job record (with its thread count).
+
+        check() is called while waiting and may raise to give up the place in the queue.
+        """
+        ticket = Ticket(kind, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._dispatch()
+            while ticket.slot is None:
+                try:
+                    if check:
+                        check()
+                except BaseException:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    raise
+                # Other processes free slots without notifying us, so poll too
+                self._cond.wait(0.25)
+                if ticket.slot is None:
+                    self._dispatch()
+
+        waited = time.time() - ticket.queued_at
+        self._waits.append(waited)
+        job = {'kind': kind, 'slot': ticket.slot, 'threads': self.threads_for(),
+               'started': time.time(), 'waited': round(waited, 2), 'out_time': 0.0, 'speed': None}
+        self.running[ticket.seq] = job
+        try:
+            yield job
+        finally:
+            self.running.pop(ticket.seq, None)
+            self._release(ticket.slot)
+
+    # ===== RUNNING =====
+
+    def run(self, command, kind='proxy', timeout=None, progress=None, check=None):
+        """Run an ffmpeg command in a slot; True on success.
+
+        progress(key, value) gets each `-progress` line; check() is called
+        while queued and, with the timeout, twice a second while running
+        (from a watchdog, so a silent ffmpeg can't dodge them). Either may
+        raise to stop the job (ffmpeg is killed and the exception re-raised).
+        """
+        with self.slot(kind, check) as job:
+            command = with_threads(command, job['threads'])
+            command = command[:1] + ['-progress', 'pipe:1', '-nostats'] + command[1:]
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       text=True, bufsize=1)
+            errors = deque(maxlen=20)
+            drain = threading.Thread(target=lambda: errors.extend(process.stderr), daemon=True)
+            drain.start()
+            stopped = []  # 'timeout' or the exception check() raised
+            done = threading.Event()
+
+            def watchdog():
+                while not done.wait(0.5):
+                    if timeout and time.time() - job['started'] > timeout:
+                        stopped.append('timeout')
+                    elif check:
+                        try:
+                            check()
+                        except BaseException as e:
+                            stopped.append(e)
+                    if stopped:
+                        process.kill()
+                        return
+
+            guard = threading.Thread(target=watchdog, daemon=True, name='ffmpeg-watchdog')
+            guard.start()
+            try:
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    # out_time_ms is microseconds too (a long-standing ffmpeg misnomer)
+                    if key in ('out_time_us', 'out_time_ms') and value.isdigit():
+                        job['out_time'] = int(value) / 1e6
+                    elif key == 'speed' and value.endswith('x'):
+                        try:
+                            job['speed'] = float(value[:-1])
+                        except ValueError:
+                            pass
+                    if progress:
+                        progress(key, value)
+                process.wait()
+            except BaseException:
+                process.kill()
+                process.wait()
+                self.failed += 1
+                raise
+            finally:
+                done.set()
+                guard.join()
+            drain.join(timeout=1)
+            if stopped and stopped[0] == 'timeout':
+                self.failed += 1
+                print(f"⏱️ ffmpeg {kind} job timed out after {timeout}s")
+                return False
+            if stopped:
+                self.failed += 1
+                raise stopped[0]
+            if process.returncode != 0:
+                self.failed += 1
+                print(f"ffmpeg {kind} failed ({process.returncode}): {''.join(errors)[-500:]}")
+                return False
+            self.completed += 1
+            return True
+
+    # ===== METRICS =====
+
+    def metrics(self):
+        now = time.time()
+        with self._cond:
+            queued = {}
+            for ticket in self._waiting:
+                queued[ticket.kind] = queued.get(ticket.kind, 0) + 1
+            oldest = max((now - t.queued_at for t in self._waiting), default=0)
+        running = [{'kind': job['kind'], 'slot': job['slot'], 'threads': job['threads'],
+                    'seconds': round(now - job['started'], 1), 'waited': job['waited'],
+                    'out_time': round(job['out_time'], 1), 'speed': job['speed']}
+                   for job in list(self.running.values())]
+        threads = sum(job['threads'] for job in running)
+        busy = self.busy_slots()
+        return {
+            'cores': self.cores,
+            'slots': self.slots,
+            'busy_slots': busy,
+            'slot_utilization': round(busy / self.slots, 2),
+            'threads_in_use': threads,
+            'cpu_share': round(threads / self.cores, 2),
+            'load_average': os.getloadavg() if hasattr(os, 'getloadavg') else None,
+            'running': running,
+            'queued': queued,
+            'oldest_wait_seconds': round(oldest, 1),
+            'avg_wait_seconds': round(sum(self._waits) / len(self._waits), 2) if self._waits else 0,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide scheduler (slots are shared with other processes through FFMPEG_SLOT_DIR)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FFmpegScheduler()
+        return _scheduler
@@ -0,0 +1,234 @@
+# hls_output.py
+"""
+Progressive HLS renditions (fMP4 segments + playlist) for proxies and web caches:
+- ffmpeg writes an EVENT playlist that grows as segments finish, so the
+  player can start after the first HLS_SEGMENT_SECONDS are encoded
+- Keyframes are forced on segment boundaries; segments and the playlist
+  are written to temp names and renamed (never served half-written)
+- One encode per output directory across processes: whoever renames its
+  claim (a directory already holding the heartbeat) into place runs ffmpeg,
+  everyone else waits on the playlist
+- Cache headers: segments are immutable, an unfinished playlist must be
+  revalidated
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+
+try:
+    from persistence import file_lock
+except ImportError:
+    from utils.persistence import file_lock
+
+HLS_SEGMENT_SECONDS = int(os.environ.get('HLS_SEGMENT_SECONDS', 4))
+PLAYLIST = 'index.m3u8'
+HEARTBEAT = '.encoding'
+STALE_SECONDS = 60
+
+_active = {}  # out_dir -> thread, encodes running in this process
+_callbacks = {}  # out_dir -> [on_done], called when that encode finishes
+_lock = threading.Lock()
+_heartbeat = None
+
+
+def playlist_path(out_dir):
+    return os.path.join(out_dir, PLAYLIST)
+
+
+def hls_command(source, out_dir, video_args, audio_args, segment_seconds=HLS_SEGMENT_SECONDS):
+    """ffmpeg command writing source as fMP4 HLS into out_dir"""
+    return [
+        'ffmpeg', '-i', source,
+        *video_args,
+        '-force_key_frames', f"expr:gte(t,n_forced*{segment_seconds})",  # cut exactly on segment boundaries
+        *audio_args,
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'event',    # grows while encoding, ENDLIST when done
+        '-hls_segment_type', 'fmp4',
+        '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_flags', 'independent_segments+temp_file',
+        '-hls_segment_filename', os.path.join(out_dir, 'seg_%05d.m4s'),
+        '-y', playlist_path(out_dir)
+    ]
+
+
+def _read_playlist(out_dir):
+    try:
+        with open(playlist_path(out_dir)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+
+def hls_status(out_dir):
+    """'ready', 'encoding', 'failed' (stopped before the end) or 'missing'"""
+    if '#EXT-X-ENDLIST' in _read_playlist(out_dir):
+        return 'ready'
+    if out_dir in _active:
+        return 'encoding'
+    if not os.path.isdir(out_dir):
+        return 'missing'
+    try:
+        age = time.time() - os.path.getmtime(os.path.join(out_dir, HEARTBEAT))
+    except FileNotFoundError:
+        # The encode may have just finished: ENDLIST is written before the heartbeat goes
+        return 'ready' if '#EXT-X-ENDLIST' in _read_playlist(out_dir) else 'failed'
+    return 'encoding' if age < STALE_SECONDS else 'failed'
+
+
+def _beat():
+    """Keep the heartbeat files of our running encodes fresh (for other processes)"""
+    while True:
+        with _lock:
+            dirs = list(_active)
+        for out_dir in dirs:
+            try:
+                os.utime(os.path.join(out_dir, HEARTBEAT))
+            except FileNotFoundError:
+                pass
+        time.sleep(STALE_SECONDS / 4)
+
+
+def _claim(out_dir):
+    """Create out_dir with its heartbeat in one rename, so nobody sees it without
+    one (that reads as 'failed'); False if another caller got there first"""
+    parent, name = os.path.split(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    claim_dir = os.path.join(parent, f".{name}.claim-{uuid.uuid4().hex[:8]}")
+    os.mkdir(claim_dir)
+    open(os.path.join(claim_dir, HEARTBEAT), 'w').close()
+    try:
+        os.rename(claim_dir, out_dir)  # fails if out_dir exists (a live claim is never empty)
+        return True
+    except OSError:
+        shutil.rmtree(claim_dir, ignore_errors=True)
+        return False
+
+
+def _reclaim(out_dir):
+    """Replace a failed rendition with a fresh claim.
+
+    Under a file lock and re-checked, so a caller that saw 'failed' before
+    someone else's claim can't delete that claim.
+    """
+    with file_lock(out_dir):
+        if hls_status(out_dir) != 'failed':
+            return False
+        parent, name = os.path.split(out_dir)
+        failed_dir = os.path.join(parent, f".{name}.failed-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(out_dir, failed_dir)  # out of the way at once; deleted below
+        except FileNotFoundError:
+            pass
+        claimed = _claim(out_dir)
+    shutil.rmtree(failed_dir, ignore_errors=True)
+    return claimed
+
+
+def start_hls(out_dir, command, run, on_done=None):
+    """Start writing an HLS rendition in the background unless it exists or is being written.
+
+    run(command, timeout) -> bool runs ffmpeg (normally through the scheduler).
+    on_done(ok) is called when the encode finishes if it runs in this process
+    (started now or by an earlier call); sizes and statuses recorded while
+    it was growing can be refreshed there. Returns the status after starting.
+    """
+    global _heartbeat
+    with _lock:
+        # Threads of this process decide one at a time, so a claim is in _active
+        # before another thread can see it and register its on_done
+        status = hls_status(out_dir)
+        if status == 'encoding' and out_dir in _active and on_done:
+            _callbacks[out_dir].append(on_done)
+        if status in ('encoding', 'ready'):
+            return status
+        claimed = _reclaim(out_dir) if status == 'failed' else _claim(out_dir)
+        if not claimed:
+            return hls_status(out_dir)  # another process just claimed it
+        _active[out_dir] = None
+        _callbacks[out_dir] = [on_done] if on_done else []
+
+    def encode():
+        try:
+            ok = run(command, timeout=None)
+        except BaseException as e:
+            print(f"HLS encode error: {e}")
+            ok = False
+        with _lock:
+            _active.pop(out_dir, None)
+            callbacks = _callbacks.pop(out_dir, [])
+        try:
+            os.remove(os.path.join(out_dir, HEARTBEAT))  # no playlist ENDLIST + no heartbeat = failed
+        except FileNotFoundError:
+            pass
+        if ok:
+            print(f"📺 HLS ready: {out_dir}")
+        else:
+            print(f"HLS encode failed: {out_dir}")
+        for callback in callbacks:
+            try:
+                callback(ok)
+            except Exception as e:
+                print(f"HLS completion hook error: {e}")
+
+    thread = threading.Thread(target=encode, daemon=True, name='hls')
+    with _lock:
+        _active[out_dir] = thread
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_beat, daemon=True, name='hls-heartbeat')
+            _heartbeat.start()
+    thread.start()
+    return 'encoding'
+
+
+def wait_playable(out_dir, timeout=10):
+    """Wait until the playlist lists a segment (or the encode stopped); True if playable"""
+    deadline = time.time() + timeout
+    while True:
+        if '#EXTINF' in _read_playlist(out_dir):
+            return True
+        if hls_status(out_dir) in ('failed', 'missing') or time.time() >= deadline:
+            return False
+        time.sleep(0.2)
+
+
+def hls_size(out_dir):
+    total = 0
+    for entry in os.scandir(out_dir):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+def hls_info(out_dir, url_prefix):
+    """Playlist URL and progress of an HLS rendition"""
+    playlist = _read_playlist(out_dir)
+    return {
+        'playlist_path': playlist_path(out_dir),
+        'playlist_url': f"{url_prefix}/{os.path.basename(out_dir)}/{PLAYLIST}",
+        'hls_status': hls_status(out_dir),
+        'segments': playlist.count('#EXTINF'),
+        'seconds_ready': round(sum(float(line[8:].split(',')[0]) for line in playlist.splitlines()
+                                   if line.startswith('#EXTINF:')), 2),
+        'format': 'hls'
+    }
+
+
+def hls_cache_headers(file_path, response):
+    """Caching/content headers for a served file of an HLS rendition (Flask after_request)"""
+    name = os.path.basename(file_path)
+    if name.endswith('.m4s') or (name == 'init.mp4' and os.path.exists(playlist_path(os.path.dirname(file_path)))):
+        # Written once under a final name, never changed
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        if name.endswith('.m4s'):
+            response.headers['Content-Type'] = 'video/iso.segment'
+    elif name.endswith('.m3u8'):
+        response.headers['Content-Type'] = 'application/vnd.apple.mpegurl'
+        # Still growing: players must refetch it; finished playlists can be cached briefly
+        finished = hls_status(os.path.dirname(file_path)) == 'ready'
+        response.headers['Cache-Control'] = 'public, max-age=3600' if finished else 'no-cache'
+    return response
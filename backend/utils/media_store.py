@@ -0,0 +1,295 @@
+# media_store.py
+"""
+Content-addressed media store shared by every upload session:
+- Originals are kept once per content digest; a duplicate upload is
+  replaced by a hardlink to the stored copy
+- Derived files (proxies, web caches) are keyed by digest + rendition
+  parameters, so a clip is transcoded once no matter who uploads it
+- Sessions hold references; a file is deleted when its last one goes
+- Index and refcounts in SQLite (store.db), safe across worker processes;
+  each rendition is created by one writer machine-wide (flock per key)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: keys are locked per process only
+    FCNTL_AVAILABLE = False
+
+
+def params_hash(params):
+    """Stable short id for a set of rendition parameters"""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def disk_size(path):
+    """Bytes of a file, or of the files in a directory rendition (e.g. HLS)"""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def link_or_copy(src, dest):
+    """Atomically make dest a hardlink to src (a copy across filesystems)"""
+    tmp_path = f"{dest}.{uuid.uuid4().hex[:8]}.link"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+class MediaStore:
+    """Deduplicated originals and renditions with per-session refcounts"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.conn = sqlite3.connect(os.path.join(root, 'store.db'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                created TEXT,
+                meta TEXT
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                key TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                created TEXT,
+                PRIMARY KEY (key, session_id)
+            );
+            CREATE INDEX IF NOT EXISTS refs_session ON refs (session_id);
+            CREATE INDEX IF NOT EXISTS objects_path ON objects (path);
+        ''')
+        if 'meta' not in [row[1] for row in self.conn.execute('PRAGMA table_info(objects)')]:
+            try:
+                self.conn.execute('ALTER TABLE objects ADD COLUMN meta TEXT')  # stores from before meta
+            except sqlite3.OperationalError:
+                pass  # another process just added it
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    # ===== INDEX =====
+
+    @contextmanager
+    def _key_lock(self, key):
+        """Exclusive hold on a key: per thread here, per process through objects/<key>.lock"""
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if not FCNTL_AVAILABLE:
+                yield
+                return
+            fd = os.open(os.path.join(self.root, 'objects', key.replace(':', '_') + '.lock'),
+                         os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)  # releases the flock
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT path FROM objects WHERE key = ?', (key,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def _register(self, key, kind, digest, path, session_id, meta=None):
+        now = datetime.now().isoformat()
+        meta = json.dumps(meta) if meta else None
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO objects (key, kind, digest, path, size, created, meta) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET path = excluded.path, size = excluded.size, meta = excluded.meta
+            ''', (key, kind, digest, path, disk_size(path), now, meta))
+            self.conn.execute('INSERT OR IGNORE INTO refs (key, session_id, created) VALUES (?, ?, ?)',
+                              (key, session_id, now))
+            self.conn.commit()
+
+    def refresh_size(self, path):
+        """Re-measure a rendition written in place once its writer has finished"""
+        with self._lock:
+            self.conn.execute('UPDATE objects SET size = ? WHERE path = ?', (disk_size(path), path))
+            self.conn.commit()
+
+    def add_ref(self, key, session_id):
+        with self._lock:
+            self.conn.execute('INSERT OR IGNORE INTO refs (key, session_id, created) VALUES (?, ?, ?)',
+                              (key, session_id, datetime.now().isoformat()))
+            self.conn.commit()
+
+    # ===== ORIGINALS =====
+
+    def add_original(self, path, digest, session_id):
+        """Store an uploaded file by digest; a duplicate becomes a hardlink to the stored copy"""
+        key = f"original:{digest}"
+        with self._key_lock(key):
+            stored = self._lookup(key)
+            if stored:
+                if not os.path.samefile(stored, path):
+                    link_or_copy(stored, path)
+                self.add_ref(key, session_id)
+                self.hits += 1
+                print(f"♻️ Duplicate upload linked: {os.path.basename(path)} ({digest[:12]})")
+                return {'key': key, 'path': stored, 'deduplicated': True}
+
+            object_dir = os.path.join(self.root, 'objects', digest[:2])
+            os.makedirs(object_dir, exist_ok=True)
+            stored = os.path.join(object_dir, digest + os.path.splitext(path)[1].lower())
+            link_or_copy(path, stored)
+            self._register(key, 'original', digest, stored, session_id)
+            self.misses += 1
+            return {'key': key, 'path': stored, 'deduplicated': False}
+
+    # ===== RENDITIONS =====
+
+    def rendition(self, digest, kind, params, session_id, directory, create, ext='.mp4', meta=None):
+        """Path of the (digest, kind, params) rendition in directory, creating it once.
+
+        create(output_path) -> bool writes the file; concurrent requests for
+        the same rendition wait for the first one instead of transcoding again.
+        meta (a dict create may fill in) is stored with a new rendition; see
+        rendition_meta. Returns None if creation fails.
+        """
+        key = f"{kind}:{digest}:{params_hash(params)}"
+        path = os.path.join(directory, f"{kind}_{digest}_{params_hash(params)}{ext}")
+        with self._key_lock(key):
+            if self._lookup(key):
+                self.add_ref(key, session_id)
+                self.hits += 1
+                return path
+
+            # Unique per writer; keeps the extension for ffmpeg's muxer choice
+            tmp_path = f"{path[:-len(ext)]}.part-{uuid.uuid4().hex[:8]}{ext}"
+            ok = False
+            try:
+                ok = create(tmp_path)
+            except Exception as e:
+                print(f"Rendition {kind} failed: {e}")
+            finally:
+                # Also on cancellation, which is not an Exception
+                if not ok and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            if not ok or not os.path.exists(tmp_path):
+                return None
+            os.replace(tmp_path, path)
+            self._register(key, kind, digest, path, session_id, meta)
+            self.misses += 1
+            return path
+
+    def rendition_meta(self, digest, kind, params):
+        """Metadata stored when the rendition was created (None if there was none)"""
+        key = f"{kind}:{digest}:{params_hash(params)}"
+        with self._lock:
+            row = self.conn.execute('SELECT meta FROM objects WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def register_output(self, digest, kind, params, session_id, path):
+        """Index a rendition its owner writes in place (e.g. a progressive HLS directory).
+
+        The caller makes sure only one writer produces path; this just shares
+        and refcounts it like any other rendition.
+        """
+        key = f"{kind}:{digest}:{params_hash(params)}"
+        with self._key_lock(key):
+            if self._lookup(key):
+                self.add_ref(key, session_id)
+                self.hits += 1
+            else:
+                self._register(key, kind, digest, path, session_id)
+                self.misses += 1
+        return key
+
+    # ===== LIFECYCLE =====
+
+    def release_session(self, session_id, kinds=None):
+        """Drop a session's references (optionally only some kinds); deletes files nobody references any more"""
+        with self._lock:
+            keys = [k for (k,) in self.conn.execute('SELECT key FROM refs WHERE session_id = ?', (session_id,))
+                    if kinds is None or k.split(':', 1)[0] in kinds]
+            orphans = []
+            for key in keys:
+                self.conn.execute('DELETE FROM refs WHERE key = ? AND session_id = ?', (key, session_id))
+                if self.conn.execute('SELECT 1 FROM refs WHERE key = ? LIMIT 1', (key,)).fetchone() is None:
+                    row = self.conn.execute('SELECT path FROM objects WHERE key = ?', (key,)).fetchone()
+                    self.conn.execute('DELETE FROM objects WHERE key = ?', (key,))
+                    if row:
+                        orphans.append(row[0])
+            self.conn.commit()
+
+        for path in orphans:
+            remove_path(path)
+        return len(orphans)
+
+    def is_referenced(self, path):
+        with self._lock:
+            return self.conn.execute('''
+                SELECT 1 FROM objects JOIN refs ON refs.key = objects.key WHERE objects.path = ? LIMIT 1
+            ''', (path,)).fetchone() is not None
+
+    def forget(self, path):
+        """Drop a file evicted by its owner (e.g. the web cache's size limit)"""
+        with self._lock:
+            keys = [k for (k,) in self.conn.execute('SELECT key FROM objects WHERE path = ?', (path,))]
+            for key in keys:
+                self.conn.execute('DELETE FROM refs WHERE key = ?', (key,))
+                self.conn.execute('DELETE FROM objects WHERE key = ?', (key,))
+            self.conn.commit()
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: {'files': n, 'bytes': size or 0} for kind, n, size in self.conn.execute(
+                'SELECT kind, COUNT(*), SUM(size) FROM objects GROUP BY kind')}
+            refs = self.conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+            sessions = self.conn.execute('SELECT COUNT(DISTINCT session_id) FROM refs').fetchone()[0]
+        return {
+            'kinds': kinds,
+            'references': refs,
+            'sessions': sessions,
+            'dedup_hits': self.hits,
+            'misses': self.misses
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_media_store(root):
+    """Process-wide MediaStore for a root (one SQLite connection and lock table per process)"""
+    root = os.path.abspath(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = MediaStore(root)
+        return _stores[root]
@@ -0,0 +1,226 @@
+# persistence.py
+"""
+Shared persistence for JSON metadata files (project.json, session.json,
+cache_index.json, chat history snapshots):
+- Atomic write-rename, so readers never see a half-written file
+- orjson / msgpack codecs when installed, stdlib json otherwise
+- mtime-validated read cache: unchanged files are not re-parsed
+- Per-file write coalescing for files saved on every request
+- file_lock for read-modify-write of files shared between processes
+"""
+
+import atexit
+import copy
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: file_lock only serializes this process
+    FCNTL_AVAILABLE = False
+
+MSGPACK_EXTENSIONS = ('.msgpack', '.mpk')
+
+_cache = {}        # path -> (mtime_ns, size, data)
+_pending = {}      # path -> (data, indent) waiting for a coalesced write
+_timers = {}       # path -> threading.Timer
+_locks = {}        # path -> threading.RLock guarding that file's entries above
+_locks_lock = threading.Lock()
+
+
+def _lock(path):
+    """In-process lock for one file, so saves of unrelated files don't queue up"""
+    with _locks_lock:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = threading.RLock()
+        return lock
+
+
+# ===== CODECS =====
+
+def encode(data, path='', indent=2):
+    """Serialize by file type: msgpack for .msgpack/.mpk when available, else JSON"""
+    if path.endswith(MSGPACK_EXTENSIONS) and MSGPACK_AVAILABLE:
+        return msgpack.packb(data, use_bin_type=True)
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits - let json handle it
+    return json.dumps(data, indent=indent, ensure_ascii=False).encode('utf-8')
+
+
+def decode(raw):
+    """Parse JSON or msgpack bytes (JSON always starts with text)"""
+    if raw.startswith(b'\xef\xbb\xbf'):
+        raw = raw[3:]  # UTF-8 BOM from editors on Windows
+    head = raw.lstrip()[:1]
+    if head in (b'{', b'[', b'"') or not MSGPACK_AVAILABLE:
+        return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw.decode('utf-8'))
+    return msgpack.unpackb(raw, raw=False)
+
+
+# ===== WRITES =====
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path across processes (flock on path + '.lock')"""
+    path = os.path.abspath(path)
+    if not FCNTL_AVAILABLE:
+        with _lock(f"{path}.lock"):
+            yield
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the flock
+
+
+@contextmanager
+def atomic_open(path, mode='wb'):
+    """Write to a temp file next to path, fsync, then rename over it.
+
+    The temp name is unique per writer, so processes saving the same file
+    never write into each other's temp file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    invalidate(path)
+
+
+def _write_now(path, data, indent):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with atomic_open(path) as f:
+        f.write(encode(data, path, indent))
+    stat = os.stat(path)
+    _cache[path] = (stat.st_mtime_ns, stat.st_size, data)
+
+
+def write_json(path, data, indent=2, delay=0):
+    """Atomically save data.
+
+    With delay > 0 the write is coalesced: repeated saves of the same file
+    within the window become one write of the latest data. Reads in this
+    process see the new data immediately.
+    """
+    path = os.path.abspath(path)
+    with _lock(path):
+        if delay <= 0:
+            _pending.pop(path, None)
+            timer = _timers.pop(path, None)
+            if timer:
+                timer.cancel()
+            _write_now(path, data, indent)
+            return
+
+        _pending[path] = (data, indent)
+        if path not in _timers:
+            timer = threading.Timer(delay, flush, args=(path,))
+            timer.daemon = True
+            _timers[path] = timer
+            timer.start()
+
+
+def flush(path=None):
+    """Write out pending coalesced saves (one file, or all of them)"""
+    paths = [os.path.abspath(path)] if path else list(_pending)
+    for p in paths:
+        with _lock(p):
+            timer = _timers.pop(p, None)
+            if timer:
+                timer.cancel()
+            pending = _pending.pop(p, None)
+            if pending is not None:
+                try:
+                    _write_now(p, *pending)
+                except Exception as e:
+                    print(f"⚠️ Failed to save {p}: {e}")
+
+
+atexit.register(flush)
+
+
+def update_json(path, fields):
+    """Merge fields into a JSON object file under file_lock, so concurrent
+    updaters (e.g. a request and a background encode) don't drop each other's
+    fields. Returns the updated data, or None if the file doesn't exist."""
+    with file_lock(path):
+        data = read_json(path, copy_result=True)
+        if data is None:
+            return None
+        data.update(fields)
+        write_json(path, data)
+        return data
+
+
+# ===== READS =====
+
+def read_json(path, default=None, copy_result=False):
+    """Load a file, re-parsing only if its mtime/size changed.
+
+    The cached object is shared; pass copy_result=True if you will modify
+    the result before (or instead of) writing it back.
+    """
+    path = os.path.abspath(path)
+    with _lock(path):
+        if path in _pending:
+            data = _pending[path][0]
+            return copy.deepcopy(data) if copy_result else data
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return default
+
+        cached = _cache.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            data = cached[2]
+        else:
+            with open(path, 'rb') as f:
+                data = decode(f.read())
+            _cache[path] = (stat.st_mtime_ns, stat.st_size, data)
+
+    return copy.deepcopy(data) if copy_result else data
+
+
+def invalidate(path):
+    """Forget the cached parse of a file written outside write_json"""
+    path = os.path.abspath(path)
+    with _lock(path):
+        _cache.pop(path, None)
@@ -1,10 +1,14 @@
 # project_manager.py - Professional Project Management
 import os
-import json
 import shutil
 from datetime import datetime
 from pathlib import Path
 
+try:
+    from persistence import read_json, write_json
+except ImportError:
+    from utils.persistence import read_json, write_json
+
 class ProjectManager:
     def __init__(self):
         self.base_path = "projects"
@@ -66,8 +70,7 @@ class ProjectManager:
             }
         }
         
-        with open(os.path.join(project_path, "project.json"), "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        write_json(os.path.join(project_path, "project.json"), metadata)
         
         # Create basic Ren'Py script
         self.create_renpy_script(project_path, name)
@@ -142,13 +145,11 @@ label start:
         char_data["created"] = datetime.now().isoformat()
         char_data["image"] = f"sprites/{char_folder}/default.png"  # Placeholder
         
-        with open(char_file, "w", encoding="utf-8") as f:
-            json.dump(char_data, f, indent=2, ensure_ascii=False)
+        write_json(char_file, char_data)
         
         # Update project metadata
         project_file = os.path.join(project_path, "project.json")
-        with open(project_file, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+        metadata = read_json(project_file, copy_result=True)
         
         metadata["characters"].append({
             "id": char_folder,
@@ -157,21 +158,19 @@ label start:
             "file": f"characters/{char_folder}/character.json"
         })
         
-        with open(project_file, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        write_json(project_file, metadata)
         
         # Create character dialogue template
         dialogue_file = os.path.join(char_path, "dialogue.json")
-        with open(dialogue_file, "w", encoding="utf-8") as f:
-            json.dump({
-                "character": char_data["name"],
-                "lines": [],
-                "expressions": {
-                    "happy": "Happy dialogue lines...",
-                    "sad": "Sad dialogue lines...",
-                    "angry": "Angry dialogue lines..."
-                }
-            }, f, indent=2, ensure_ascii=False)
+        write_json(dialogue_file, {
+            "character": char_data["name"],
+            "lines": [],
+            "expressions": {
+                "happy": "Happy dialogue lines...",
+                "sad": "Sad dialogue lines...",
+                "angry": "Angry dialogue lines..."
+            }
+        })
         
         return True
     
@@ -190,8 +189,7 @@ label start:
         scene_data["id"] = scene_folder
         scene_data["created"] = datetime.now().isoformat()
         
-        with open(scene_file, "w", encoding="utf-8") as f:
-            json.dump(scene_data, f, indent=2, ensure_ascii=False)
+        write_json(scene_file, scene_data)
         
         # Create Ren'Py scene file
         rpy_file = os.path.join(scene_path, "scene.rpy")
@@ -212,8 +210,7 @@ label {scene_folder}:
         
         # Update project metadata
         project_file = os.path.join(project_path, "project.json")
-        with open(project_file, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+        metadata = read_json(project_file, copy_result=True)
         
         metadata["scenes"].append({
             "id": scene_folder,
@@ -223,8 +220,7 @@ label {scene_folder}:
             "file": f"scenes/{scene_folder}/scene.rpy"
         })
         
-        with open(project_file, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        write_json(project_file, metadata)
         
         return True
     
@@ -238,8 +234,8 @@ label {scene_folder}:
                     project_file = os.path.join(project_path, "project.json")
                     if os.path.exists(project_file):
                         try:
-                            with open(project_file, "r", encoding="utf-8") as f:
-                                metadata = json.load(f)
+                            # Cached parse; only re-read when project.json changes
+                            metadata = read_json(project_file)
                             projects.append({
                                 "id": item,
                                 "name": metadata["project"]["name"],
@@ -1,20 +1,63 @@
 import os
 import json
 import subprocess
-import hashlib
 from datetime import datetime
 import shutil
 
+try:
+    from ffmpeg_scheduler import get_scheduler
+    from segmented_transcode import SegmentedTranscoder, probe_media, MIN_DURATION
+    from hls_output import hls_command, start_hls, wait_playable, hls_info, hls_size, hls_status, HLS_SEGMENT_SECONDS
+    from media_store import params_hash, remove_path
+    from content_hash import file_digest
+except ImportError:
+    from utils.ffmpeg_scheduler import get_scheduler
+    from utils.segmented_transcode import SegmentedTranscoder, probe_media, MIN_DURATION
+    from utils.hls_output import hls_command, start_hls, wait_playable, hls_info, hls_size, hls_status, HLS_SEGMENT_SECONDS
+    from utils.media_store import params_hash, remove_path
+    from utils.content_hash import file_digest
+
+# 'auto' segments sources longer than PROXY_SEGMENT_MIN_DURATION; 'on' / 'off' force it
+SEGMENTED = os.environ.get('PROXY_SEGMENTED', 'auto')
+
+# Rendition parameters: part of the shared proxy's identity in the media store
+PROXY_PARAMS = {'vcodec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'scale': '960:-2',
+                'fps': 15, 'acodec': 'aac', 'abitrate': '64k'}
+HLS_PARAMS = dict(PROXY_PARAMS, format='hls-fmp4', segment=HLS_SEGMENT_SECONDS)
+FALLBACK_PARAMS = {'vcodec': 'libx264', 'preset': 'superfast', 'crf': 32, 'scale': '480:-2',
+                   'fps': 10, 'acodec': 'aac', 'abitrate': '32k'}
+
 class ProxyManager:
-    def __init__(self, proxy_dir):
+    def __init__(self, proxy_dir, store=None):
         self.proxy_dir = proxy_dir
+        self.store = store  # MediaStore: proxies shared across sessions by content
+        self.runner = None  # optional runner(command, timeout) -> bool, e.g. a job with progress
+        self.on_segment = None  # optional callback as segments of a segmented proxy finish
         os.makedirs(proxy_dir, exist_ok=True)
     
-    def create_proxy(self, original_path, session_id, filename):
-        """Create lightweight proxy for editing"""
+    def create_proxy(self, original_path, session_id, filename, file_hash=None):
+        """Create lightweight proxy for editing (pass file_hash from the upload to skip re-hashing)"""
         
         # Generate unique proxy filename
-        file_hash = self.get_file_hash(original_path)
+        file_hash = file_hash or self.get_file_hash(original_path)
+        
+        segmented = self.use_segments(original_path)
+        # Segmented encodes keep their checkpoints on failure. Under a job runner the job's
+        # retry resumes them, so don't spend the time on a full fallback encode instead;
+        # a direct (sync) caller has no retry and still gets the fallback proxy
+        resumable = segmented and self.runner is not None
+        
+        if self.store is not None:
+            # One proxy per content + settings, whoever uploaded it
+            proxy_path = self.store.rendition(
+                file_hash, 'proxy', PROXY_PARAMS, session_id, self.proxy_dir,
+                lambda out: self.encode_proxy(original_path, out, file_hash, segmented))
+            if proxy_path:
+                return self.get_proxy_info(proxy_path, session_id, filename)
+            if resumable:
+                return None
+            return self.create_fallback_proxy(original_path, session_id, filename, file_hash)
+        
         proxy_filename = f"proxy_{session_id}_{file_hash}.mp4"
         proxy_path = os.path.join(self.proxy_dir, proxy_filename)
         
@@ -23,52 +66,132 @@ class ProxyManager:
             return self.get_proxy_info(proxy_path, session_id, filename)
         
         # Create proxy with optimal settings for editing
-        command = [
-            'ffmpeg', '-i', original_path,
-            '-c:v', 'libx264', '-preset', 'ultrafast',
-            '-crf', '28',           # Higher compression
-            '-vf', 'scale=960:-2',  # 960p proxy (good balance)
-            '-r', '15',             # 15fps (enough for editing)
-            '-c:a', 'aac', '-b:a', '64k',  # Low audio quality
-            '-movflags', '+faststart',
-            '-threads', '2',        # Use 2 threads max
-            '-y', proxy_path
-        ]
+        print(f"Creating proxy: {original_path} -> {proxy_path}")
+        if self.encode_proxy(original_path, proxy_path, file_hash, segmented):
+            return self.get_proxy_info(proxy_path, session_id, filename)
+        if resumable:
+            return None
         
-        try:
-            print(f"Creating proxy: {original_path} -> {proxy_path}")
-            result = subprocess.run(command, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0:
-                return self.get_proxy_info(proxy_path, session_id, filename)
-            else:
-                print(f"Proxy creation failed: {result.stderr}")
-                # Fallback: copy original but smaller
-                return self.create_fallback_proxy(original_path, session_id, filename)
-                
-        except subprocess.TimeoutExpired:
-            print("Proxy creation timeout")
-            return self.create_fallback_proxy(original_path, session_id, filename)
+        # Fallback: copy original but smaller
+        return self.create_fallback_proxy(original_path, session_id, filename, file_hash)
     
-    def create_fallback_proxy(self, original_path, session_id, filename):
+    def create_hls_proxy(self, original_path, session_id, filename, file_hash=None, wait=10, on_done=None):
+        """HLS proxy written progressively; returns once the first segment is playable (or after wait s).
+
+        The size returned is only what was written so far; on_done(ok, size) gets
+        the final size in bytes when the encode finishes (if it runs in this process).
+        """
+        file_hash = file_hash or self.get_file_hash(original_path)
+        out_dir = os.path.join(self.proxy_dir, 'hls', f"{file_hash}_{params_hash(HLS_PARAMS)}")
+        os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+        p = PROXY_PARAMS
+        command = hls_command(
+            original_path, out_dir,
+            video_args=['-c:v', p['vcodec'], '-preset', p['preset'], '-crf', str(p['crf']),
+                        '-vf', f"scale={p['scale']}", '-r', str(p['fps'])],
+            audio_args=['-c:a', p['acodec'], '-b:a', p['abitrate']])
+        
+        def finished(ok):
+            if ok and self.store is not None:
+                self.store.refresh_size(out_dir)
+            if on_done:
+                on_done(ok, hls_size(out_dir) if ok else 0)
+        
+        start_hls(out_dir, command, lambda cmd, timeout: self.run_ffmpeg(cmd, timeout=timeout), on_done=finished)
+        if self.store is not None:
+            self.store.register_output(file_hash, 'proxy-hls', HLS_PARAMS, session_id, out_dir)
+        if not wait_playable(out_dir, wait) and hls_status(out_dir) in ('failed', 'missing'):
+            return None
+        
+        info = hls_info(out_dir, '/static/proxies/hls')
+        size = hls_size(out_dir)
+        return {
+            **info,
+            'original_filename': filename,
+            'proxy_path': out_dir,
+            'proxy_url': info['playlist_url'],
+            'size': size,
+            'size_mb': round(size / (1024 * 1024), 2),
+            'is_proxy': True,
+            'proxy_quality': 'standard'
+        }
+    
+    def create_fallback_proxy(self, original_path, session_id, filename, file_hash=None):
         """Create super simple proxy as fallback"""
-        file_hash = self.get_file_hash(original_path)
+        file_hash = file_hash or self.get_file_hash(original_path)
+        
+        if self.store is not None:
+            proxy_path = self.store.rendition(
+                file_hash, 'fallback', FALLBACK_PARAMS, session_id, self.proxy_dir,
+                lambda out: self.run_ffmpeg(self.fallback_command(original_path, out)))
+            return self.get_proxy_info(proxy_path, session_id, filename) if proxy_path else None
+        
         proxy_filename = f"fallback_{session_id}_{file_hash}.mp4"
         proxy_path = os.path.join(self.proxy_dir, proxy_filename)
         
-        command = [
-            'ffmpeg', '-i', original_path,
-            '-c:v', 'libx264', '-preset', 'superfast',
-            '-crf', '32',           # Very high compression
-            '-vf', 'scale=480:-2',  # 480p
-            '-r', '10',             # 10fps
-            '-c:a', 'aac', '-b:a', '32k',
-            '-y', proxy_path
-        ]
-        
-        subprocess.run(command, capture_output=True)
+        self.run_ffmpeg(self.fallback_command(original_path, proxy_path))
         return self.get_proxy_info(proxy_path, session_id, filename)
     
+    def use_segments(self, original_path):
+        if SEGMENTED in ('on', 'off'):
+            return SEGMENTED == 'on'
+        return probe_media(original_path)['duration'] >= MIN_DURATION
+    
+    def encode_proxy(self, original_path, output_path, file_hash, segmented=False):
+        """Write the standard proxy to output_path; True on success"""
+        if not segmented:
+            return self.run_ffmpeg(self.proxy_command(original_path, output_path), timeout=300)
+        
+        # Long source: parallel keyframe-aligned segments, checkpointed per content digest
+        p = PROXY_PARAMS
+        transcoder = SegmentedTranscoder(
+            os.path.join(self.proxy_dir, 'segments', file_hash),
+            lambda command, timeout: self.run_ffmpeg(command, timeout=timeout, segment=True),
+            workers=get_scheduler().slots)
+        ok = transcoder.transcode(
+            original_path, output_path,
+            video_args=['-c:v', p['vcodec'], '-preset', p['preset'], '-crf', str(p['crf']),
+                        '-vf', f"scale={p['scale']}", '-r', str(p['fps'])],
+            audio_args=['-c:a', p['acodec'], '-b:a', p['abitrate']],
+            on_segment=self.on_segment)
+        if ok:
+            transcoder.discard()
+        return ok
+    
+    def proxy_command(self, input_path, output_path):
+        """ffmpeg command for the standard editing proxy (PROXY_PARAMS)"""
+        p = PROXY_PARAMS
+        return [
+            'ffmpeg', '-i', input_path,
+            '-c:v', p['vcodec'], '-preset', p['preset'],
+            '-crf', str(p['crf']),             # Higher compression
+            '-vf', f"scale={p['scale']}",      # 960p proxy (good balance)
+            '-r', str(p['fps']),               # 15fps (enough for editing)
+            '-c:a', p['acodec'], '-b:a', p['abitrate'],  # Low audio quality
+            '-movflags', '+faststart',
+            '-y', output_path       # -threads set by the scheduler
+        ]
+    
+    def fallback_command(self, input_path, output_path):
+        """ffmpeg command for the low-quality fallback proxy (FALLBACK_PARAMS)"""
+        p = FALLBACK_PARAMS
+        return [
+            'ffmpeg', '-i', input_path,
+            '-c:v', p['vcodec'], '-preset', p['preset'],
+            '-crf', str(p['crf']),             # Very high compression
+            '-vf', f"scale={p['scale']}",      # 480p
+            '-r', str(p['fps']),               # 10fps
+            '-c:a', p['acodec'], '-b:a', p['abitrate'],
+            '-y', output_path
+        ]
+    
+    def run_ffmpeg(self, command, timeout=None, segment=False):
+        """Run an ffmpeg command through the machine-wide scheduler; True on success.
+        segment: one piece of a segmented proxy (runners shouldn't treat it as overall progress)"""
+        if self.runner is not None:
+            return self.runner(command, timeout=timeout, segment=segment)
+        return get_scheduler().run(command, kind='proxy', timeout=timeout)
+    
     def get_proxy_info(self, proxy_path, session_id, original_filename):
         """Get proxy file information"""
         if not os.path.exists(proxy_path):
@@ -108,14 +231,8 @@ class ProxyManager:
         }
     
     def get_file_hash(self, file_path):
-        """Generate hash for file"""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            buf = f.read(65536)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = f.read(65536)
-        return hasher.hexdigest()
+        """Content hash of a file, with the same algorithm the upload routes use"""
+        return file_digest(file_path)['digest']
     
     def cleanup_old_proxies(self, max_age_hours=24):
         """Delete proxies older than specified hours"""
@@ -125,6 +242,9 @@ class ProxyManager:
         for proxy_file in os.listdir(self.proxy_dir):
             proxy_path = os.path.join(self.proxy_dir, proxy_file)
             if os.path.isfile(proxy_path):
+                # Shared proxies live until their last session releases them
+                if self.store is not None and self.store.is_referenced(proxy_path):
+                    continue
                 file_age = datetime.fromtimestamp(os.path.getmtime(proxy_path))
                 age_hours = (now - file_age).total_seconds() / 3600
                 
@@ -132,4 +252,27 @@ class ProxyManager:
                     os.remove(proxy_path)
                     deleted_count += 1
         
+        # HLS proxies are directories (the files beside them are claim locks);
+        # never delete one still being written
+        hls_dir = os.path.join(self.proxy_dir, 'hls')
+        for name in os.listdir(hls_dir) if os.path.isdir(hls_dir) else []:
+            out_dir = os.path.join(hls_dir, name)
+            if not os.path.isdir(out_dir) or hls_status(out_dir) == 'encoding':
+                continue
+            if self.store is not None and self.store.is_referenced(out_dir):
+                continue
+            age_hours = (now - datetime.fromtimestamp(os.path.getmtime(out_dir))).total_seconds() / 3600
+            if age_hours > max_age_hours:
+                remove_path(out_dir)
+                deleted_count += 1
+        
+        # Checkpoints of segmented encodes that were never resumed (every new segment touches the directory)
+        segments_dir = os.path.join(self.proxy_dir, 'segments')
+        for name in os.listdir(segments_dir) if os.path.isdir(segments_dir) else []:
+            work_dir = os.path.join(segments_dir, name)
+            age_hours = (now - datetime.fromtimestamp(os.path.getmtime(work_dir))).total_seconds() / 3600
+            if age_hours > max_age_hours:
+                remove_path(work_dir)
+                deleted_count += 1
+        
         return deleted_count
\ No newline at end of file
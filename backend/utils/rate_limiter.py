@@ -0,0 +1,256 @@
+# rate_limiter.py
+"""
+Token-bucket rate limiting for the LLM routes (/api/chat, /ai/generate):
+- One bucket per route and client address (never a client-chosen id,
+  which could simply be rotated)
+- Requests cost their prompt's estimated tokens plus the max_tokens they
+  ask for; what the reply didn't use is refunded when it finishes
+- On by default (RATE_LIMIT_ENABLED=0 turns it off)
+- Buckets live in Redis (REDIS_URL) and are shared by every worker;
+  in-process buckets otherwise
+- Denials carry a Retry-After; allowed/limited counters for /api/health
+"""
+
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from state_backend import get_state_client, LocalRedis
+except ImportError:
+    from utils.state_backend import get_state_client, LocalRedis
+
+# Bucket size and refill, in LLM tokens (a chat turn is typically a few hundred)
+DEFAULT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 20000))
+DEFAULT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_TOKENS_PER_MINUTE', 10000))
+MAX_TOKENS_LIMIT = 32768
+
+Decision = namedtuple('Decision', 'allowed retry_after remaining cost')
+
+# Refill and take atomically; TIME keeps every worker on the Redis clock.
+# Floats are returned as strings (Lua numbers become integers in replies).
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry), tostring(tokens)}
+"""
+
+# Give tokens back to a bucket (a missing bucket is already full)
+REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if not tokens then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[2]), tokens + tonumber(ARGV[1]))))
+return 1
+"""
+
+
+def client_identity(remote_addr=None, forwarded_for=None):
+    """Bucket owner: the client IP.
+
+    X-Forwarded-For is only trusted with RATE_LIMIT_TRUST_PROXY=1.
+    """
+    if forwarded_for and os.environ.get('RATE_LIMIT_TRUST_PROXY') == '1':
+        remote_addr = forwarded_for.split(',')[0].strip()
+    return f"ip:{remote_addr or 'unknown'}"
+
+
+def estimate_tokens(text):
+    """Rough LLM token count (~4 characters per token)"""
+    return math.ceil(len(str(text or '')) / 4)
+
+
+def request_cost(prompt, max_tokens):
+    """Tokens charged up front: the prompt plus the whole reply it may ask for"""
+    return estimate_tokens(prompt) + max_tokens
+
+
+def parse_max_tokens(value, default=1000):
+    """max_tokens from a request body; ValueError for anything but 1..32768"""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError('max_tokens must be an integer')
+    try:
+        tokens = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('max_tokens must be an integer')
+    if tokens != value and not (isinstance(value, str) and value.strip().isdigit()):
+        raise ValueError('max_tokens must be an integer')
+    if not 1 <= tokens <= MAX_TOKENS_LIMIT:
+        raise ValueError(f'max_tokens must be between 1 and {MAX_TOKENS_LIMIT}')
+    return tokens
+
+
+class RateLimiter:
+    """Weighted token buckets per (route, caller)"""
+
+    def __init__(self, client=None, burst=DEFAULT_BURST, per_minute=DEFAULT_PER_MINUTE,
+                 routes=None, prefix='ratelimit'):
+        self.client = client or get_state_client()
+        self.prefix = prefix
+        self.default = (per_minute / 60.0, float(burst))
+        self.routes = {route: (pm / 60.0, float(b)) for route, (b, pm) in (routes or {}).items()}
+        self.enabled = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+
+        self._script = self._refund_script = None
+        if not isinstance(self.client, LocalRedis):
+            try:
+                self._script = self.client.register_script(TAKE_SCRIPT)
+                self._refund_script = self.client.register_script(REFUND_SCRIPT)
+            except Exception as e:
+                print(f"⚠️ Rate limiter scripts unavailable ({e}), using in-process buckets")
+        self._buckets = {}      # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+        self._metrics = {}      # route -> counters
+
+    def limits(self, route):
+        """(tokens per second, burst) for a route"""
+        return self.routes.get(route, self.default)
+
+    def hit(self, route, identity, cost):
+        """Take `cost` tokens from the caller's bucket for this route"""
+        rate, capacity = self.limits(route)
+        # A request bigger than the bucket is allowed, but only from a full one
+        cost = min(max(float(cost), 1.0), capacity)
+        if not self.enabled:
+            return Decision(True, 0, capacity, cost)
+
+        key = f"{self.prefix}:{route}:{identity}"
+        try:
+            if self._script is not None:
+                allowed, retry, tokens = self._script(keys=[key], args=[rate, capacity, cost])
+                decision = Decision(bool(int(allowed)), float(retry), float(tokens), cost)
+            else:
+                decision = self._take_local(key, rate, capacity, cost)
+        except Exception as e:
+            # Never turn a limiter outage into an API outage
+            print(f"Rate limiter error: {e}")
+            decision = Decision(True, 0, capacity, cost)
+
+        self._count(route, decision)
+        return decision
+
+    def settle(self, route, identity, decision, prompt, reply):
+        """Refund the part of an allowed request's charge its reply didn't use"""
+        if not self.enabled or not decision.allowed:
+            return 0
+        unused = int(decision.cost) - estimate_tokens(prompt) - estimate_tokens(reply)
+        if unused <= 0:
+            return 0
+        rate, capacity = self.limits(route)
+        key = f"{self.prefix}:{route}:{identity}"
+        try:
+            if self._refund_script is not None:
+                self._refund_script(keys=[key], args=[unused, capacity])
+            else:
+                with self._lock:
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket[0] = min(capacity, bucket[0] + unused)
+        except Exception as e:
+            print(f"Rate limiter error: {e}")
+            return 0
+        with self._lock:
+            if route in self._metrics:
+                self._metrics[route]['tokens_refunded'] += unused
+        return unused
+
+    def _take_local(self, key, rate, capacity, cost):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                if len(self._buckets) > 10000:
+                    self._prune(now)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return Decision(True, 0, bucket[0], cost)
+            bucket[0] = tokens
+            return Decision(False, (cost - tokens) / rate, tokens, cost)
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely (they hold no state)"""
+        for key, (tokens, ts) in list(self._buckets.items()):
+            rate, capacity = self.limits(key.split(':')[1])
+            if tokens + (now - ts) * rate >= capacity:
+                del self._buckets[key]
+
+    def _count(self, route, decision):
+        with self._lock:
+            m = self._metrics.setdefault(route, {'allowed': 0, 'limited': 0, 'tokens_allowed': 0,
+                                                 'tokens_limited': 0, 'tokens_refunded': 0})
+            if decision.allowed:
+                m['allowed'] += 1
+                m['tokens_allowed'] += int(decision.cost)
+            else:
+                m['limited'] += 1
+                m['tokens_limited'] += int(decision.cost)
+
+    def stats(self):
+        with self._lock:
+            routes = {route: dict(m) for route, m in self._metrics.items()}
+            local_buckets = len(self._buckets)
+        return {
+            'enabled': self.enabled,
+            'backend': 'redis' if self._script is not None else 'in-process',
+            'limits': {route: {'burst': capacity, 'tokens_per_minute': round(rate * 60)}
+                       for route, (rate, capacity) in
+                       [('default', self.default)] + list(self.routes.items())},
+            'routes': routes,
+            'local_buckets': local_buckets
+        }
+
+
+def limit_headers(decision):
+    """Response headers for a decision (Retry-After only on denials)"""
+    headers = {'X-RateLimit-Remaining': str(int(decision.remaining))}
+    if not decision.allowed:
+        headers['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+    return headers
+
+
+def limited_body(decision):
+    """JSON body for a 429"""
+    return {
+        'error': 'Rate limit exceeded',
+        'retry_after': max(1, math.ceil(decision.retry_after)),
+        'requested_tokens': int(decision.cost),
+        'success': False
+    }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Process-wide limiter shared by every route"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
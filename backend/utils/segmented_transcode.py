@@ -0,0 +1,174 @@
+# segmented_transcode.py
+"""
+Segmented proxy encoding for long uploads:
+- The source is split at keyframes into ~PROXY_SEGMENT_SECONDS pieces
+- Video segments are encoded side by side (one ffmpeg per segment, in the
+  machine-wide scheduler's slots); audio is encoded once, in parallel,
+  so there are no AAC priming gaps at segment joins
+- Pieces are joined with the concat demuxer and stream copy (lossless)
+- Finished segments are checkpointed on disk: a timeout, crash or job
+  retry redoes only the missing ones
+- on_segment reports each finished segment, so the first minutes of the
+  proxy can be previewed before the rest is done
+"""
+
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SEGMENT_SECONDS = float(os.environ.get('PROXY_SEGMENT_SECONDS', 20))
+MIN_DURATION = float(os.environ.get('PROXY_SEGMENT_MIN_DURATION', 120))
+SEGMENT_TIMEOUT = 120
+SEGMENT_ATTEMPTS = 2
+
+
+def probe_media(path):
+    """Duration and whether there is an audio stream"""
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'quiet', '-show_entries',
+                                 'format=duration:stream=codec_type', '-of', 'json', path],
+                                capture_output=True, text=True, timeout=10)
+        data = json.loads(result.stdout or '{}')
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return {'duration': 0.0, 'has_audio': False}
+    return {
+        'duration': float(data.get('format', {}).get('duration', 0) or 0),
+        'has_audio': any(s.get('codec_type') == 'audio' for s in data.get('streams', []))
+    }
+
+
+def keyframe_times(path):
+    """Timestamps of the video keyframes (packet flags only, nothing is decoded)"""
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path],
+                            capture_output=True, text=True, timeout=120)
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' in flags and pts not in ('', 'N/A'):
+            times.append(float(pts))
+    return sorted(set(times))
+
+
+def plan_segments(keyframes, duration, target=SEGMENT_SECONDS):
+    """[(start, end)] cut at keyframes, each at least `target` seconds (the last may be shorter)"""
+    cuts = [0.0]
+    for t in keyframes:
+        if t - cuts[-1] >= target and duration - t >= target / 2:
+            cuts.append(t)
+    return [(start, end) for start, end in zip(cuts, cuts[1:] + [duration])]
+
+
+class SegmentedTranscoder:
+    """Encodes one source as parallel segments with on-disk checkpoints"""
+
+    def __init__(self, work_dir, run, workers=4):
+        self.work_dir = work_dir
+        self.run = run          # run(command, timeout) -> bool
+        self.workers = workers
+
+    def _plan(self, source, args):
+        """Segment plan, reused from the checkpoint if it is for the same source and settings"""
+        plan_file = os.path.join(self.work_dir, 'plan.json')
+        size = os.path.getsize(source)
+        if os.path.exists(plan_file):
+            with open(plan_file) as f:
+                plan = json.load(f)
+            if plan.get('size') == size and plan.get('args') == args:
+                return plan
+            # Different source or settings: old segments are no use
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            os.makedirs(self.work_dir, exist_ok=True)
+        info = probe_media(source)
+        plan = {'size': size, 'args': args, 'duration': info['duration'], 'has_audio': info['has_audio'],
+                'segments': plan_segments(keyframe_times(source), info['duration'])}
+        with open(plan_file + '.tmp', 'w') as f:
+            json.dump(plan, f)
+        os.replace(plan_file + '.tmp', plan_file)
+        return plan
+
+    def segment_path(self, index):
+        return os.path.join(self.work_dir, f"seg_{index:05d}.mp4")
+
+    def _encode(self, command_for, output, timeout):
+        """Run one piece into output (written as .part, renamed when complete)"""
+        if os.path.exists(output):
+            return True  # checkpoint
+        tmp_path = f"{output[:-4]}.part{output[-4:]}"
+        for attempt in range(SEGMENT_ATTEMPTS):
+            try:
+                if self.run(command_for(tmp_path), timeout=timeout) and os.path.exists(tmp_path):
+                    os.replace(tmp_path, output)
+                    return True
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return False
+
+    def transcode(self, source, output, video_args, audio_args, on_segment=None):
+        """Encode source to output; True on success. Checkpoints survive a failure."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        plan = self._plan(source, list(video_args) + list(audio_args))
+        segments = plan['segments']
+        if not segments:
+            return False
+        done = [os.path.exists(self.segment_path(i)) for i in range(len(segments))]
+        if any(done):
+            print(f"♻️ Resuming segmented proxy: {sum(done)}/{len(segments)} segments done")
+
+        def video_segment(index):
+            start, end = segments[index]
+            return index, self._encode(
+                lambda out: ['ffmpeg', '-ss', f"{start:.6f}", '-i', source, '-t', f"{end - start:.6f}",
+                             *video_args, '-an', '-avoid_negative_ts', 'make_zero', '-y', out],
+                self.segment_path(index), SEGMENT_TIMEOUT)
+
+        audio_path = os.path.join(self.work_dir, 'audio.m4a')
+
+        def audio_track():
+            return 'audio', self._encode(
+                lambda out: ['ffmpeg', '-i', source, '-vn', *audio_args, '-y', out],
+                audio_path, max(SEGMENT_TIMEOUT, plan['duration']))
+
+        ok = True
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='segment') as pool:
+            # Audio first: it is the longest single piece, queued last it would finish last
+            futures = [pool.submit(audio_track)] if plan['has_audio'] else []
+            # Then video in order, so the first segments finish first and can be previewed early
+            futures += [pool.submit(video_segment, i) for i in range(len(segments)) if not done[i]]
+            try:
+                for future in as_completed(futures):
+                    index, success = future.result()
+                    ok = ok and success
+                    if index != 'audio' and success:
+                        done[index] = True
+                        if on_segment:
+                            ready = done.index(False) if False in done else len(done)
+                            on_segment({'index': index, 'path': self.segment_path(index),
+                                        'done': sum(done), 'total': len(done), 'ready': ready,
+                                        'ready_seconds': segments[ready - 1][1] if ready else 0.0})
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        if not ok:
+            print(f"Segmented proxy incomplete: {sum(done)}/{len(done)} segments (kept for resume)")
+            return False
+
+        list_file = os.path.join(self.work_dir, 'segments.txt')
+        with open(list_file, 'w') as f:
+            for i in range(len(segments)):
+                f.write(f"file '{os.path.basename(self.segment_path(i))}'\n")
+        command = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if plan['has_audio']:
+            command += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        command += ['-c', 'copy', '-movflags', '+faststart', '-y', output]
+        if not self.run(command, timeout=max(SEGMENT_TIMEOUT, plan['duration'] / 10)):
+            return False
+        return True
+
+    def discard(self):
+        """Delete the checkpoints (after the joined file is in place)"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
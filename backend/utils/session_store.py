@@ -0,0 +1,159 @@
+# session_store.py
+"""
+In-process session store for the chat servers:
+- Idle expiry tracked on a min-heap (reaping costs O(expired * log n))
+- Max-entries cap with least-recently-used eviction
+- Background reaper thread, lock-protected access for threaded servers
+- Gauges for live sessions and evictions
+"""
+
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionStore:
+    """Dict-like session registry with TTL + LRU eviction"""
+
+    def __init__(self, ttl_seconds=None, max_entries=None, reap_interval=60, on_evict=None):
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('SESSION_TTL', 3600))
+        self.max_entries = max_entries or int(os.environ.get('MAX_SESSIONS', 1000))
+        self.reap_interval = reap_interval
+        self.on_evict = on_evict
+
+        self._entries = OrderedDict()  # key -> value, least recently used first
+        self._deadlines = {}           # key -> monotonic expiry time
+        self._heap = []                # (deadline, key); stale entries skipped lazily
+        self._lock = threading.RLock()
+
+        self.evicted_expired = 0
+        self.evicted_lru = 0
+        self.reaper_runs = 0
+
+        self._stop = threading.Event()
+        self._reaper = None
+        if reap_interval:
+            self._reaper = threading.Thread(target=self._reap_loop, name='session-reaper', daemon=True)
+            self._reaper.start()
+
+    # ===== MAPPING API =====
+
+    def get(self, key, default=None):
+        """Look up a session and refresh its idle timer"""
+        with self._lock:
+            if key not in self._entries or self._expired(key):
+                return default
+            self._touch(key)
+            return self._entries[key]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._touch(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._evict(oldest)
+                self.evicted_lru += 1
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._entries.pop(key)
+            self._deadlines.pop(key, None)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._deadlines.pop(key, None)
+            return self._entries.pop(key, default)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries and not self._expired(key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    # ===== EXPIRY =====
+
+    def _touch(self, key):
+        deadline = time.monotonic() + self.ttl_seconds
+        self._deadlines[key] = deadline
+        self._entries.move_to_end(key)
+        heapq.heappush(self._heap, (deadline, key))
+        # Every touch leaves a stale heap entry behind; rebuild when they dominate
+        if len(self._heap) > 4 * len(self._deadlines) + 64:
+            self._heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _expired(self, key):
+        return self._deadlines.get(key, 0) <= time.monotonic()
+
+    def _evict(self, key):
+        value = self._entries.pop(key)
+        self._deadlines.pop(key, None)
+        if self.on_evict:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"Session evict hook error: {e}")
+
+    def reap(self):
+        """Drop every session past its idle deadline; returns how many were removed"""
+        removed = 0
+        now = time.monotonic()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) != deadline:
+                    continue  # touched since, or already gone
+                self._evict(key)
+                removed += 1
+            self.evicted_expired += removed
+            self.reaper_runs += 1
+        return removed
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Session reaper error: {e}")
+
+    def close(self):
+        self._stop.set()
+
+    # ===== GAUGES =====
+
+    def stats(self):
+        with self._lock:
+            return {
+                'live': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'evicted_expired': self.evicted_expired,
+                'evicted_lru': self.evicted_lru,
+                'reaper_runs': self.reaper_runs
+            }
+
+
+_MISSING = object()
@@ -0,0 +1,340 @@
+# state_backend.py
+"""
+Shared state backend for chat sessions and Flask sessions:
+- Redis (REDIS_URL) so any worker process can serve any request
+- Pipelined reads/writes: one round trip per load or update
+- Compact serialization (msgpack when installed, otherwise compact JSON)
+- In-process stand-in with the same command surface when Redis is absent
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+
+def pack(value):
+    """Serialize for storage (msgpack or compact JSON)"""
+    if MSGPACK_AVAILABLE:
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def unpack(data):
+    if data is None:
+        return None
+    if MSGPACK_AVAILABLE and data[:1] not in (b'{', b'['):
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+class LocalRedis:
+    """Single-process stand-in implementing the Redis commands used here.
+
+    Mirrors redis-py signatures, so fakeredis.FakeRedis can be passed
+    wherever a client is expected as well. Expired keys are dropped when
+    touched, on writes and by a periodic sweep, so abandoned sessions
+    don't pile up in memory.
+    """
+
+    SWEEP_SECONDS = 60
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.RLock()
+        self._next_sweep = time.time() + self.SWEEP_SECONDS
+        sweeper = threading.Thread(target=LocalRedis._sweep_forever, args=(weakref.ref(self),),
+                                   daemon=True, name='state-sweep')
+        sweeper.start()
+
+    @staticmethod
+    def _sweep_forever(ref):
+        while True:
+            time.sleep(LocalRedis.SWEEP_SECONDS)
+            client = ref()
+            if client is None:
+                return
+            client.purge_expired()
+            del client
+
+    def purge_expired(self):
+        """Drop every expired key; returns how many"""
+        with self._lock:
+            now = time.time()
+            self._next_sweep = now + self.SWEEP_SECONDS
+            expired = [key for key, deadline in self._expiry.items() if deadline <= now]
+            for key in expired:
+                self._data.pop(key, None)
+                self._expiry.pop(key, None)
+            return len(expired)
+
+    def _written(self):
+        """Called by every write: sweep if one is due"""
+        if time.time() >= self._next_sweep:
+            self.purge_expired()
+
+    def _live(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return self._data.get(key)
+
+    def _container(self, key, factory):
+        """Live value of key for a mutator, a fresh one if it is missing or expired"""
+        value = self._live(key)
+        if value is None:
+            value = self._data[key] = factory()
+        return value
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._written()
+            self._data[key] = value
+            self._expiry.pop(key, None)
+            if ex:
+                self._expiry[key] = time.time() + ex
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                self._expiry.pop(key, None)
+                removed += self._data.pop(key, None) is not None
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            self._expiry[key] = time.time() + seconds
+            return True
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._written()
+            self._container(key, dict).update(mapping)
+            return len(mapping)
+
+    def hget(self, key, field):
+        with self._lock:
+            return (self._live(key) or {}).get(field)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._live(key) or {})
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            self._written()
+            h = self._container(key, dict)
+            h[field] = int(h.get(field, 0)) + amount
+            return h[field]
+
+    def rpush(self, key, *values):
+        with self._lock:
+            self._written()
+            items = self._container(key, list)
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._live(key) or []
+            end = len(items) if end == -1 else end + 1
+            return list(items[start:end])
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            items = self._live(key)
+            if items is not None:
+                end = len(items) if end == -1 else end + 1
+                self._data[key] = items[start:end]
+            return True
+
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    """Queues commands and runs them together, like a redis-py pipeline"""
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [command(*args, **kwargs) for command, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+def get_state_client(url=None):
+    """Redis client for REDIS_URL, or the in-process stand-in"""
+    url = url or os.environ.get('REDIS_URL')
+    if url and REDIS_AVAILABLE:
+        try:
+            client = redis.Redis.from_url(url, socket_timeout=2)
+            client.ping()
+            print(f"🔗 State backend: Redis ({url})")
+            return client
+        except Exception as e:
+            print(f"⚠️ Redis unavailable ({e}), using in-process state")
+    else:
+        print("💾 State backend: in-process")
+    return LocalRedis()
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class SharedSessionState:
+    """Chat session state (metadata, recent messages, agent conversation) in a shared store"""
+
+    def __init__(self, client=None, prefix='chat', ttl_seconds=None, window=100):
+        self.client = client or get_state_client()
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('SESSION_TTL', 3600))
+        self.window = window
+
+    def _keys(self, session_id):
+        base = f"{self.prefix}:session:{session_id}"
+        return f"{base}:meta", f"{base}:messages", f"{base}:conversation_log"
+
+    def load(self, session_id):
+        """Metadata, message window and agent conversation in one round trip"""
+        meta_key, messages_key, conversation_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.hgetall(meta_key)
+        pipe.lrange(messages_key, -self.window, -1)
+        pipe.lrange(conversation_key, 0, -1)
+        meta, messages, conversation = pipe.execute()
+        if not meta:
+            return None
+
+        meta = {_text(k): _text(v) for k, v in meta.items()}
+        meta['version'] = int(meta.get('version', 0))
+        meta['message_count'] = int(meta.get('message_count', 0))
+        return {
+            'meta': meta,
+            'messages': [unpack(m) for m in messages],
+            'conversation': [unpack(c) for c in conversation] or None
+        }
+
+    def version(self, session_id):
+        """Cheap freshness check for a locally cached session"""
+        value = self.client.hget(self._keys(session_id)[0], 'version')
+        return int(value) if value is not None else None
+
+    def record(self, session_id, meta, message=None, conversation=None, replace=False):
+        """Write an update in one pipeline; returns the new version.
+
+        conversation holds the agent conversation entries added since the
+        last record (appended), or the whole conversation with replace=True.
+        """
+        meta_key, messages_key, conversation_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.hset(meta_key, mapping={k: str(v) for k, v in meta.items() if v is not None})
+        pipe.hincrby(meta_key, 'version', 1)
+        pipe.expire(meta_key, self.ttl_seconds)
+        if message is not None:
+            pipe.rpush(messages_key, pack(message))
+            pipe.ltrim(messages_key, -self.window, -1)
+            pipe.expire(messages_key, self.ttl_seconds)
+        if conversation is not None:
+            if replace:
+                pipe.delete(conversation_key)
+            if conversation:
+                pipe.rpush(conversation_key, *[pack(entry) for entry in conversation])
+            pipe.expire(conversation_key, self.ttl_seconds)
+        return int(pipe.execute()[1])
+
+    def delete(self, session_id):
+        self.client.delete(*self._keys(session_id))
+
+
+class StateSession(CallbackDict, SessionMixin):
+    """Server-side Flask session; the cookie only carries its id"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class StateSessionInterface(SessionInterface):
+    """Stores Flask session data in the shared state backend"""
+
+    def __init__(self, client=None, prefix='flask_session'):
+        self.client = client or get_state_client()
+        self.prefix = prefix
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = unpack(self.client.get(f"{self.prefix}:{sid}"))
+            if data is not None:
+                return StateSession(data, sid=sid)
+        return StateSession(sid=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        key = f"{self.prefix}:{session.sid}"
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.client.delete(key)
+                response.delete_cookie(self.get_cookie_name(app), domain=domain, path=path)
+            return
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        if session.modified or session.new:
+            self.client.set(key, pack(dict(session)), ex=ttl)
+        else:
+            self.client.expire(key, ttl)
+
+        response.set_cookie(self.get_cookie_name(app), session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,120 @@
+# suggestion_pool.py
+"""
+Stale-while-revalidate pool of AI suggestion sets for page renders:
+- N suggestion sets precomputed in the background and rotated per request
+- Served instantly; stale sets trigger a background refresh, never a wait
+- Static fallback while the pool is still empty
+- Hit / miss / stale counters to verify render latency
+"""
+
+import threading
+import time
+from datetime import datetime
+
+FALLBACK_SUGGESTIONS = """1. **Day-in-the-life vlog** - film one ordinary day and cut it to a 60-second story with a strong hook.
+2. **Before / after build** - document a project from blank canvas to finished piece, with time-lapse transitions.
+3. **Myth vs. fact short series** - three quick episodes busting common myths in your niche."""
+
+
+class SuggestionPool:
+    """Rotates precomputed generations and refreshes them off the request path"""
+
+    def __init__(self, generate, size=4, ttl_seconds=900, refresh_interval=None, fallback=FALLBACK_SUGGESTIONS):
+        self.generate = generate          # callable -> str or None
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self.refresh_interval = refresh_interval or ttl_seconds
+        self.fallback = fallback
+
+        self._entries = []                # [(created_at, text)]
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self):
+        """Fill the pool now (in the background) and keep it fresh on a schedule"""
+        def loop():
+            while not self._stop.is_set():
+                self.refresh()
+                self._stop.wait(self.refresh_interval)
+        threading.Thread(target=loop, name='suggestion-pool', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self):
+        """Next suggestion set, or the fallback when nothing has been generated yet"""
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                entry = None
+            else:
+                entry = self._entries[self._cursor % len(self._entries)]
+                self._cursor += 1
+                stale = time.time() - entry[0] > self.ttl_seconds
+                if stale:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+
+        if entry is None or stale:
+            self.refresh_async()
+        return entry[1] if entry else self.fallback
+
+    def refresh_async(self):
+        """Start a refresh unless one is already running"""
+        if not self._refreshing.is_set():
+            threading.Thread(target=self.refresh, name='suggestion-refresh', daemon=True).start()
+
+    def refresh(self):
+        """Regenerate the pool; keeps the old sets if generation fails"""
+        with self._lock:
+            if self._refreshing.is_set():
+                return
+            self._refreshing.set()
+        try:
+            fresh = []
+            for _ in range(self.size):
+                try:
+                    text = self.generate()
+                except Exception as e:
+                    print(f"Suggestion generation failed: {e}")
+                    text = None
+                if text:
+                    fresh.append((time.time(), text))
+                else:
+                    self.failures += 1
+            if fresh:
+                with self._lock:
+                    # Keep any unexpired old sets if we came up short
+                    keep = [e for e in self._entries if time.time() - e[0] <= self.ttl_seconds]
+                    self._entries = (fresh + keep)[:self.size]
+                self.refreshes += 1
+        finally:
+            self._refreshing.clear()
+
+    def stats(self):
+        with self._lock:
+            served = self.hits + self.stale_hits + self.misses
+            oldest = min((e[0] for e in self._entries), default=None)
+            return {
+                'pool_size': len(self._entries),
+                'target_size': self.size,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.stale_hits) / served, 3) if served else None,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'refreshing': self._refreshing.is_set(),
+                'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else None,
+                'timestamp': datetime.now().isoformat()
+            }
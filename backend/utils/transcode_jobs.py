@@ -0,0 +1,449 @@
+# transcode_jobs.py
+"""
+Background transcoding jobs (proxy, web cache, export):
+- Celery workers on Redis (TRANSCODE_BACKEND=celery): jobs survive web
+  restarts and are re-delivered if a worker dies mid-job
+- In-process thread pool otherwise, for single-box dev
+- Progress percentages parsed from `ffmpeg -progress`; ffmpeg itself runs
+  in ffmpeg_scheduler's machine-wide slots
+- Job state in the shared state backend, so any web worker can report it
+- Cancellation (kills ffmpeg) and automatic retries with backoff
+
+Worker: cd backend/utils && celery -A transcode_jobs.celery_app worker -Q transcode
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    from state_backend import get_state_client
+    from persistence import update_json
+    from proxy_manager import ProxyManager
+    from video_cache_manager import CacheManager
+    from media_store import get_media_store
+    from ffmpeg_scheduler import get_scheduler
+except ImportError:
+    from utils.state_backend import get_state_client
+    from utils.persistence import update_json
+    from utils.proxy_manager import ProxyManager
+    from utils.video_cache_manager import CacheManager
+    from utils.media_store import get_media_store
+    from utils.ffmpeg_scheduler import get_scheduler
+
+try:
+    from celery import Celery
+    CELERY_AVAILABLE = True
+except ImportError:
+    CELERY_AVAILABLE = False
+
+BACKEND = os.environ.get('TRANSCODE_BACKEND', 'local')
+BROKER_URL = os.environ.get('CELERY_BROKER_URL') or os.environ.get('REDIS_URL')
+TERMINAL = ('done', 'error', 'cancelled')
+JOB_TTL = 7 * 24 * 3600
+RETRY_BACKOFF = 5  # seconds, doubled per attempt
+
+
+class JobCancelled(BaseException):
+    """Raised inside a job when cancellation is requested.
+
+    A BaseException so the managers' `except Exception` fallbacks
+    (e.g. copy the original when conversion fails) don't swallow it.
+    """
+
+
+# ===== JOB STATE =====
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class JobStore:
+    """Job records as hashes in Redis (or the in-process stand-in)"""
+
+    def __init__(self, client=None, prefix='transcode'):
+        self.client = client or get_state_client()
+        self.prefix = prefix
+
+    def _key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def create(self, kind, args, max_retries=2, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            'job_id': job_id, 'kind': kind, 'args': json.dumps(args), 'status': 'queued',
+            'progress': 0, 'attempts': 0, 'max_retries': max_retries, 'cancel': 0,
+            'created': now, 'updated': now
+        })
+        pipe.expire(self._key(job_id), JOB_TTL)
+        pipe.rpush(f"{self.prefix}:jobs", job_id)
+        pipe.ltrim(f"{self.prefix}:jobs", -1000, -1)
+        pipe.execute()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        raw = self.client.hgetall(self._key(job_id))
+        if not raw:
+            return None
+        job = {_text(k): _text(v) for k, v in raw.items()}
+        job['args'] = json.loads(job.get('args') or '{}')
+        job['result'] = json.loads(job['result']) if job.get('result') else None
+        job['progress'] = float(job.get('progress', 0))
+        for field in ('attempts', 'max_retries', 'cancel'):
+            job[field] = int(job.get(field, 0))
+        return job
+
+    def update(self, job_id, **fields):
+        fields['updated'] = datetime.now().isoformat()
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        self.client.hset(self._key(job_id), mapping={k: v for k, v in fields.items() if v is not None})
+
+    def cancel_requested(self, job_id):
+        return str(_text(self.client.hget(self._key(job_id), 'cancel'))) == '1'
+
+    def recent(self, limit=50):
+        ids = [_text(i) for i in self.client.lrange(f"{self.prefix}:jobs", -limit, -1)]
+        return [job for job in (self.get(i) for i in reversed(ids)) if job]
+
+
+# ===== FFMPEG WITH PROGRESS =====
+
+def probe_duration(path):
+    """Media duration in seconds (0 if unknown)"""
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
+                                 '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                                capture_output=True, text=True, timeout=10)
+        return float(result.stdout.strip() or 0)
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return 0.0
+
+
+class JobContext:
+    """What a running handler uses to report progress and notice cancellation"""
+
+    def __init__(self, jobs, job_id, kind='proxy'):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.kind = kind  # scheduler priority class
+        self._last_report = 0
+        self._last_check = 0
+        self._progress = 0.0
+
+    def progress(self, percent):
+        """Record progress (throttled to a write every 0.5 s or 1%)"""
+        percent = round(min(max(percent, 0.0), 100.0), 1)
+        now = time.time()
+        if percent >= 100 or percent - self._progress >= 1 or now - self._last_report >= 0.5:
+            self._progress = percent
+            self._last_report = now
+            self.jobs.update(self.job_id, progress=percent)
+
+    def check_cancelled(self):
+        now = time.time()
+        if now - self._last_check >= 0.5:
+            self._last_check = now
+            if self.jobs.cancel_requested(self.job_id):
+                raise JobCancelled()
+
+    def run_ffmpeg(self, command, duration=0, timeout=None):
+        """Run ffmpeg in a scheduler slot reporting progress; True on success. Killed on cancel."""
+        def on_progress(key, value):
+            # out_time_ms is microseconds too (a long-standing ffmpeg misnomer)
+            if key in ('out_time_us', 'out_time_ms') and duration and value.isdigit():
+                self.progress(int(value) / 1e6 / duration * 100)
+            elif key == 'progress' and value == 'end' and duration:
+                self.progress(100)
+
+        return get_scheduler().run(command, kind=self.kind, timeout=timeout,
+                                   progress=on_progress, check=self.check_cancelled)
+
+
+# ===== HANDLERS =====
+
+HANDLERS = {}
+STATUS_HOOKS = {}
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def status_hook(kind):
+    """Register fn(args, status), called when a job of this kind ends in error or
+    cancelled, or is queued again by retry()"""
+    def register(fn):
+        STATUS_HOOKS[kind] = fn
+        return fn
+    return register
+
+
+def _store(root):
+    """The process's MediaStore for root (the same instance the web app uses)"""
+    return get_media_store(root) if root else None
+
+
+def _update_session(session_file, **fields):
+    if session_file:
+        update_json(session_file, fields)
+
+
+@handler('proxy')
+def proxy_job(ctx, args):
+    """Editing proxy for an upload; fills in proxy fields of session.json when done"""
+    manager = ProxyManager(args['proxy_dir'], store=_store(args.get('store_root')))
+    duration = probe_duration(args['original_path'])
+    # Segments report through on_segment; their own out_time isn't overall progress
+    manager.runner = lambda command, timeout=None, segment=False: \
+        ctx.run_ffmpeg(command, 0 if segment else duration, timeout)
+
+    def on_segment(segment):
+        ctx.progress(segment['done'] / segment['total'] * 99)
+        if segment['index'] < segment['ready']:
+            # The playable prefix grew: the editor can start on it
+            base = f"/static/proxies/segments/{os.path.basename(os.path.dirname(segment['path']))}"
+            _update_session(args.get('session_file'), proxy_status='partial',
+                            proxy_preview_seconds=segment['ready_seconds'],
+                            proxy_preview_segments=[f"{base}/seg_{i:05d}.mp4" for i in range(segment['ready'])])
+
+    manager.on_segment = on_segment
+    info = manager.create_proxy(args['original_path'], args['session_id'], args['filename'],
+                                file_hash=args.get('file_hash'))
+    if not info:
+        raise RuntimeError('Failed to create proxy')
+    _update_session(args.get('session_file'), proxy_url=info['proxy_url'],
+                    proxy_size_mb=info['size_mb'], proxy_status='ready', proxy_preview_segments=[])
+    return info
+
+
+@status_hook('proxy')
+def proxy_status(args, status):
+    """Keep session.json's proxy_status in step when no proxy is coming (or one is again)"""
+    _update_session(args.get('session_file'),
+                    proxy_status={'error': 'failed'}.get(status, status), proxy_preview_segments=[])
+
+
+@handler('cache')
+def cache_job(ctx, args):
+    """Web playback version of an upload"""
+    os.makedirs(args['cache_dir'], exist_ok=True)
+    manager = CacheManager(args['cache_dir'], store=_store(args.get('store_root')))
+    duration = probe_duration(args['original_path'])
+    manager.runner = lambda command, timeout=None: ctx.run_ffmpeg(command, duration, timeout)
+    try:
+        info = manager.create_cached_version(args['original_path'], args['session_id'],
+                                             file_hash=args.get('file_hash'), file_size=args.get('file_size'))
+    finally:
+        # Merged into cache_index.json, keeping entries the web app and other jobs wrote
+        manager.flush_cache_index()
+    if not info:
+        raise RuntimeError('Failed to create cached version')
+    return info
+
+
+@handler('export')
+def export_job(ctx, args):
+    """Export the edited original (currently a straight copy, like the sync route)"""
+    src, dest = args['original_path'], args['export_path']
+    total = os.path.getsize(src) or 1
+    copied = 0
+    tmp_path = f"{dest}.part"
+    try:
+        with open(src, 'rb') as fin, open(tmp_path, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(4 * 1024 * 1024), b''):
+                fout.write(chunk)
+                copied += len(chunk)
+                ctx.progress(copied / total * 100)
+                ctx.check_cancelled()
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {'export_path': dest, 'export_url': args.get('export_url')}
+
+
+# ===== QUEUE =====
+
+class TranscodeQueue:
+    """Submits jobs to Celery or a local pool and runs them with retries"""
+
+    def __init__(self, jobs=None, backend=BACKEND, workers=None):
+        self.jobs = jobs or JobStore()
+        self.backend = 'celery' if backend == 'celery' and celery_app is not None else 'local'
+        if backend == 'celery' and self.backend != 'celery':
+            print("⚠️ Celery unavailable (install celery, set REDIS_URL), using in-process transcoding")
+        self.workers = workers or int(os.environ.get('TRANSCODE_WORKERS', 2))
+        self.executor = None
+        if self.backend == 'local':
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+        print(f"🎬 Transcode queue: {self.backend}")
+
+    def submit(self, kind, args, max_retries=2, job_id=None):
+        """Queue a job; job_id may be picked beforehand so records naming the job exist before it runs"""
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = self.jobs.create(kind, args, max_retries, job_id)
+        self._dispatch(job['job_id'])
+        return job
+
+    def _dispatch(self, job_id, delay=0):
+        if self.backend == 'celery':
+            run_job.apply_async(args=[job_id], countdown=delay or None)
+        elif delay:
+            timer = threading.Timer(delay, self.executor.submit, args=(self.execute, job_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.executor.submit(self.execute, job_id)
+
+    def execute(self, job_id):
+        """Run one attempt of a job (in a Celery worker or the local pool)"""
+        job = self.jobs.get(job_id)
+        if not job or job['status'] in TERMINAL:
+            return
+        if job['cancel']:
+            self._stopped(job, 'cancelled')
+            return
+
+        attempts = job['attempts'] + 1
+        self.jobs.update(job_id, status='running', attempts=attempts, started=datetime.now().isoformat())
+        ctx = JobContext(self.jobs, job_id, job['kind'])
+        try:
+            result = HANDLERS[job['kind']](ctx, job['args'])
+            self.jobs.update(job_id, status='done', progress=100, result=result,
+                             finished=datetime.now().isoformat())
+            print(f"✅ {job['kind']} job {job_id} done")
+        except JobCancelled:
+            self._stopped(job, 'cancelled')
+            print(f"⏹️ {job['kind']} job {job_id} cancelled")
+        except Exception as e:
+            if attempts <= job['max_retries']:
+                delay = RETRY_BACKOFF * 2 ** (attempts - 1)
+                print(f"🔁 {job['kind']} job {job_id} failed ({e}), retry in {delay}s")
+                self.jobs.update(job_id, status='retrying', error=str(e))
+                self._dispatch(job_id, delay)
+            else:
+                print(f"❌ {job['kind']} job {job_id} failed: {e}")
+                self._stopped(job, 'error', error=str(e))
+
+    def _stopped(self, job, status, **fields):
+        """Record a job ending without a result and let its kind react"""
+        self.jobs.update(job['job_id'], status=status, finished=datetime.now().isoformat(), **fields)
+        self._notify(job, status)
+
+    def _notify(self, job, status):
+        hook = STATUS_HOOKS.get(job['kind'])
+        if hook:
+            try:
+                hook(job['args'], status)
+            except Exception as e:
+                print(f"⚠️ {job['kind']} job {job['job_id']} status hook failed: {e}")
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Flag a job; a running ffmpeg is killed within about a second"""
+        job = self.jobs.get(job_id)
+        if job and job['status'] not in TERMINAL:
+            self.jobs.update(job_id, cancel=1)
+            if job['status'] in ('queued', 'retrying'):
+                self._stopped(job, 'cancelled')
+        return self.jobs.get(job_id)
+
+    def retry(self, job_id):
+        """Run a failed or cancelled job again"""
+        job = self.jobs.get(job_id)
+        if not job or job['status'] not in ('error', 'cancelled'):
+            return job
+        self.jobs.update(job_id, status='queued', cancel=0, progress=0, error='',
+                         max_retries=job['attempts'] + job['max_retries'])
+        self._notify(job, 'queued')
+        self._dispatch(job_id)
+        return self.jobs.get(job_id)
+
+    def resume_pending(self):
+        """Local backend: requeue jobs a previous process left unfinished (needs Redis state)"""
+        if self.backend != 'local':
+            return 0
+        pending = [job for job in self.jobs.recent(1000) if job['status'] in ('queued', 'running', 'retrying')]
+        for job in pending:
+            self._dispatch(job['job_id'])
+        if pending:
+            print(f"🎬 Resumed {len(pending)} unfinished transcode jobs")
+        return len(pending)
+
+    def stats(self):
+        statuses = [job['status'] for job in self.jobs.recent(200)]
+        return {
+            'backend': self.backend,
+            'workers': self.workers if self.backend == 'local' else None,
+            **{status: statuses.count(status)
+               for status in ('queued', 'running', 'retrying', 'done', 'error', 'cancelled')}
+        }
+
+
+def job_events(queue, job_id, interval=0.5, keepalive=15):
+    """Server-Sent Events for a job's progress until it finishes"""
+    last = None
+    quiet_since = time.time()
+    while True:
+        job = queue.get(job_id)
+        if job is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+            return
+        state = (job['status'], job['progress'])
+        if state != last:
+            last = state
+            quiet_since = time.time()
+            event = job['status'] if job['status'] in TERMINAL else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+        elif time.time() - quiet_since >= keepalive:
+            quiet_since = time.time()
+            yield ": keep-alive\n\n"
+        if job['status'] in TERMINAL:
+            return
+        time.sleep(interval)
+
+
+# ===== CELERY =====
+
+celery_app = None
+if CELERY_AVAILABLE and BROKER_URL:
+    celery_app = Celery('transcode', broker=BROKER_URL)
+    celery_app.conf.update(
+        task_default_queue='transcode',
+        task_acks_late=True,              # re-delivered if the worker dies mid-job
+        task_reject_on_worker_lost=True,
+        worker_prefetch_multiplier=1,     # long jobs: don't hoard the queue
+    )
+
+    @celery_app.task(name='transcode.run')
+    def run_job(job_id):
+        get_transcode_queue().execute(job_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_transcode_queue():
+    """Process-wide queue (Celery workers use it to run jobs, too)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = TranscodeQueue()
+        return _queue
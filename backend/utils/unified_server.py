@@ -9,105 +9,34 @@ import sys
 import uuid
 import json
 import time
+import threading
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 from datetime import datetime
 from pathlib import Path
 
-# Chat history configuration
-CHAT_HISTORY_DIR = os.path.join(BASE_DIR, 'chat_history')
-os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
-
-class ChatHistoryManager:
-    """Manages persistent chat history with project folders"""
-    
-    @staticmethod
-    def get_project_path(project_name="General", agent_type="basic"):
-        """Get file path for a project's chat history"""
-        # Sanitize project name for filesystem
-        safe_name = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        if not safe_name:
-            safe_name = "General"
-        
-        # Create project directory
-        project_dir = os.path.join(CHAT_HISTORY_DIR, 'Projects', safe_name)
-        os.makedirs(project_dir, exist_ok=True)
-        
-        # Return file path
-        return os.path.join(project_dir, f"{agent_type}_agent.json")
-    
-    @staticmethod
-    def save_conversation(project_name, agent_type, messages):
-        """Save conversation to file"""
-        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
-        
-        chat_data = {
-            'project': project_name,
-            'agent_type': agent_type,
-            'last_updated': datetime.now().isoformat(),
-            'messages': messages,
-            'message_count': len(messages)
-        }
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, indent=2, ensure_ascii=False)
-        
-        print(f"💾 Saved chat: {project_name}/{agent_type} ({len(messages)} messages)")
-        return file_path
-    
-    @staticmethod
-    def load_conversation(project_name, agent_type):
-        """Load conversation from file"""
-        file_path = ChatHistoryManager.get_project_path(project_name, agent_type)
-        
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return None
-    
-    @staticmethod
-    def list_projects():
-        """List all projects"""
-        projects_dir = os.path.join(CHAT_HISTORY_DIR, 'Projects')
-        os.makedirs(projects_dir, exist_ok=True)
-        
-        projects = []
-        if os.path.exists(projects_dir):
-            for item in os.listdir(projects_dir):
-                if os.path.isdir(os.path.join(projects_dir, item)):
-                    projects.append(item)
-        
-        return sorted(projects)
-    
-    @staticmethod
-    def get_project_chats(project_name):
-        """Get all chats for a project"""
-        project_dir = os.path.join(CHAT_HISTORY_DIR, 'Projects', project_name)
-        chats = []
-        
-        if os.path.exists(project_dir):
-            for file in os.listdir(project_dir):
-                if file.endswith('.json'):
-                    agent_type = file.replace('_agent.json', '')
-                    file_path = os.path.join(project_dir, file)
-                    
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        chat_data = json.load(f)
-                        chats.append({
-                            'agent': agent_type,
-                            'last_updated': chat_data.get('last_updated'),
-                            'message_count': chat_data.get('message_count', 0)
-                        })
-        
-        return chats
-
-# Get current directory
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Get backend directory (this file lives in backend/utils)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 WEB_DIR = os.path.join(BASE_DIR, 'web')
 STATIC_DIR = os.path.join(WEB_DIR, 'static')
 TEMPLATES_DIR = os.path.join(WEB_DIR, 'templates')
 
+# Chat history (append-only logs + compacted snapshots)
+from chat_history import ChatHistoryManager, CHAT_HISTORY_DIR
+
+# Full-text search over every project's chat messages
+from chat_search import get_search_index
+search_index = get_search_index()
+
+# Enhanced agent turn logs (data/conversations/enhanced) rolled into columnar analytics
+from conversation_analytics import ConversationAnalytics
+analytics = ConversationAnalytics()
+analytics.start_background(interval=int(os.environ.get('ANALYTICS_INTERVAL', 300)))
+
+# Newest messages kept in RAM per session; older pages come from /api/chat/history
+HISTORY_WINDOW = int(os.environ.get('CHAT_HISTORY_WINDOW', 50))
+
 print(f"Base directory: {BASE_DIR}")
 print(f"Web directory: {WEB_DIR}")
 print(f"Static directory: {STATIC_DIR}")
@@ -148,6 +77,14 @@ except ImportError as e:
     print(f"⚠ Creative agent not available: {e}")
     AGENTS['creative'] = None
 
+# Shared agent prototypes - sessions get lightweight clones
+from agents.agent_pool import AgentPool
+agent_pool = AgentPool(AGENTS)
+
+# Bounded worker pool for async /api/chat jobs
+from chat_jobs import ChatJobManager, sse_events
+chat_jobs = ChatJobManager()
+
 # Agent configurations
 AGENT_CONFIGS = {
     'basic': {
@@ -193,37 +130,102 @@ Example style: "Let's create! Here's a concept: [idea]. We could develop it by:
     }
 }
 
-# Session storage
-sessions = {}
+# Session storage: idle TTL (SESSION_TTL) + LRU cap (MAX_SESSIONS), reaped in the background
+from session_store import SessionStore
+sessions = SessionStore()
+
+# Cross-process session state (Redis at REDIS_URL, in-process otherwise)
+from state_backend import SharedSessionState
+shared_state = SharedSessionState(window=HISTORY_WINDOW)
+
+# Token-bucket quotas per client IP and route, weighted by prompt + max_tokens
+from rate_limiter import get_rate_limiter, client_identity, limit_headers, limited_body, request_cost
+rate_limiter = get_rate_limiter()
+
+def chat_cost(agent_type, message):
+    """Tokens charged for a chat turn (message plus the agent's max_tokens)"""
+    return request_cost(message, AGENT_CONFIGS.get(agent_type, {}).get('max_tokens', 2000))
 
 class ChatSession:
     """Manages a chat session with project support"""
-    def __init__(self, session_id, agent_type='basic', project_name='General'):
+    def __init__(self, session_id, agent_type='basic', project_name='General', load_history=True):
         self.session_id = session_id
         self.agent_type = agent_type
         self.project_name = project_name  # NEW: Track project
-        self.messages = []
+        self.messages = []  # bounded window of the newest messages
+        self.message_count = 0  # total messages in the conversation
+        self.version = 0  # shared-state version this copy reflects
+        self._conversation_synced = (0, None)  # entries of the agent conversation in shared state, last one
         self.created_at = datetime.now()
         self.last_activity = datetime.now()
         self.agent_instance = None
+        self.lock = threading.Lock()  # one agent call at a time per session
         
         # Load existing project chat if available
-        self.load_project_history()
+        if load_history:
+            self.load_project_history()
         
-        # Try to create actual agent instance
-        if agent_type in AGENTS and AGENTS[agent_type] is not None:
+        # Clone the shared agent for this session
+        if agent_pool.is_available(agent_type):
             try:
-                self.agent_instance = AGENTS[agent_type]()
+                self.agent_instance = agent_pool.acquire(agent_type)
             except Exception as e:
                 print(f"Failed to create {agent_type} agent: {e}")
                 self.agent_instance = None
     
+    def state_meta(self):
+        """Serializable metadata shared with other worker processes"""
+        return {
+            'agent_type': self.agent_type,
+            'project_name': self.project_name,
+            'message_count': self.message_count,
+            'created_at': self.created_at.isoformat()
+        }
+    
+    def restore(self, state):
+        """Adopt state written by another worker"""
+        meta = state['meta']
+        self.messages = state['messages']
+        self.message_count = meta['message_count']
+        self.version = meta['version']
+        if meta.get('created_at'):
+            self.created_at = datetime.fromisoformat(meta['created_at'])
+        if state.get('conversation') and self.agent_instance is not None \
+                and hasattr(self.agent_instance, 'conversation'):
+            self.agent_instance.conversation = state['conversation']
+            self._conversation_synced = (len(state['conversation']), state['conversation'][-1])
+    
+    def _agent_conversation(self):
+        if self.agent_instance is not None and hasattr(self.agent_instance, 'conversation'):
+            return self.agent_instance.conversation
+        return None
+    
+    def _conversation_delta(self):
+        """Agent conversation entries not yet in shared state, and whether they replace it.
+        
+        Normally just the turn's new entries; the whole conversation if the
+        agent reset or trimmed it since the last record.
+        """
+        conversation = self._agent_conversation()
+        if conversation is None:
+            return None, False
+        count, tail = self._conversation_synced
+        self._conversation_synced = (len(conversation), conversation[-1] if conversation else None)
+        if count and len(conversation) >= count and conversation[count - 1] is tail:
+            return conversation[count:], False
+        return list(conversation), True
+    
     def load_project_history(self):
-        """Load chat history from project file"""
-        chat_data = ChatHistoryManager.load_conversation(self.project_name, self.agent_type)
-        if chat_data and chat_data.get('messages'):
-            self.messages = chat_data['messages']
-            print(f"📖 Loaded {len(self.messages)} messages from {self.project_name}/{self.agent_type}")
+        """Load the newest page of chat history from the project file"""
+        page = ChatHistoryManager.load_page(self.project_name, self.agent_type, limit=HISTORY_WINDOW)
+        self.messages = page['messages']
+        self.message_count = page['total']
+        if self.messages:
+            print(f"📖 Loaded {len(self.messages)}/{self.message_count} messages from {self.project_name}/{self.agent_type}")
+    
+    def history_page(self, before=None, limit=HISTORY_WINDOW):
+        """Older history on demand (cursor = index of the oldest message already shown)"""
+        return ChatHistoryManager.load_page(self.project_name, self.agent_type, before=before, limit=limit)
     
     def add_message(self, role, content):
         message = {
@@ -234,27 +236,46 @@ class ChatSession:
             'project': self.project_name  # Track which project
         }
         self.messages.append(message)
+        if len(self.messages) > HISTORY_WINDOW:
+            del self.messages[:-HISTORY_WINDOW]
         self.last_activity = datetime.now()
         
-        # Auto-save to project file (every 5 messages or important messages)
-        if len(self.messages) % 5 == 0 or role == 'assistant':
-            self.save_to_project()
+        # Append-only log; snapshots are compacted in the background
+        seq = ChatHistoryManager.append_message(self.project_name, self.agent_type, message)
+        search_index.add(self.project_name, self.agent_type, seq, message)
+        self.message_count = seq + 1
+        conversation, replace = self._conversation_delta() if role == 'assistant' else (None, False)
+        self.version = shared_state.record(
+            self.session_id, self.state_meta(), message=message,
+            conversation=conversation, replace=replace)
         
         return message
     
     def save_to_project(self):
-        """Save current conversation to project file"""
-        ChatHistoryManager.save_conversation(self.project_name, self.agent_type, self.messages)
+        """Compact current conversation into the project snapshot"""
+        ChatHistoryManager.compact(self.project_name, self.agent_type)
     
-    def to_dict(self):
-        return {
-            'session_id': self.session_id,
-            'agent_type': self.agent_type,
-            'project_name': self.project_name,
-            'message_count': len(self.messages),
-            'created_at': self.created_at.isoformat(),
-            'last_activity': self.last_activity.isoformat()
-        }
+    def stream_response(self, message, cancel_event=None):
+        """Yield the response in chunks (token stream when the agent supports it)"""
+        if self.agent_instance and hasattr(self.agent_instance, 'stream_message'):
+            try:
+                yield from self.agent_instance.stream_message(message, cancel_event=cancel_event)
+                return
+            except Exception as e:
+                print(f"Agent error: {e}")
+                yield f"Agent error: {str(e)[:100]}..."
+                return
+        
+        yield self.get_response(message)
+    
+    def get_response(self, message):
+        """Get response from agent or simulated"""
+        if self.agent_instance:
+            try:
+                return self.agent_instance.send_message(message)
+            except Exception as e:
+                print(f"Agent error: {e}")
+                return f"Agent error: {str(e)[:100]}..."
         
         # Fallback: Simulated response
         if self.agent_type == 'basic':
@@ -270,7 +291,8 @@ class ChatSession:
         return {
             'session_id': self.session_id,
             'agent_type': self.agent_type,
-            'message_count': len(self.messages),
+            'project_name': self.project_name,
+            'message_count': self.message_count,
             'created_at': self.created_at.isoformat(),
             'last_activity': self.last_activity.isoformat(),
             'has_real_agent': self.agent_instance is not None
@@ -278,8 +300,20 @@ class ChatSession:
 
 def get_session(session_id=None, agent_type='basic'):
     """Get or create a session"""
-    if session_id and session_id in sessions:
-        session = sessions[session_id]
+    session = sessions.get(session_id) if session_id else None
+    if session_id:
+        # Another worker may have served this session since we last saw it
+        version = shared_state.version(session_id)
+        if version is not None and (session is None or session.version != version):
+            state = shared_state.load(session_id)
+            if state:
+                if session is None:
+                    session = ChatSession(session_id, state['meta'].get('agent_type', agent_type),
+                                          state['meta'].get('project_name', 'General'),
+                                          load_history=False)
+                session.restore(state)
+                sessions[session_id] = session
+    if session:
         session.last_activity = datetime.now()
         return session
     
@@ -289,20 +323,9 @@ def get_session(session_id=None, agent_type='basic'):
     
     session = ChatSession(session_id, agent_type)
     sessions[session_id] = session
+    session.version = shared_state.record(session_id, session.state_meta())
     return session
 
-def cleanup_sessions():
-    """Remove inactive sessions (older than 1 hour)"""
-    now = datetime.now()
-    to_remove = []
-    
-    for session_id, session in sessions.items():
-        if (now - session.last_activity).seconds > 3600:
-            to_remove.append(session_id)
-    
-    for session_id in to_remove:
-        del sessions[session_id]
-
 # ===== ROUTES =====
 
 @app.route('/')
@@ -319,7 +342,6 @@ def test_page():
 @app.route('/debug')
 def debug_info():
     """Debug information"""
-    cleanup_sessions()
     return jsonify({
         'status': 'running',
         'paths': {
@@ -330,11 +352,13 @@ def debug_info():
         },
         'agents': {
             'available': list(AGENT_CONFIGS.keys()),
-            'loaded': {k: v is not None for k, v in AGENTS.items()}
+            'loaded': {k: v is not None for k, v in AGENTS.items()},
+            'pool': agent_pool.stats()
         },
         'sessions': {
             'count': len(sessions),
-            'active': list(sessions.keys())
+            'active': list(sessions.keys()),
+            'store': sessions.stats()
         },
         'timestamp': datetime.now().isoformat()
     })
@@ -342,13 +366,15 @@ def debug_info():
 @app.route('/api/health')
 def health_check():
     """Health check endpoint"""
-    cleanup_sessions()
     return jsonify({
         'status': 'healthy',
         'message': 'Deepseek Web Interface is operational',
         'version': '1.0.0',
         'available_agents': list(AGENT_CONFIGS.keys()),
         'active_sessions': len(sessions),
+        'session_store': sessions.stats(),
+        'chat_jobs': chat_jobs.stats(),
+        'rate_limits': rate_limiter.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
@@ -373,24 +399,40 @@ def chat():
         if not message:
             return jsonify({'error': 'Message cannot be empty'}), 400
         
+        identity = client_identity(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        decision = rate_limiter.hit('chat', identity, chat_cost(agent_type, message))
+        if not decision.allowed:
+            return jsonify(limited_body(decision)), 429, limit_headers(decision)
+        
         # Get or create session
         session = get_session(session_id, agent_type)
         
         # Add user message
         session.add_message('user', message)
         
+        # Async mode: hand the agent call to the worker pool and return a job handle
+        if data.get('async') or request.args.get('async'):
+            job = chat_jobs.submit(session, message,
+                                   on_complete=reply_recorder(identity, decision, message))
+            return jsonify({
+                'job_id': job.job_id,
+                'status': job.status,
+                'session_id': session.session_id,
+                'agent_type': agent_type,
+                'status_url': f"/api/chat/jobs/{job.job_id}",
+                'stream_url': f"/api/chat/jobs/{job.job_id}/stream",
+                'success': True
+            }), 202
+        
         # Get response with timing
         start_time = time.time()
-        response = session.get_response(message)
+        with session.lock:
+            response = session.get_response(message)
         elapsed = time.time() - start_time
         
-        # Simulate processing time if too fast
-        if elapsed < 0.5:
-            time.sleep(0.5 - elapsed)
-            elapsed = 0.5
-        
         # Add assistant response
         session.add_message('assistant', response)
+        rate_limiter.settle('chat', identity, decision, message, response)
         
         return jsonify({
             'response': response,
@@ -413,10 +455,91 @@ def chat():
             'success': False
         }), 500
 
+def record_job_reply(session, job):
+    """Store a finished background reply in the session history"""
+    if job.response:
+        session.add_message('assistant', job.response)
+
+def reply_recorder(identity, decision, message):
+    """on_complete for a chat job: record the reply and refund its unused tokens"""
+    def on_complete(session, job):
+        record_job_reply(session, job)
+        rate_limiter.settle('chat', identity, decision, message, job.response or '')
+    return on_complete
+
+@app.route('/api/rate-limits')
+def rate_limit_stats():
+    """Limiter configuration and allowed/limited counters (this worker)"""
+    return jsonify(rate_limiter.stats())
+
+@app.route('/api/chat/jobs/<job_id>')
+def chat_job_status(job_id):
+    """Poll a chat job; pass ?since=<next> to get only new text"""
+    job = chat_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(since=request.args.get('since', 0, type=int)))
+
+@app.route('/api/chat/jobs/<job_id>/stream')
+def chat_job_stream(job_id):
+    """Stream a chat job's tokens as Server-Sent Events"""
+    job = chat_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(sse_events(job, since=request.args.get('since', 0, type=int)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/jobs/<job_id>/cancel', methods=['POST'])
+def chat_job_cancel(job_id):
+    """Cancel a queued or running chat job"""
+    job = chat_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': job.status, 'cancel_requested': True})
+
+@app.route('/api/projects')
+def list_projects():
+    """List chat projects (manifest lookup, no history parsing)"""
+    return jsonify({'projects': ChatHistoryManager.list_projects()})
+
+@app.route('/api/projects/<project_name>/chats')
+def project_chats(project_name):
+    """Chats in a project with last_updated and message_count"""
+    return jsonify({'project': project_name, 'chats': ChatHistoryManager.get_project_chats(project_name)})
+
+@app.route('/api/search')
+def search_history():
+    """Ranked full-text search: ?q=&project=&agent_type=&limit="""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query cannot be empty'}), 400
+    return jsonify(search_index.search(query,
+                                       limit=min(request.args.get('limit', 10, type=int), 100),
+                                       project_name=request.args.get('project'),
+                                       agent_type=request.args.get('agent_type')))
+
+@app.route('/api/chat/history')
+def chat_history():
+    """Paginated history, newest first: ?session_id= or ?project=&agent_type=, then ?before=<next_cursor>&limit="""
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', HISTORY_WINDOW, type=int), 500)
+    
+    session_id = request.args.get('session_id')
+    if session_id:
+        session = sessions.get(session_id)
+        if not session:
+            return jsonify({'error': 'Session not found'}), 404
+        page = session.history_page(before=before, limit=limit)
+    else:
+        page = ChatHistoryManager.load_page(request.args.get('project', 'General'),
+                                            request.args.get('agent_type', 'basic'),
+                                            before=before, limit=limit)
+    return jsonify(page)
+
 @app.route('/api/sessions')
 def list_sessions():
     """List all active sessions"""
-    cleanup_sessions()
     return jsonify({
         'sessions': [session.to_dict() for session in sessions.values()],
         'count': len(sessions)
@@ -499,11 +622,12 @@ if __name__ == '__main__':
     print("   • Test LM Studio:  http://localhost:5000/api/test-lm")
     print("   • List Sessions:   http://localhost:5000/api/sessions")
     print("   • Test Echo:       POST http://localhost:5000/api/echo")
+    print("\n💡 Production: python asgi_server.py (async /api/chat + /ai/generate)")
     print("\n🔄 Starting server...")
     print("=" * 70)
     
     try:
-        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+        app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
     except Exception as e:
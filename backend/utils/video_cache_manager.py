@@ -1,47 +1,150 @@
 import os
 import json
-import hashlib
+import copy
+import atexit
+import threading
+import weakref
 from datetime import datetime, timedelta
 import shutil
 import subprocess
 
+try:
+    from persistence import read_json, write_json, file_lock
+    from ffmpeg_scheduler import get_scheduler
+    from hls_output import hls_command, start_hls, wait_playable, hls_info, hls_size, hls_status, HLS_SEGMENT_SECONDS
+    from media_store import params_hash, remove_path
+    from content_hash import file_digest
+except ImportError:
+    from utils.persistence import read_json, write_json, file_lock
+    from utils.ffmpeg_scheduler import get_scheduler
+    from utils.hls_output import hls_command, start_hls, wait_playable, hls_info, hls_size, hls_status, HLS_SEGMENT_SECONDS
+    from utils.media_store import params_hash, remove_path
+    from utils.content_hash import file_digest
+
+# Web playback rendition (part of the shared file's identity in the media store)
+WEB_PARAMS = {'vcodec': 'libx264', 'preset': 'fast', 'crf': 23, 'scale': '-2:720',
+              'acodec': 'aac', 'abitrate': '128k'}
+# Streams browsers play as-is in MP4: copied instead of re-encoded (WEB_REMUX=0 to always transcode)
+REMUX_ENABLED = os.environ.get('WEB_REMUX', '1') != '0'
+COPY_VIDEO_CODECS = ('h264',)
+COPY_PIX_FMTS = ('yuv420p', 'yuvj420p')
+COPY_AUDIO_CODECS = ('aac',)
+HLS_WEB_PARAMS = dict(WEB_PARAMS, format='hls-fmp4', segment=HLS_SEGMENT_SECONDS)
+
+def plan_web_conversion(streams):
+    """Pick how to make a web version from ffprobe streams.
+
+    'remux': H.264 (8-bit 4:2:0, <= 720p) and AAC/no audio, streams copied
+    'audio': video copyable, audio re-encoded to AAC
+    'transcode': video re-encoded (the old path for everything)
+    """
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    decision = {'mode': 'transcode', 'video': 'libx264', 'audio': 'aac' if audio else None,
+                'source_video': video.get('codec_name') if video else None,
+                'source_audio': audio.get('codec_name') if audio else None}
+    if not REMUX_ENABLED or video is None:
+        decision['reason'] = 'remux disabled' if not REMUX_ENABLED else 'no video stream'
+        return decision
+
+    try:
+        width, height = int(video.get('width') or 0), int(video.get('height') or 0)
+    except (TypeError, ValueError):
+        width = height = 0
+    if not width or not height:
+        decision['reason'] = 'frame size unknown'
+    elif video.get('codec_name') not in COPY_VIDEO_CODECS:
+        decision['reason'] = f"video codec {video.get('codec_name')}"
+    elif video.get('pix_fmt') not in COPY_PIX_FMTS:
+        decision['reason'] = f"pixel format {video.get('pix_fmt')}"
+    elif min(width, height) > 720 or max(width, height) > 1280:
+        decision['reason'] = f"{width}x{height} above 720p"
+    else:
+        decision['video'] = 'copy'
+        if audio is None or audio.get('codec_name') in COPY_AUDIO_CODECS:
+            decision.update(mode='remux', audio='copy' if audio else None,
+                            reason='streams already web-compatible')
+        else:
+            decision.update(mode='audio', reason=f"audio codec {audio.get('codec_name')}")
+    return decision
+
+
+_managers = weakref.WeakSet()  # flushed at exit
+
+
+@atexit.register
+def _flush_managers():
+    for manager in list(_managers):
+        manager.flush_cache_index()
+
+
 class CacheManager:
-    def __init__(self, cache_dir, max_size_gb=10):
+    def __init__(self, cache_dir, max_size_gb=10, store=None):
         self.cache_dir = cache_dir
+        self.store = store  # MediaStore: cached versions shared across sessions by content
+        self.runner = None  # optional runner(command, timeout) -> bool, e.g. a job with progress
         self.max_size_bytes = max_size_gb * 1024 * 1024 * 1024
         self.cache_index = self.load_cache_index()
+        self._saved_index = copy.deepcopy(self.cache_index)  # as last read/written, to find our changes
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        _managers.add(self)
     
     def load_cache_index(self):
         """Load cache index from file"""
         index_file = os.path.join(self.cache_dir, 'cache_index.json')
-        if os.path.exists(index_file):
-            try:
-                with open(index_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+        try:
+            return read_json(index_file, default={}, copy_result=True)
+        except:
+            return {}
     
     def save_cache_index(self):
         """Save cache index to file"""
+        # Coalesced: last_accessed bumps on every hit would otherwise rewrite it each request
+        with self._save_lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(1.0, self.flush_cache_index)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+    
+    def flush_cache_index(self):
+        """Merge our changes into cache_index.json under a file lock.
+        
+        Job workers in other processes write the same index; entries they
+        added stay and are picked up here.
+        """
         index_file = os.path.join(self.cache_dir, 'cache_index.json')
-        with open(index_file, 'w') as f:
-            json.dump(self.cache_index, f, indent=2)
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            with file_lock(index_file):
+                try:
+                    merged = read_json(index_file, default={}, copy_result=True)
+                except Exception:
+                    merged = {}
+                removed = set(self._saved_index) - set(self.cache_index)
+                changed = {key: info for key, info in self.cache_index.items()
+                           if self._saved_index.get(key) != info}
+                for key in removed:
+                    merged.pop(key, None)
+                merged.update(changed)
+                if removed or changed:
+                    write_json(index_file, merged)
+            self.cache_index.clear()
+            self.cache_index.update(merged)
+            self._saved_index = copy.deepcopy(merged)
     
     def get_file_hash(self, file_path):
-        """Generate hash for file"""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            buf = f.read(65536)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = f.read(65536)
-        return hasher.hexdigest()
+        """Content hash of a file, with the same algorithm the upload routes use"""
+        return file_digest(file_path)['digest']
     
-    def create_cached_version(self, original_path, session_id):
-        """Create cached version of video for web playback"""
+    def create_cached_version(self, original_path, session_id, file_hash=None, file_size=None):
+        """Create cached version of video for web playback (file_hash/file_size from the upload skip re-reading it)"""
         # Generate cache key
-        file_hash = self.get_file_hash(original_path)
+        file_hash = file_hash or self.get_file_hash(original_path)
+        if self.store is not None:
+            return self.create_shared_version(original_path, session_id, file_hash, file_size)
         cache_key = f"{session_id}_{file_hash}"
         
         # Check if already cached
@@ -57,7 +160,9 @@ class CacheManager:
         cached_path = os.path.join(self.cache_dir, cached_filename)
         
         # Convert video for web
-        self.convert_for_web(original_path, cached_path)
+        decision = self.plan_conversion(original_path)
+        if not self.convert_for_web(original_path, cached_path, decision):
+            decision = dict(decision, mode='copy-original', reason='conversion failed')
         
         # Get video info
         video_info = self.get_video_info(cached_path)
@@ -69,12 +174,14 @@ class CacheManager:
             'web_path': f"/static/uploads/cache/{cached_filename}",
             'session_id': session_id,
             'file_hash': file_hash,
+            'original_size': file_size if file_size is not None else os.path.getsize(original_path),
             'created': datetime.now().isoformat(),
             'last_accessed': datetime.now().isoformat(),
             'size': os.path.getsize(cached_path),
             'duration': video_info['duration'],
             'resolution': video_info['resolution'],
-            'file_size': video_info['file_size']
+            'file_size': video_info['file_size'],
+            'conversion': decision
         }
         
         self.cache_index[cache_key] = cached_info
@@ -85,13 +192,124 @@ class CacheManager:
         
         return cached_info
     
-    def convert_for_web(self, input_path, output_path):
-        """Convert video to web-friendly format"""
+    def create_shared_version(self, original_path, session_id, file_hash, file_size=None):
+        """Cached version keyed by content + WEB_PARAMS; sessions share one file"""
+        decided = {}  # stored with the rendition, so whoever reuses it knows how it was made
+        
+        def create(out):
+            decision = decided['conversion'] = self.plan_conversion(original_path)
+            if self.convert_for_web(original_path, out, decision):
+                return True
+            decided['conversion'] = dict(decision, mode='copy-original', reason='conversion failed')
+            return os.path.exists(out)
+        
+        cached_path = self.store.rendition(file_hash, 'web', WEB_PARAMS, session_id, self.cache_dir, create,
+                                           meta=decided)
+        if cached_path is None:
+            return None
+        
+        cached_filename = os.path.basename(cached_path)
+        cache_key = os.path.splitext(cached_filename)[0]
+        cached_info = self.cache_index.get(cache_key)
+        if cached_info is None:
+            video_info = self.get_video_info(cached_path) or {}
+            cached_info = {
+                'original_path': original_path,
+                'path': cached_path,
+                'web_path': f"/static/uploads/cache/{cached_filename}",
+                'session_id': session_id,
+                'sessions': [],
+                'file_hash': file_hash,
+                'original_size': file_size if file_size is not None else os.path.getsize(original_path),
+                'created': datetime.now().isoformat(),
+                'size': os.path.getsize(cached_path),
+                'duration': video_info.get('duration', 0),
+                'resolution': video_info.get('resolution', 'Unknown'),
+                'file_size': video_info.get('file_size', 0),
+                # Made by another process: its decision was stored with the rendition
+                'conversion': decided.get('conversion')
+                or (self.store.rendition_meta(file_hash, 'web', WEB_PARAMS) or {}).get('conversion')
+                or {'mode': 'unknown', 'reason': 'created before conversions were recorded'}
+            }
+            self.cache_index[cache_key] = cached_info
+        
+        if session_id not in cached_info['sessions']:
+            cached_info['sessions'].append(session_id)
+        cached_info['last_accessed'] = datetime.now().isoformat()
+        self.save_cache_index()
+        self.cleanup_cache()
+        return cached_info
+    
+    def create_hls_version(self, original_path, session_id, file_hash=None, wait=10):
+        """Web playback version as progressive HLS; returns once the first segment is playable"""
+        file_hash = file_hash or self.get_file_hash(original_path)
+        cache_key = f"{file_hash}_{params_hash(HLS_WEB_PARAMS)}"
+        out_dir = os.path.join(self.cache_dir, 'hls', cache_key)
+        os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+        p = WEB_PARAMS
+        command = hls_command(
+            original_path, out_dir,
+            video_args=['-c:v', p['vcodec'], '-preset', p['preset'], '-crf', str(p['crf']),
+                        '-vf', f"scale={p['scale']}"],
+            audio_args=['-c:a', p['acodec'], '-b:a', p['abitrate']])
+        
+        def finished(ok):
+            # Sizes recorded below are from while it was still being written
+            if not ok:
+                return
+            if self.store is not None:
+                self.store.refresh_size(out_dir)
+            if cache_key in self.cache_index:
+                self.cache_index[cache_key]['size'] = hls_size(out_dir)
+                self.save_cache_index()
+        
+        start_hls(out_dir, command, lambda cmd, timeout: self.run_ffmpeg(cmd, timeout=timeout), on_done=finished)
+        if self.store is not None:
+            self.store.register_output(file_hash, 'web-hls', HLS_WEB_PARAMS, session_id, out_dir)
+        if not wait_playable(out_dir, wait) and hls_status(out_dir) in ('failed', 'missing'):
+            return None
+        
+        info = hls_info(out_dir, '/static/uploads/cache/hls')
+        cached_info = self.cache_index.setdefault(cache_key, {
+            'original_path': original_path,
+            'path': out_dir,
+            'web_path': info['playlist_url'],
+            'format': 'hls',
+            'session_id': session_id,
+            'sessions': [],
+            'file_hash': file_hash,
+            'created': datetime.now().isoformat()
+        })
+        if session_id not in cached_info['sessions']:
+            cached_info['sessions'].append(session_id)
+        cached_info['size'] = hls_size(out_dir)
+        cached_info['last_accessed'] = datetime.now().isoformat()
+        self.save_cache_index()
+        self.cleanup_cache()
+        return {**cached_info, **info}
+    
+    def run_ffmpeg(self, command, timeout=None):
+        """Run an ffmpeg command (job runner if set, else the machine-wide scheduler); True on success"""
+        if self.runner is not None:
+            return self.runner(command, timeout=timeout)
+        return get_scheduler().run(command, kind='cache', timeout=timeout)
+    
+    def plan_conversion(self, input_path):
+        """Probe input_path and decide remux / audio-only / full transcode"""
         try:
-            ext = os.path.splitext(input_path)[1].lower()
-            
-            # For ALL formats, use re-encoding (simpler and more compatible)
-            command = [
+            result = subprocess.run(['ffprobe', '-v', 'quiet', '-show_streams', '-print_format', 'json',
+                                     input_path], capture_output=True, text=True, timeout=10)
+            streams = json.loads(result.stdout or '{}').get('streams', [])
+        except (subprocess.SubprocessError, ValueError, OSError) as e:
+            print(f"Probe error: {e}")
+            streams = []
+        return plan_web_conversion(streams)
+    
+    def convert_for_web(self, input_path, output_path, decision=None):
+        """Convert video to web-friendly format (stream copy when the codecs allow it)"""
+        try:
+            decision = decision or self.plan_conversion(input_path)
+            transcode = [
                 'ffmpeg', '-i', input_path,
                 '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
                 '-c:a', 'aac', '-b:a', '128k',
@@ -100,7 +318,21 @@ class CacheManager:
                 '-y', output_path
             ]
             
-            subprocess.run(command, check=True, capture_output=True, text=True, timeout=300)
+            if decision['mode'] != 'transcode':
+                # Seconds of I/O instead of minutes of CPU
+                audio = ['-c:a', 'copy'] if decision['audio'] == 'copy' else ['-c:a', 'aac', '-b:a', '128k']
+                command = ['ffmpeg', '-i', input_path, '-map', '0:v:0', '-map', '0:a:0?',
+                           '-c:v', 'copy', *audio, '-movflags', '+faststart', '-y', output_path]
+                print(f"⚡ Web version by {decision['mode']}: {decision['reason']}")
+                if self.run_ffmpeg(command, timeout=300):
+                    return True
+                # e.g. timestamps the MP4 muxer rejects: re-encode after all
+                print(f"{decision['mode']} failed, transcoding instead")
+                decision.update(mode='transcode', video='libx264', audio='aac' if decision['audio'] else None,
+                                reason=f"{decision['mode']} failed")
+            
+            if not self.run_ffmpeg(transcode, timeout=300):
+                raise RuntimeError("ffmpeg failed")
             return True
             
         except Exception as e:
@@ -166,10 +398,14 @@ class CacheManager:
         # Remove oldest items until under limit
         while total_size > self.max_size_bytes and cache_items:
             cache_key, cache_info = cache_items.pop(0)
+            if cache_info.get('format') == 'hls' and hls_status(cache_info['path']) == 'encoding':
+                continue  # someone may be watching it being written
             
-            # Remove file
+            # Remove file (or HLS directory)
             if os.path.exists(cache_info['path']):
-                os.remove(cache_info['path'])
+                remove_path(cache_info['path'])
+            if self.store is not None:
+                self.store.forget(cache_info['path'])
             
             # Remove from index
             del self.cache_index[cache_key]
@@ -179,11 +415,20 @@ class CacheManager:
     
     def clean_session_cache(self, session_id):
         """Clear cache for specific session"""
+        if self.store is not None:
+            # Shared files go only when their last session releases them
+            self.store.release_session(session_id, kinds=('web', 'web-hls'))
+        
         to_remove = []
         for cache_key, cache_info in self.cache_index.items():
-            if cache_info['session_id'] == session_id:
+            if 'sessions' in cache_info:
+                if session_id in cache_info['sessions']:
+                    cache_info['sessions'].remove(session_id)
+                if not os.path.exists(cache_info['path']):
+                    to_remove.append(cache_key)
+            elif cache_info['session_id'] == session_id:
                 if os.path.exists(cache_info['path']):
-                    os.remove(cache_info['path'])
+                    remove_path(cache_info['path'])
                 to_remove.append(cache_key)
         
         for key in to_remove:
@@ -201,4 +446,5 @@ class CacheManager:
             'num_files': num_files,
             'max_size': self.max_size_bytes,
             'usage_percent': (total_size / self.max_size_bytes) * 100
-        }
\ No newline at end of file
+        }
+
@@ -5,6 +5,11 @@ from datetime import datetime
 import subprocess
 from moviepy.editor import VideoFileClip
 
+try:
+    from ffmpeg_scheduler import get_scheduler
+except ImportError:
+    from utils.ffmpeg_scheduler import get_scheduler
+
 class VideoProcessor:
     def __init__(self):
         self.supported_formats = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv']
@@ -48,7 +53,8 @@ class VideoProcessor:
                 '-y', output_path
             ]
             
-            subprocess.run(command, check=True, capture_output=True)
+            if not get_scheduler().run(command, kind='clip'):
+                raise RuntimeError("ffmpeg failed")
             return True
         except Exception as e:
             print(f"Error converting video: {e}")
@@ -9,8 +9,9 @@ import sys
 import uuid
 import json
 import time
+import threading
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 
 # Add src to path to try importing agents
@@ -48,6 +49,15 @@ except ImportError as e:
     print(f"⚠ Creative agent not available: {e}")
     AGENTS['creative'] = None
 
+# Shared agent prototypes - sessions get lightweight clones
+from agents.agent_pool import AgentPool
+agent_pool = AgentPool(AGENTS)
+
+# Bounded worker pool for async /api/chat jobs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from chat_jobs import ChatJobManager, sse_events
+chat_jobs = ChatJobManager()
+
 # Agent configurations
 AGENT_CONFIGS = {
     'basic': {
@@ -76,8 +86,21 @@ AGENT_CONFIGS = {
     }
 }
 
-# Session storage
-sessions = {}
+# Session storage: idle TTL (SESSION_TTL) + LRU cap (MAX_SESSIONS), reaped in the background
+from session_store import SessionStore
+sessions = SessionStore()
+
+# Cross-process session state (Redis at REDIS_URL, in-process otherwise)
+from state_backend import SharedSessionState
+shared_state = SharedSessionState(window=100)
+
+# Token-bucket quotas per client IP, weighted by message + the agent's max_tokens
+from rate_limiter import get_rate_limiter, client_identity, limit_headers, limited_body, request_cost
+rate_limiter = get_rate_limiter()
+
+def chat_cost(agent_type, message):
+    """Tokens charged for a chat turn (message plus the agent's max_tokens)"""
+    return request_cost(message, AGENT_CONFIGS.get(agent_type, {}).get('max_tokens', 2000))
 
 class ChatSession:
     """Manages a chat session"""
@@ -85,19 +108,60 @@ class ChatSession:
         self.session_id = session_id
         self.agent_type = agent_type
         self.messages = []
+        self.message_count = 0
+        self.version = 0  # shared-state version this copy reflects
+        self._conversation_synced = (0, None)  # entries of the agent conversation in shared state, last one
         self.created_at = datetime.now()
         self.last_activity = datetime.now()
         self.agent_instance = None
+        self.lock = threading.Lock()  # one agent call at a time per session
         
-        # Try to create actual agent instance
-        if agent_type in AGENTS and AGENTS[agent_type] is not None:
+        # Clone the shared agent for this session
+        if agent_pool.is_available(agent_type):
             try:
-                self.agent_instance = AGENTS[agent_type]()
+                self.agent_instance = agent_pool.acquire(agent_type)
                 print(f"Created {agent_type} agent instance for session {session_id[:8]}")
             except Exception as e:
                 print(f"Failed to create {agent_type} agent: {e}")
                 self.agent_instance = None
     
+    def state_meta(self):
+        """Serializable metadata shared with other worker processes"""
+        return {
+            'agent_type': self.agent_type,
+            'message_count': self.message_count,
+            'created_at': self.created_at.isoformat()
+        }
+    
+    def restore(self, state):
+        """Adopt state written by another worker"""
+        meta = state['meta']
+        self.messages = state['messages']
+        self.message_count = meta['message_count']
+        self.version = meta['version']
+        if meta.get('created_at'):
+            self.created_at = datetime.fromisoformat(meta['created_at'])
+        if state.get('conversation') and self.agent_instance is not None \
+                and hasattr(self.agent_instance, 'conversation'):
+            self.agent_instance.conversation = state['conversation']
+            self._conversation_synced = (len(state['conversation']), state['conversation'][-1])
+    
+    def _agent_conversation(self):
+        if self.agent_instance is not None and hasattr(self.agent_instance, 'conversation'):
+            return self.agent_instance.conversation
+        return None
+    
+    def _conversation_delta(self):
+        """Agent conversation entries not yet in shared state, and whether they replace it"""
+        conversation = self._agent_conversation()
+        if conversation is None:
+            return None, False
+        count, tail = self._conversation_synced
+        self._conversation_synced = (len(conversation), conversation[-1] if conversation else None)
+        if count and len(conversation) >= count and conversation[count - 1] is tail:
+            return conversation[count:], False
+        return list(conversation), True
+    
     def add_message(self, role, content):
         message = {
             'role': role,
@@ -111,9 +175,27 @@ class ChatSession:
         # Keep only last 100 messages
         if len(self.messages) > 100:
             self.messages = self.messages[-100:]
+        self.message_count += 1
+        conversation, replace = self._conversation_delta() if role == 'assistant' else (None, False)
+        self.version = shared_state.record(
+            self.session_id, self.state_meta(), message=message,
+            conversation=conversation, replace=replace)
         
         return message
     
+    def stream_response(self, message, cancel_event=None):
+        """Yield the response in chunks (token stream when the agent supports it)"""
+        if self.agent_instance and hasattr(self.agent_instance, 'stream_message'):
+            try:
+                yield from self.agent_instance.stream_message(message, cancel_event=cancel_event)
+                return
+            except Exception as e:
+                print(f"Agent error: {e}")
+                yield f"Agent error: {str(e)[:100]}..."
+                return
+        
+        yield self.get_response(message)
+    
     def get_response(self, message):
         """Get response from agent or simulated"""
         if self.agent_instance:
@@ -167,7 +249,7 @@ The canvas is blank, and the brush is in your hands! 🎨"""
         return {
             'session_id': self.session_id,
             'agent_type': self.agent_type,
-            'message_count': len(self.messages),
+            'message_count': self.message_count,
             'created_at': self.created_at.isoformat(),
             'last_activity': self.last_activity.isoformat(),
             'has_real_agent': self.agent_instance is not None
@@ -175,8 +257,18 @@ The canvas is blank, and the brush is in your hands! 🎨"""
 
 def get_session(session_id=None, agent_type='basic'):
     """Get or create a session"""
-    if session_id and session_id in sessions:
-        session = sessions[session_id]
+    session = sessions.get(session_id) if session_id else None
+    if session_id:
+        # Another worker may have served this session since we last saw it
+        version = shared_state.version(session_id)
+        if version is not None and (session is None or session.version != version):
+            state = shared_state.load(session_id)
+            if state:
+                if session is None:
+                    session = ChatSession(session_id, state['meta'].get('agent_type', agent_type))
+                session.restore(state)
+                sessions[session_id] = session
+    if session:
         session.last_activity = datetime.now()
         return session
     
@@ -186,20 +278,9 @@ def get_session(session_id=None, agent_type='basic'):
     
     session = ChatSession(session_id, agent_type)
     sessions[session_id] = session
+    session.version = shared_state.record(session_id, session.state_meta())
     return session
 
-def cleanup_sessions():
-    """Remove inactive sessions (older than 1 hour)"""
-    now = datetime.now()
-    to_remove = []
-    
-    for session_id, session in sessions.items():
-        if (now - session.last_activity).seconds > 3600:
-            to_remove.append(session_id)
-    
-    for session_id in to_remove:
-        del sessions[session_id]
-
 # Routes
 @app.route('/')
 def index():
@@ -214,24 +295,27 @@ def test():
 @app.route('/debug')
 def debug():
     """Debug information"""
-    cleanup_sessions()
     return jsonify({
         'sessions': len(sessions),
         'session_ids': list(sessions.keys()),
+        'session_store': sessions.stats(),
         'agent_configs': list(AGENT_CONFIGS.keys()),
         'agents_loaded': {k: v is not None for k, v in AGENTS.items()},
+        'agent_pool': agent_pool.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/health')
 def health():
     """Health check endpoint"""
-    cleanup_sessions()
     return jsonify({
         'status': 'running',
         'message': 'Deepseek Web Interface is operational',
         'available_agents': list(AGENT_CONFIGS.keys()),
         'active_sessions': len(sessions),
+        'session_store': sessions.stats(),
+        'chat_jobs': chat_jobs.stats(),
+        'rate_limits': rate_limiter.stats(),
         'real_agents_loaded': {k: v is not None for k, v in AGENTS.items()},
         'timestamp': datetime.now().isoformat()
     })
@@ -257,24 +341,40 @@ def chat():
         if not message:
             return jsonify({'error': 'Message cannot be empty'}), 400
         
+        identity = client_identity(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        decision = rate_limiter.hit('chat', identity, chat_cost(agent_type, message))
+        if not decision.allowed:
+            return jsonify(limited_body(decision)), 429, limit_headers(decision)
+        
         # Get or create session
         session = get_session(session_id, agent_type)
         
         # Add user message
         session.add_message('user', message)
         
+        # Async mode: hand the agent call to the worker pool and return a job handle
+        if data.get('async') or request.args.get('async'):
+            job = chat_jobs.submit(session, message,
+                                   on_complete=reply_recorder(identity, decision, message))
+            return jsonify({
+                'job_id': job.job_id,
+                'status': job.status,
+                'session_id': session.session_id,
+                'agent_type': agent_type,
+                'status_url': f"/api/chat/jobs/{job.job_id}",
+                'stream_url': f"/api/chat/jobs/{job.job_id}/stream",
+                'success': True
+            }), 202
+        
         # Get response
         start_time = time.time()
-        response = session.get_response(message)
+        with session.lock:
+            response = session.get_response(message)
         elapsed = time.time() - start_time
         
-        # Simulate processing time if too fast
-        if elapsed < 0.5:
-            time.sleep(0.5 - elapsed)
-            elapsed = 0.5
-        
         # Add assistant response
         session.add_message('assistant', response)
+        rate_limiter.settle('chat', identity, decision, message, response)
         
         return jsonify({
             'response': response,
@@ -295,10 +395,47 @@ def chat():
             'success': False
         }), 500
 
+def record_job_reply(session, job):
+    """Store a finished background reply in the session history"""
+    if job.response:
+        session.add_message('assistant', job.response)
+
+def reply_recorder(identity, decision, message):
+    """on_complete for a chat job: record the reply and refund its unused tokens"""
+    def on_complete(session, job):
+        record_job_reply(session, job)
+        rate_limiter.settle('chat', identity, decision, message, job.response or '')
+    return on_complete
+
+@app.route('/api/chat/jobs/<job_id>')
+def chat_job_status(job_id):
+    """Poll a chat job; pass ?since=<next> to get only new text"""
+    job = chat_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(since=request.args.get('since', 0, type=int)))
+
+@app.route('/api/chat/jobs/<job_id>/stream')
+def chat_job_stream(job_id):
+    """Stream a chat job's tokens as Server-Sent Events"""
+    job = chat_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(sse_events(job, since=request.args.get('since', 0, type=int)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat/jobs/<job_id>/cancel', methods=['POST'])
+def chat_job_cancel(job_id):
+    """Cancel a queued or running chat job"""
+    job = chat_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': job.status, 'cancel_requested': True})
+
 @app.route('/api/sessions')
 def list_sessions():
     """List all active sessions"""
-    cleanup_sessions()
     return jsonify({
         'sessions': [session.to_dict() for session in sessions.values()],
         'count': len(sessions)
@@ -356,4 +493,4 @@ if __name__ == '__main__':
     print("  • Test LM Studio: http://localhost:5000/api/test-lm")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False)
\ No newline at end of file